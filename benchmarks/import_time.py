@@ -0,0 +1,165 @@
+"""
+Checks that importing the pipeline modules and running the scripts with --help
+stay fast, which means none of the heavy frameworks is imported before a stage
+actually needs it. Exits with an error when an import pulls in a heavy framework
+or takes longer than the budget.
+
+    python benchmarks/import_time.py --budget 1.0
+    python benchmarks/import_time.py --check-tables
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported by the stages that use them, never at startup
+HEAVY_MODULES = (
+    "torch",
+    "torchaudio",
+    "whisperx",
+    "faster_whisper",
+    "ctranslate2",
+    "pyannote",
+    "nemo",
+    "demucs",
+    "ctc_forced_aligner",
+    "transformers",
+    "onnxruntime",
+    "optimum",
+    "nltk",
+    "omegaconf",
+    "wget",
+    "pydub",
+)
+
+MODULES = (
+    "languages",
+    "model_store",
+    "helpers",
+    "transcript",
+    "transcript_writers",
+    "stage_cache",
+    "stage_profiler",
+    "punctuation",
+    "transcription_helpers",
+    "pipeline",
+    "streaming",
+    "long_audio",
+)
+
+SCRIPTS = (
+    "diarize.py",
+    "diarize_parallel.py",
+    "diarize_stream.py",
+    "diarize_server.py",
+    "diarize_client.py",
+    "nemo_process.py",
+    "prefetch_models.py",
+)
+
+
+def run_importtime(args):
+    """Run python with `-X importtime`, returns the wall time and imported modules."""
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"python {' '.join(args)} failed:\n{completed.stderr[-2000:]}"
+        )
+    imported = set()
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            if name != "imported package":
+                imported.add(name.split(".")[0])
+    return wall, imported
+
+
+def measure(args, baseline: float, repeat: int):
+    """Fastest wall time of `repeat` runs on top of the interpreter's own startup."""
+    walls, imported = [], set()
+    for _ in range(repeat):
+        wall, imported = run_importtime(args)
+        walls.append(wall)
+    return max(0.0, min(walls) - baseline), imported
+
+
+def check_tables():
+    """Compare the static language tables with the installed whisperx, if any."""
+    try:
+        from whisperx.alignment import (
+            DEFAULT_ALIGN_MODELS_HF,
+            DEFAULT_ALIGN_MODELS_TORCH,
+        )
+        from whisperx.utils import LANGUAGES, TO_LANGUAGE_CODE
+    except ImportError:
+        print("whisperx is not installed, the language tables weren't checked")
+        return []
+
+    sys.path.insert(0, REPO_DIR)
+    import languages
+
+    problems = []
+    for code, language in LANGUAGES.items():
+        if languages.LANGUAGES.get(code) != language:
+            problems.append(f"LANGUAGES[{code!r}] should be {language!r}")
+    for language, code in TO_LANGUAGE_CODE.items():
+        if languages.TO_LANGUAGE_CODE.get(language) != code:
+            problems.append(f"TO_LANGUAGE_CODE[{language!r}] should be {code!r}")
+    for code in [*DEFAULT_ALIGN_MODELS_TORCH, *DEFAULT_ALIGN_MODELS_HF]:
+        if code not in languages.wav2vec2_langs:
+            problems.append(f"wav2vec2_langs is missing {code!r}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.0,
+        help="seconds every import or --help may take on top of the interpreter startup",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--check-tables",
+        action="store_true",
+        default=False,
+        help="also check languages.py against the installed whisperx",
+    )
+    args = parser.parse_args()
+
+    baseline, _ = measure(["-c", "pass"], 0.0, args.repeat)
+    cases = [(module, ["-c", f"import {module}"]) for module in MODULES]
+    cases += [(f"{script} --help", [script, "--help"]) for script in SCRIPTS]
+
+    problems = []
+    for name, case_args in cases:
+        seconds, imported = measure(case_args, baseline, args.repeat)
+        heavy = sorted(set(HEAVY_MODULES) & imported)
+        print(f"{name:>28} {seconds:>7.3f}s {' '.join(heavy)}")
+        if heavy:
+            problems.append(f"{name} imports {', '.join(heavy)}")
+        if seconds > args.budget:
+            problems.append(f"{name} took {seconds:.3f}s, the budget is {args.budget}s")
+
+    if args.check_tables:
+        problems += check_tables()
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
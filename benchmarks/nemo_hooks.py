@@ -0,0 +1,98 @@
+"""
+Checks that the NeMo internals the diarization relies on are still there: the
+ClusteringDiarizer methods `reused_embeddings` replaces to cluster the same
+embeddings again, and the NeuralDiarizer methods and speaker_utils functions
+`diarize_in_memory` calls. Also replaces the methods on a stand-in diarizer and
+checks they are restored afterwards. Exits with an error when a name is missing,
+the NeMo part is skipped when NeMo isn't installed.
+
+    python benchmarks/nemo_hooks.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import (  # noqa: E402
+    REUSED_EMBEDDINGS_METHODS,
+    can_reuse_embeddings,
+    reused_embeddings,
+)
+
+NEURAL_DIARIZER_METHODS = ("diarize", "get_emb_clus_infer", "run_pairwise_diarization")
+SPEAKER_UTILS_FUNCTIONS = ("labels_to_pyannote_object", "make_rttm_with_overlap")
+
+
+def check_nemo():
+    try:
+        from nemo.collections.asr.models import ClusteringDiarizer
+        from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+        from nemo.collections.asr.parts.utils import speaker_utils
+    except ImportError:
+        print("NeMo isn't installed, its internals aren't checked")
+        return []
+
+    failures = []
+    for owner, names in (
+        (ClusteringDiarizer, REUSED_EMBEDDINGS_METHODS),
+        (NeuralDiarizer, NEURAL_DIARIZER_METHODS),
+        (speaker_utils, SPEAKER_UTILS_FUNCTIONS),
+    ):
+        for name in names:
+            status = "ok" if callable(getattr(owner, name, None)) else "missing"
+            print(f"{owner.__name__:>20}.{name:<36} {status}")
+            if status != "ok":
+                failures.append(f"{owner.__name__}.{name} is missing")
+    return failures
+
+
+class StandInDiarizer:
+    """A ClusteringDiarizer with nothing but the methods that are replaced."""
+
+    def __init__(self):
+        self.multiscale_embeddings_and_timestamps = {0: ("embeddings", "stamps")}
+
+    def _perform_speech_activity_detection(self):
+        raise AssertionError("the VAD runs again")
+
+    def _run_segmentation(self, *args, **kwargs):
+        raise AssertionError("the segmentation runs again")
+
+    def _extract_embeddings(self, manifest_file, scale_idx, num_scales):
+        raise AssertionError("the embeddings are extracted again")
+
+
+def check_reused_embeddings():
+    failures = []
+    diarizer, other = StandInDiarizer(), StandInDiarizer()
+    if not can_reuse_embeddings(diarizer):
+        failures.append("a diarizer with every method can't reuse its embeddings")
+    with reused_embeddings(diarizer):
+        diarizer._perform_speech_activity_detection()
+        diarizer._run_segmentation("manifest.json", 0)
+        diarizer._extract_embeddings("manifest.json", 0, 1)
+        if (diarizer.embeddings, diarizer.time_stamps) != ("embeddings", "stamps"):
+            failures.append("the saved embeddings aren't handed back")
+        if any(name in vars(other) for name in REUSED_EMBEDDINGS_METHODS):
+            failures.append("the methods of another diarizer are replaced")
+    if any(name in vars(diarizer) for name in REUSED_EMBEDDINGS_METHODS):
+        failures.append("the diarizer's methods aren't restored")
+
+    class Renamed(StandInDiarizer):
+        _extract_embeddings = None
+
+    if can_reuse_embeddings(Renamed()):
+        failures.append("a diarizer missing a method can reuse its embeddings")
+    return failures
+
+
+def main():
+    failures = check_nemo() + check_reused_embeddings()
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
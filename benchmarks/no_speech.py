@@ -0,0 +1,86 @@
+"""
+Checks that a file without speech still gets its transcripts, empty ones, from
+the post-processing. Runs the post-processing step of the pipeline on no words
+and no speaker turns, as the diarization returns them when the shared VAD finds
+no speech or no chunk of a long recording has any, no models needed. Exits with
+an error when the step fails or a transcript is missing or holds any text.
+
+    python benchmarks/no_speech.py
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import (  # noqa: E402
+    ModelManager,
+    _job_steps,
+    _new_job,
+    pipeline_options,
+)
+from stage_cache import StageCache  # noqa: E402
+from transcript_writers import OUTPUT_FORMATS  # noqa: E402
+
+
+def read_output(path: str):
+    """The text of a transcript without what every file of its format holds."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8-sig") as f:
+        text = f.read()
+    fmt = os.path.basename(path).split(".")[1]
+    if fmt == "json":
+        return "".join(json.dumps(record) for record in json.loads(text))
+    if fmt == "vtt":
+        return text.replace("WEBVTT", "", 1)
+    return text
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for compress_outputs in (False, True):
+            options = pipeline_options(
+                output_formats=list(OUTPUT_FORMATS),
+                compress_outputs=compress_outputs,
+                language="en",
+            )
+            steps = _job_steps(ModelManager("cpu"), StageCache(), options)
+            stage, _, run_postprocessing = steps[-1]
+            assert stage == "postprocessing"
+
+            job = _new_job(
+                os.path.join(temp_dir, "silence.wav"), os.path.join(temp_dir, "scratch")
+            )
+            job.update(
+                word_timestamps=[],
+                speaker_ts=np.zeros((0, 3), dtype=np.int64),
+                language="en",
+            )
+            try:
+                run_postprocessing(job)
+            except Exception as e:
+                failures.append(f"post-processing failed: {type(e).__name__}: {e}")
+                continue
+
+            if len(job["outputs"]) != len(OUTPUT_FORMATS):
+                failures.append(f"expected {len(OUTPUT_FORMATS)} transcripts")
+            for path in job["outputs"]:
+                text = read_output(path)
+                status = "ok" if not text.strip() else "not empty"
+                print(f"{os.path.basename(path):>24} {len(text):>6} chars  {status}")
+                if text.strip():
+                    failures.append(f"{os.path.basename(path)} is not empty")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
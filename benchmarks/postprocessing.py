@@ -0,0 +1,229 @@
+"""
+Times the post-processing helpers on synthetic transcripts of 1 minute to 24
+hours of speech, no models needed, and saves the results as JSON so they can be
+compared between commits.
+
+    python benchmarks/postprocessing.py --output before.json
+    python benchmarks/postprocessing.py --output after.json --compare before.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import (  # noqa: E402
+    filter_missing_timestamps,
+    get_realigned_ws_mapping_with_punctuation,
+    get_sentences_speaker_mapping,
+    get_words_speaker_mapping,
+)
+from transcript_writers import write_transcripts  # noqa: E402
+
+DURATIONS_MINUTES = [1, 10, 60, 240, 480, 1440]
+
+WORDS_PER_SECOND = 2.5
+
+VOCABULARY = (
+    "the of and to a in is it you that he was for on are with as I his they be at "
+    "one have this from or had by word but what some we can out other were all "
+    "there when up use your how said an each she which do their time if will way "
+    "about many then them write would like so these her long make thing see him "
+    "two has look more day could go come did number sound no most people my over"
+).split()
+
+
+def synthetic_transcript(duration_s: float, num_speakers: int = 4, seed: int = 0):
+    """
+    Aligned words and RTTM style speaker turns covering `duration_s` seconds.
+
+    Speaker turns last from a couple of seconds to a minute, and about one word
+    in ten ends with punctuation.
+    """
+    rng = random.Random(seed)
+    spk_ts, turn_start, speaker = [], 0, 0
+    while turn_start < duration_s * 1000:
+        turn_end = turn_start + rng.randint(2_000, 60_000)
+        spk_ts.append([turn_start, turn_end, speaker])
+        speaker = (speaker + rng.randint(1, num_speakers - 1)) % num_speakers
+        turn_start = turn_end + rng.randint(0, 500)
+
+    words, time_s = [], 0.0
+    for _ in range(int(duration_s * WORDS_PER_SECOND)):
+        word = rng.choice(VOCABULARY)
+        if rng.random() < 0.1:
+            word += rng.choice(".,?!")
+        length = rng.uniform(0.1, 0.5)
+        words.append(
+            {
+                "text": word,
+                "start": round(time_s, 3),
+                "end": round(time_s + length, 3),
+                "score": 1.0,
+            }
+        )
+        time_s += length + rng.uniform(0.0, 0.3)
+    return words, spk_ts
+
+
+def with_missing_timestamps(words, seed: int = 0):
+    """Words as filter_missing_timestamps takes them, with 2% missing timestamps."""
+    rng = random.Random(seed)
+    word_timestamps = []
+    for word in words:
+        word_timestamps.append({"word": word["text"]})
+        if rng.random() >= 0.02:
+            word_timestamps[-1].update(start=word["start"], end=word["end"])
+    word_timestamps[0].update(start=words[0]["start"], end=words[0]["end"])
+    return word_timestamps
+
+
+def time_function(function, make_args, repeat: int):
+    """Run `function` on fresh arguments `repeat` times, returns the timings."""
+    timings = []
+    for _ in range(repeat):
+        args = make_args()
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(durations_minutes, repeat: int, seed: int):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_base = os.path.join(temp_dir, "benchmark")
+
+        def srt_to_file(ssm):
+            write_transcripts(ssm, None, output_base, ["srt"])
+
+        for minutes in durations_minutes:
+            words, spk_ts = synthetic_transcript(minutes * 60, seed=seed)
+            wsm = get_words_speaker_mapping(words, spk_ts, "start")
+            realigned = get_realigned_ws_mapping_with_punctuation(copy.deepcopy(wsm))
+            ssm = get_sentences_speaker_mapping(realigned, spk_ts)
+            missing = with_missing_timestamps(words, seed)
+
+            cases = {
+                "get_words_speaker_mapping": (
+                    get_words_speaker_mapping,
+                    lambda: (words, spk_ts, "start"),
+                ),
+                "get_realigned_ws_mapping_with_punctuation": (
+                    get_realigned_ws_mapping_with_punctuation,
+                    lambda: (copy.deepcopy(wsm),),
+                ),
+                "get_sentences_speaker_mapping": (
+                    get_sentences_speaker_mapping,
+                    lambda: (realigned, spk_ts),
+                ),
+                "write_srt": (srt_to_file, lambda: (ssm,)),
+                "filter_missing_timestamps": (
+                    filter_missing_timestamps,
+                    lambda: (copy.deepcopy(missing),),
+                ),
+            }
+            for name, (function, make_args) in cases.items():
+                timings = time_function(function, make_args, repeat)
+                results.append(
+                    {
+                        "function": name,
+                        "duration_minutes": minutes,
+                        "words": len(words),
+                        "turns": len(spk_ts),
+                        "min_s": min(timings),
+                        "median_s": statistics.median(timings),
+                    }
+                )
+                print(
+                    f"{name:>42} {minutes:>6} min {len(words):>8} words "
+                    f"{min(timings):>9.4f}s"
+                )
+    return results
+
+
+def compare(results, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {
+            (result["function"], result["duration_minutes"]): result
+            for result in json.load(f)["results"]
+        }
+    print(f"\nCompared with {baseline_path} (min time, >1 is faster now)")
+    for result in results:
+        previous = baseline.get((result["function"], result["duration_minutes"]))
+        if previous is None:
+            continue
+        print(
+            f"{result['function']:>42} {result['duration_minutes']:>6} min "
+            f"{previous['min_s']:>9.4f}s -> {result['min_s']:>9.4f}s "
+            f"{previous['min_s'] / result['min_s']:>6.2f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--durations",
+        type=float,
+        nargs="+",
+        default=DURATIONS_MINUTES,
+        help="transcript durations in minutes",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        default="postprocessing_benchmark.json",
+        help="JSON file the results are written to",
+    )
+    parser.add_argument(
+        "--compare", default=None, help="results of an earlier run to compare with"
+    )
+    args = parser.parse_args()
+
+    results = run(args.durations, args.repeat, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": current_commit(),
+                "created": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "seed": args.seed,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
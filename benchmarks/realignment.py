@@ -0,0 +1,183 @@
+"""
+Compares `get_realigned_ws_mapping_with_punctuation` with the previous
+implementation, which searched the sentence around every speaker change, on
+synthetic transcripts and checks that both give the same speakers.
+
+    python benchmarks/realignment.py --words 100000 1000000 --speakers 2 8 32
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import (  # noqa: E402
+    get_realigned_ws_mapping_with_punctuation,
+    sentence_ending_punctuations,
+)
+from transcript import Transcript  # noqa: E402
+
+
+def get_first_word_idx_of_sentence(word_idx, word_list, speaker_list, max_words):
+    is_word_sentence_end = (
+        lambda x: x >= 0 and word_list[x][-1] in sentence_ending_punctuations
+    )
+    left_idx = word_idx
+    while (
+        left_idx > 0
+        and word_idx - left_idx < max_words
+        and speaker_list[left_idx - 1] == speaker_list[left_idx]
+        and not is_word_sentence_end(left_idx - 1)
+    ):
+        left_idx -= 1
+
+    return left_idx if left_idx == 0 or is_word_sentence_end(left_idx - 1) else -1
+
+
+def get_last_word_idx_of_sentence(word_idx, word_list, max_words):
+    is_word_sentence_end = (
+        lambda x: x >= 0 and word_list[x][-1] in sentence_ending_punctuations
+    )
+    right_idx = word_idx
+    while (
+        right_idx < len(word_list) - 1
+        and right_idx - word_idx < max_words
+        and not is_word_sentence_end(right_idx)
+    ):
+        right_idx += 1
+
+    return (
+        right_idx
+        if right_idx == len(word_list) - 1 or is_word_sentence_end(right_idx)
+        else -1
+    )
+
+
+def reference_realignment(word_speaker_mapping, max_words_in_sentence=50):
+    is_word_sentence_end = (
+        lambda x: x >= 0
+        and word_speaker_mapping[x]["word"][-1] in sentence_ending_punctuations
+    )
+    wsp_len = len(word_speaker_mapping)
+
+    words_list, speaker_list = [], []
+    for k, line_dict in enumerate(word_speaker_mapping):
+        word, speaker = line_dict["word"], line_dict["speaker"]
+        words_list.append(word)
+        speaker_list.append(speaker)
+
+    k = 0
+    while k < len(word_speaker_mapping):
+        line_dict = word_speaker_mapping[k]
+        if (
+            k < wsp_len - 1
+            and speaker_list[k] != speaker_list[k + 1]
+            and not is_word_sentence_end(k)
+        ):
+            left_idx = get_first_word_idx_of_sentence(
+                k, words_list, speaker_list, max_words_in_sentence
+            )
+            right_idx = (
+                get_last_word_idx_of_sentence(
+                    k, words_list, max_words_in_sentence - k + left_idx - 1
+                )
+                if left_idx > -1
+                else -1
+            )
+            if min(left_idx, right_idx) == -1:
+                k += 1
+                continue
+
+            spk_labels = speaker_list[left_idx : right_idx + 1]
+            mod_speaker = max(set(spk_labels), key=spk_labels.count)
+            if spk_labels.count(mod_speaker) < len(spk_labels) // 2:
+                k += 1
+                continue
+
+            speaker_list[left_idx : right_idx + 1] = [mod_speaker] * (
+                right_idx - left_idx + 1
+            )
+            k = right_idx
+
+        k += 1
+
+    k, realigned_list = 0, []
+    while k < len(word_speaker_mapping):
+        line_dict = word_speaker_mapping[k].copy()
+        line_dict["speaker"] = speaker_list[k]
+        realigned_list.append(line_dict)
+        k += 1
+
+    return realigned_list
+
+
+def synthetic_transcript(num_words, num_speakers, seed=0):
+    """Words with speaker turns of a few words to a few sentences."""
+    rng = random.Random(seed)
+    words, speaker, turn_left, time_ms = [], 0, 0, 0
+    for idx in range(num_words):
+        if turn_left == 0:
+            speaker = rng.randrange(num_speakers)
+            turn_left = rng.choice([rng.randint(1, 5), rng.randint(5, 120)])
+        turn_left -= 1
+        punctuation = rng.choices(["", ".", "?", "!", ","], [80, 10, 3, 2, 5])[0]
+        words.append(
+            {
+                "word": f"word{idx % 997}{punctuation}",
+                "start_time": time_ms,
+                "end_time": time_ms + 250,
+                "speaker": speaker,
+            }
+        )
+        time_ms += 300
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--words", type=int, nargs="+", default=[100_000, 300_000, 1_000_000]
+    )
+    parser.add_argument("--speakers", type=int, nargs="+", default=[2, 8, 32])
+    parser.add_argument("--max-words-in-sentence", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'words':>9} {'speakers':>8} {'reference s':>12} {'current s':>10} {'speedup':>8}"
+    )
+    for num_words in args.words:
+        for num_speakers in args.speakers:
+            words = synthetic_transcript(num_words, num_speakers, args.seed)
+            current_input = Transcript.from_dicts(words)
+
+            started = time.perf_counter()
+            expected = reference_realignment(words, args.max_words_in_sentence)
+            reference_s = time.perf_counter() - started
+
+            started = time.perf_counter()
+            realigned = get_realigned_ws_mapping_with_punctuation(
+                current_input, args.max_words_in_sentence
+            )
+            current_s = time.perf_counter() - started
+
+            realigned = realigned.to_dicts()
+            if realigned != expected:
+                mismatch = next(
+                    idx for idx, (a, b) in enumerate(zip(realigned, expected)) if a != b
+                )
+                sys.exit(
+                    f"Outputs differ at word {mismatch} for {num_words} words "
+                    f"and {num_speakers} speakers"
+                )
+            print(
+                f"{num_words:>9} {num_speakers:>8} {reference_s:>12.3f} "
+                f"{current_s:>10.3f} {reference_s / current_s:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares `get_sentences_speaker_mapping` with the previous implementation,
+which re-tokenized the whole sentence for every word, on long speaker turns
+without punctuation, as transcribed in languages the punctuation model doesn't
+cover, and checks that both give the same sentences.
+
+    python benchmarks/sentence_mapping.py --turn-words 500 1000 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import nltk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import get_sentences_speaker_mapping  # noqa: E402
+from transcript import Transcript  # noqa: E402
+
+
+def reference_sentences_speaker_mapping(word_speaker_mapping, spk_ts):
+    sentence_checker = nltk.tokenize.PunktSentenceTokenizer().text_contains_sentbreak
+    s, e, spk = spk_ts[0]
+    prev_spk = spk
+
+    snts = []
+    snt = {"speaker": f"Speaker {spk}", "start_time": s, "end_time": e, "text": ""}
+
+    for wrd_dict in word_speaker_mapping:
+        wrd, spk = wrd_dict["word"], wrd_dict["speaker"]
+        s, e = wrd_dict["start_time"], wrd_dict["end_time"]
+        if spk != prev_spk or sentence_checker(snt["text"] + " " + wrd):
+            snts.append(snt)
+            snt = {
+                "speaker": f"Speaker {spk}",
+                "start_time": s,
+                "end_time": e,
+                "text": "",
+            }
+        else:
+            snt["end_time"] = e
+        snt["text"] += wrd + " "
+        prev_spk = spk
+
+    snts.append(snt)
+    return snts
+
+
+def synthetic_turns(turn_words, num_turns, seed=0):
+    """Speaker turns of `turn_words` words each, without any punctuation."""
+    rng = random.Random(seed)
+    vocabulary = [f"word{idx}" for idx in range(500)] + ["Mr", "and", "the", "I"]
+    words, spk_ts, time_ms = [], [], 0
+    for turn in range(num_turns):
+        speaker = turn % 2
+        turn_start = time_ms
+        for _ in range(turn_words):
+            words.append(
+                {
+                    "word": rng.choice(vocabulary),
+                    "start_time": time_ms,
+                    "end_time": time_ms + 250,
+                    "speaker": speaker,
+                }
+            )
+            time_ms += 300
+        spk_ts.append([turn_start, time_ms, speaker])
+    return words, spk_ts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turn-words", type=int, nargs="+", default=[500, 1000, 2000])
+    parser.add_argument("--turns", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'turn words':>10} {'turns':>6} {'reference s':>12} {'current s':>10} {'speedup':>8}"
+    )
+    for turn_words in args.turn_words:
+        words, spk_ts = synthetic_turns(turn_words, args.turns, args.seed)
+        transcript = Transcript.from_dicts(words)
+
+        started = time.perf_counter()
+        expected = reference_sentences_speaker_mapping(words, spk_ts)
+        reference_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sentences = get_sentences_speaker_mapping(transcript, spk_ts)
+        current_s = time.perf_counter() - started
+
+        if sentences.to_dicts() != expected:
+            sys.exit(f"Sentences differ for turns of {turn_words} words")
+        print(
+            f"{turn_words:>10} {args.turns:>6} {reference_s:>12.3f} "
+            f"{current_s:>10.3f} {reference_s / current_s:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Times the diarization with and without speaker count hints, on the test asset
+and on longer inputs made by repeating it, and reports how many speakers each
+run found. The models are loaded before timing, only the diarization is timed.
+
+    python benchmarks/speaker_counts.py --minutes 0 5 15 --hints none num=2 max=4
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from helpers import default_device  # noqa: E402
+from pipeline import SAMPLE_RATE, ModelManager, decode_audio, diarize  # noqa: E402
+
+TEST_ASSET = os.path.join(REPO_DIR, "tests", "assets", "test.opus")
+
+HINT_NAMES = {
+    "num": "num_speakers",
+    "min": "min_speakers",
+    "max": "max_speakers",
+}
+
+
+def parse_hints(value: str):
+    """'none' or comma separated name=count pairs, e.g. 'min=2,max=4'."""
+    if value == "none":
+        return {}
+    hints = {}
+    for pair in value.split(","):
+        name, _, count = pair.partition("=")
+        if name not in HINT_NAMES or not count.isdigit():
+            raise argparse.ArgumentTypeError(
+                f"unknown hint '{pair}', use num=N, min=N or max=N"
+            )
+        hints[HINT_NAMES[name]] = int(count)
+    return hints
+
+
+def repeated(audio, minutes: float, gap: float = 0.5):
+    """`audio` repeated with `gap` seconds of silence until it lasts `minutes`."""
+    if minutes <= 0:
+        return audio
+    silence = np.zeros(int(gap * SAMPLE_RATE), dtype=audio.dtype)
+    unit = np.concatenate([audio, silence])
+    repeats = int(np.ceil(minutes * 60 * SAMPLE_RATE / len(unit)))
+    return np.tile(unit, repeats)[: int(minutes * 60 * SAMPLE_RATE)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-a", "--audio", default=TEST_ASSET)
+    parser.add_argument(
+        "--minutes",
+        type=float,
+        nargs="+",
+        default=[0, 5, 15],
+        help="input lengths, 0 is the audio as it is",
+    )
+    parser.add_argument(
+        "--hints",
+        type=parse_hints,
+        nargs="+",
+        default=[{}, {"num_speakers": 2}, {"max_speakers": 4}],
+        help="speaker count hints to compare, 'none' or e.g. num=2 or min=2,max=4",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    args = parser.parse_args()
+    device = args.device or default_device()
+
+    audio = decode_audio(args.audio)
+    # the diarizer stays loaded, so only the diarization itself is timed
+    models = ModelManager(device, keep=("diarizer",))
+    results = []
+    with tempfile.TemporaryDirectory() as temp_path:
+        for hints in args.hints:
+            diarize(models, audio, temp_path, **hints)
+
+        print(
+            f"{'minutes':>8} {'hints':>24} {'seconds':>9} {'speakers':>8} {'speedup':>8}"
+        )
+        for minutes in args.minutes:
+            samples = repeated(audio, minutes)
+            baseline = None
+            for hints in args.hints:
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    speaker_ts = diarize(models, samples, temp_path, **hints)
+                    timings.append(time.perf_counter() - started)
+                seconds = min(timings)
+                speakers = len(np.unique(speaker_ts[:, 2]))
+                if not hints:
+                    baseline = seconds
+                label = ",".join(f"{k}={v}" for k, v in hints.items()) or "none"
+                speedup = f"{baseline / seconds:>7.2f}x" if baseline else ""
+                print(
+                    f"{len(samples) / SAMPLE_RATE / 60:>8.1f} {label:>24} "
+                    f"{seconds:>9.2f} {speakers:>8} {speedup:>8}"
+                )
+                results.append(
+                    {
+                        "minutes": len(samples) / SAMPLE_RATE / 60,
+                        "hints": hints,
+                        "seconds": seconds,
+                        "speakers": speakers,
+                    }
+                )
+    models.close()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"device": device, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
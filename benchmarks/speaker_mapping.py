@@ -0,0 +1,157 @@
+"""
+Compares `get_words_speaker_mapping` with the previous implementation, which
+walked the speaker turns word by word, on synthetic transcripts and checks that
+both give the same speakers for the "start", "mid" and "end" anchors. The turns
+end in order, as NeMo outputs them, or out of order, which takes the word by
+word walk, and every transcript has words before the first turn, after the last
+one and on turn boundaries. The "overlap" anchor is checked against a brute force
+search of the turn overlapping each word the most.
+
+    python benchmarks/speaker_mapping.py --words 100000 1000000 --speakers 2 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import get_word_ts_anchor, get_words_speaker_mapping  # noqa: E402
+
+ANCHORS = ("start", "mid", "end")
+
+
+def reference_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
+    s, e, sp = spk_ts[0]
+    wrd_pos, turn_idx = 0, 0
+    wrd_spk_mapping = []
+    for wrd_dict in wrd_ts:
+        ws, we, wrd = (
+            int(wrd_dict["start"] * 1000),
+            int(wrd_dict["end"] * 1000),
+            wrd_dict["text"],
+        )
+        wrd_pos = get_word_ts_anchor(ws, we, word_anchor_option)
+        while wrd_pos > float(e):
+            turn_idx += 1
+            turn_idx = min(turn_idx, len(spk_ts) - 1)
+            s, e, sp = spk_ts[turn_idx]
+            if turn_idx == len(spk_ts) - 1:
+                e = get_word_ts_anchor(ws, we, option="end")
+        wrd_spk_mapping.append(
+            {"word": wrd, "start_time": ws, "end_time": we, "speaker": sp}
+        )
+    return wrd_spk_mapping
+
+
+def reference_overlap_speakers(wrd_ts, spk_ts):
+    """The speaker of the turn each word overlaps the most, the first on ties."""
+    speakers = []
+    start_speakers = reference_words_speaker_mapping(wrd_ts, spk_ts, "start")
+    for wrd_dict, fallback in zip(wrd_ts, start_speakers):
+        ws, we = int(wrd_dict["start"] * 1000), int(wrd_dict["end"] * 1000)
+        best, best_overlap = None, 0
+        for s, e, sp in sorted(spk_ts, key=lambda turn: turn[0]):
+            overlap = min(we, e) - max(ws, s)
+            if overlap > best_overlap:
+                best, best_overlap = sp, overlap
+        speakers.append(fallback["speaker"] if best is None else best)
+    return speakers
+
+
+def synthetic_transcript(num_words, num_speakers, ordered=True, seed=0):
+    """
+    Aligned words and speaker turns, with pauses between the turns and words
+    before the first turn, after the last one and ending on turn boundaries.
+    With `ordered` false some turns end after the next one, as overlapping turns
+    would.
+    """
+    rng = random.Random(seed)
+    spk_ts, time_ms = [], 2_000
+    while len(spk_ts) * 40 < num_words:
+        turn_end = time_ms + rng.randint(500, 30_000)
+        spk_ts.append([time_ms, turn_end, rng.randrange(num_speakers)])
+        time_ms = turn_end + rng.choice([0, 0, rng.randint(1, 2_000)])
+    if not ordered:
+        for turn in rng.sample(spk_ts, max(1, len(spk_ts) // 10)):
+            turn[1] += rng.randint(1_000, 20_000)
+
+    boundaries = [e for _, e, _ in spk_ts]
+    wrd_ts, time_ms = [], 0
+    for idx in range(num_words):
+        if rng.random() < 0.05:
+            # a word ending exactly on a turn boundary
+            end_ms = rng.choice(boundaries)
+            start_ms = end_ms - rng.randint(100, 400)
+        else:
+            start_ms = time_ms
+            end_ms = start_ms + rng.randint(100, 600)
+        wrd_ts.append(
+            {"text": f"word{idx % 997}", "start": start_ms / 1000, "end": end_ms / 1000}
+        )
+        time_ms += rng.randint(150, 900)
+    wrd_ts.sort(key=lambda wrd_dict: wrd_dict["start"])
+    return wrd_ts, spk_ts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--words", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--speakers", type=int, nargs="+", default=[2, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'words':>9} {'speakers':>8} {'turn ends':>9} {'anchor':>7} "
+        f"{'reference s':>12} {'current s':>10} {'speedup':>8}"
+    )
+    for num_words in args.words:
+        for num_speakers in args.speakers:
+            for ordered in (True, False):
+                wrd_ts, spk_ts = synthetic_transcript(
+                    num_words, num_speakers, ordered, args.seed
+                )
+                label = "ordered" if ordered else "shuffled"
+                for anchor in ANCHORS:
+                    started = time.perf_counter()
+                    expected = reference_words_speaker_mapping(wrd_ts, spk_ts, anchor)
+                    reference_s = time.perf_counter() - started
+
+                    started = time.perf_counter()
+                    mapping = get_words_speaker_mapping(wrd_ts, spk_ts, anchor)
+                    current_s = time.perf_counter() - started
+
+                    mapping = mapping.to_dicts()
+                    if mapping != expected:
+                        mismatch = next(
+                            idx
+                            for idx, (a, b) in enumerate(zip(mapping, expected))
+                            if a != b
+                        )
+                        sys.exit(
+                            f"Outputs differ at word {mismatch} for the {anchor} "
+                            f"anchor, {num_words} words, {num_speakers} speakers "
+                            f"and {label} turn ends"
+                        )
+                    print(
+                        f"{num_words:>9} {num_speakers:>8} {label:>9} {anchor:>7} "
+                        f"{reference_s:>12.3f} {current_s:>10.3f} "
+                        f"{reference_s / current_s:>7.1f}x"
+                    )
+
+                # the brute force search is quadratic, a slice of the words will do
+                words = wrd_ts[:2_000]
+                speakers = get_words_speaker_mapping(
+                    words, spk_ts, "overlap"
+                ).speaker.tolist()
+                if speakers != reference_overlap_speakers(words, spk_ts):
+                    sys.exit(
+                        f"Overlap speakers differ for {num_speakers} speakers and "
+                        f"{label} turn ends"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Checks that the WebVTT transcript escapes the characters that mean something in
+a cue. Writes sentences holding &, <, > and "-->" with `write_transcripts`, no
+models needed, and exits with an error when a cue doesn't read back as the
+sentence's text or holds anything that a WebVTT parser would take for a tag, an
+escape or a cue timing.
+
+    python benchmarks/vtt_escaping.py
+"""
+
+import html
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript import Sentences, Transcript  # noqa: E402
+from transcript_writers import write_transcripts  # noqa: E402
+
+SENTENCES = [
+    "Fish & chips, please.",
+    "Is 3 < 4 and 5 > 2?",
+    "Type <b>bold</b> and &amp; as it is.",
+    "Then --> the arrow.",
+    "<v Speaker 9>Not a voice.",
+]
+
+# the voice tag of every cue, anything else starting with < is a tag
+VOICE_TAG = re.compile(r"^<v Speaker \d+>")
+
+
+def main():
+    words = [sentence.split() for sentence in SENTENCES]
+    ends = [sum(map(len, words[: idx + 1])) for idx in range(len(words))]
+    # only the text and the speakers of the sentences matter here
+    zeros = [0] * ends[-1]
+    transcript = Transcript(sum(words, []), zeros, zeros, zeros)
+    sentences = Sentences(
+        transcript,
+        [idx * 1000 for idx in range(len(words))],
+        [idx * 1000 + 900 for idx in range(len(words))],
+        [idx % 2 for idx in range(len(words))],
+        [0] + ends[:-1],
+        ends,
+    )
+
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        (path,) = write_transcripts(
+            sentences, transcript, os.path.join(temp_dir, "escaping"), ["vtt"]
+        )
+        with open(path, encoding="utf-8") as f:
+            cues = f.read().split("\n\n")[1:-1]
+
+    if len(cues) != len(SENTENCES):
+        failures.append(f"expected {len(SENTENCES)} cues, got {len(cues)}")
+    for sentence, cue in zip(SENTENCES, cues):
+        timing, payload = cue.split("\n", 1)
+        text = VOICE_TAG.sub("", payload)
+        status = "ok"
+        if text == payload:
+            status = "no voice tag"
+        elif "<" in text or ">" in text or "-->" in payload:
+            status = "unescaped tag or arrow"
+        elif re.search(r"&(?!amp;|lt;|gt;)", text):
+            status = "unescaped &"
+        elif html.unescape(text) != sentence:
+            status = "text differs"
+        print(f"{sentence:>40}  {status}")
+        if status != "ok":
+            failures.append(f"{sentence!r}: {status} in {payload!r}")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,237 +1,229 @@
 import argparse
+import json
 import logging
 import os
-import re
-
-import torch
-import torchaudio
-from ctc_forced_aligner import (
-    generate_emissions,
-    get_alignments,
-    get_spans,
-    load_alignment_model,
-    postprocess_results,
-    preprocess_text,
-)
-from deepmultilingualpunctuation import PunctuationModel
-from nemo.collections.asr.models.msdd_models import NeuralDiarizer
-
-from helpers import (
-    cleanup,
-    create_config,
-    get_realigned_ws_mapping_with_punctuation,
-    get_sentences_speaker_mapping,
-    get_speaker_aware_transcript,
-    get_words_speaker_mapping,
-    langs_to_iso,
-    process_language_arg,
-    punct_model_langs,
-    whisper_langs,
-    write_srt,
-)
-from transcription_helpers import transcribe_batched
-
-mtypes = {"cpu": "int8", "cuda": "float16"}
+import sys
+
+from helpers import default_device
+from long_audio import process_long_audio
+from model_store import MODEL_STORE_ENV, check_model_store, use_model_store
+from pipeline import (
+    ModelManager,
+    add_pipeline_arguments,
+    find_audio_files,
+    pipeline_options_from_args,
+    process_audio,
+    process_batch,
+    read_manifest,
+)
+from stage_cache import StageCache
+from stage_profiler import PROFILED_STAGES, PROFILERS, StageProfiler
 
 # Initialize parser
 parser = argparse.ArgumentParser()
-parser.add_argument(
-    "-a", "--audio", help="name of the target audio file", required=True
+inputs = parser.add_mutually_exclusive_group(required=True)
+inputs.add_argument("-a", "--audio", help="name of the target audio file")
+inputs.add_argument(
+    "--input-dir",
+    dest="input_dir",
+    help="directory of audio files to process as one batch",
 )
-parser.add_argument(
-    "--no-stem",
-    action="store_false",
-    dest="stemming",
-    default=True,
-    help="Disables source separation."
-    "This helps with long files that don't contain a lot of music.",
+inputs.add_argument(
+    "--manifest",
+    help="text file listing one audio file per line to process as one batch",
 )
+add_pipeline_arguments(parser)
 
 parser.add_argument(
-    "--suppress_numerals",
-    action="store_true",
-    dest="suppress_numerals",
-    default=False,
-    help="Suppresses Numerical Digits."
-    "This helps the diarization accuracy but converts all digits into written text.",
+    "--device",
+    dest="device",
+    default=None,
+    help="if you have a GPU use 'cuda', otherwise 'cpu', defaults to 'cuda' when "
+    "one is available",
 )
 
 parser.add_argument(
-    "--whisper-model",
-    dest="model_name",
-    default="medium.en",
-    help="name of the Whisper model to use",
+    "--group-size",
+    type=int,
+    dest="group_size",
+    default=32,
+    help="Number of files that go through each stage together in batch mode, "
+    "every model is loaded once per group",
 )
 
 parser.add_argument(
-    "--batch-size",
-    type=int,
-    dest="batch_size",
-    default=8,
-    help="Batch size for batched inference, reduce if you run out of memory, set to 0 for non-batched inference",
+    "--batch-report",
+    dest="batch_report",
+    default=None,
+    help="Path of a JSON file recording the outputs or the error of every file in batch mode",
 )
 
 parser.add_argument(
-    "--language",
-    type=str,
+    "--cache-dir",
+    dest="cache_dir",
     default=None,
-    choices=whisper_langs,
-    help="Language spoken in the audio, specify None to perform language detection",
+    help="Directory caching the output of every stage, a re-run skips the stages whose inputs didn't change",
 )
 
 parser.add_argument(
-    "--device",
-    dest="device",
-    default="cuda" if torch.cuda.is_available() else "cpu",
-    help="if you have a GPU use 'cuda', otherwise 'cpu'",
+    "--cache-size",
+    type=float,
+    dest="cache_size",
+    default=20,
+    help="Maximum size of the stage cache in GB, least recently used entries are evicted first",
 )
 
-args = parser.parse_args()
-language = process_language_arg(args.language, args.model_name)
-
-if args.stemming:
-    # Isolate vocals from the rest of the audio
-
-    return_code = os.system(
-        f'python3 -m demucs.separate -n htdemucs --two-stems=vocals "{args.audio}" -o "temp_outputs"'
-    )
-
-    if return_code != 0:
-        logging.warning(
-            "Source splitting failed, using original audio file. Use --no-stem argument to disable it."
-        )
-        vocal_target = args.audio
-    else:
-        vocal_target = os.path.join(
-            "temp_outputs",
-            "htdemucs",
-            os.path.splitext(os.path.basename(args.audio))[0],
-            "vocals.wav",
-        )
-else:
-    vocal_target = args.audio
-
-
-# Transcribe the audio file
-
-whisper_results, language, audio_waveform = transcribe_batched(
-    vocal_target,
-    language,
-    args.batch_size,
-    args.model_name,
-    mtypes[args.device],
-    args.suppress_numerals,
-    args.device,
+parser.add_argument(
+    "--temp-dir",
+    dest="temp_dir",
+    default=None,
+    help="Directory to create the job's scratch directory in, defaults to tmpfs when available",
 )
 
-# Forced Alignment
-alignment_model, alignment_tokenizer = load_alignment_model(
-    args.device,
-    dtype=torch.float16 if args.device == "cuda" else torch.float32,
+parser.add_argument(
+    "--stage-report",
+    action="store_true",
+    dest="stage_report",
+    default=False,
+    help="Write the wall time, CPU time, peak memory and real-time factor of every "
+    "stage to a JSON file next to the transcripts",
 )
 
-audio_waveform = (
-    torch.from_numpy(audio_waveform)
-    .to(alignment_model.dtype)
-    .to(alignment_model.device)
-)
-emissions, stride = generate_emissions(
-    alignment_model, audio_waveform, batch_size=args.batch_size
+parser.add_argument(
+    "--profile",
+    dest="profile_stage",
+    default=None,
+    choices=PROFILED_STAGES,
+    help="Stage to record a profiler trace of, written next to the transcripts",
 )
 
-del alignment_model
-torch.cuda.empty_cache()
-
-full_transcript = "".join(segment["text"] for segment in whisper_results)
-
-tokens_starred, text_starred = preprocess_text(
-    full_transcript,
-    romanize=True,
-    language=langs_to_iso[language],
+parser.add_argument(
+    "--profiler",
+    dest="profiler",
+    default="cprofile",
+    choices=PROFILERS,
+    help="Profiler used by --profile, 'cprofile' writes a .prof file and 'torch' a "
+    "chrome trace",
 )
 
-segments, scores, blank_token = get_alignments(
-    emissions,
-    tokens_starred,
-    alignment_tokenizer,
+parser.add_argument(
+    "--long-audio",
+    action="store_true",
+    dest="long_audio",
+    default=False,
+    help="Process a long recording in chunks split at pauses, several chunks at a time, "
+    "and stitch their speakers together",
 )
 
-spans = get_spans(tokens_starred, segments, blank_token)
-
-word_timestamps = postprocess_results(text_starred, spans, stride, scores)
-
-
-# convert audio to mono for NeMo combatibility
-ROOT = os.getcwd()
-temp_path = os.path.join(ROOT, "temp_outputs")
-os.makedirs(temp_path, exist_ok=True)
-torchaudio.save(
-    os.path.join(temp_path, "mono_file.wav"),
-    audio_waveform.cpu().unsqueeze(0).float(),
-    16000,
-    channels_first=True,
+parser.add_argument(
+    "--chunk-length",
+    type=float,
+    dest="chunk_length",
+    default=30,
+    help="Length of the chunks of --long-audio in minutes",
 )
 
+parser.add_argument(
+    "--chunk-overlap",
+    type=float,
+    dest="chunk_overlap",
+    default=5,
+    help="Seconds of audio on each side of a chunk processed with it for context",
+)
 
-# Initialize NeMo MSDD diarization model
-msdd_model = NeuralDiarizer(cfg=create_config(temp_path)).to(args.device)
-msdd_model.diarize()
-
-del msdd_model
-torch.cuda.empty_cache()
-
-# Reading timestamps <> Speaker Labels mapping
-
-
-speaker_ts = []
-with open(os.path.join(temp_path, "pred_rttms", "mono_file.rttm"), "r") as f:
-    lines = f.readlines()
-    for line in lines:
-        line_list = line.split(" ")
-        s = int(float(line_list[5]) * 1000)
-        e = s + int(float(line_list[8]) * 1000)
-        speaker_ts.append([s, e, int(line_list[11].split("_")[-1])])
-
-wsm = get_words_speaker_mapping(word_timestamps, speaker_ts, "start")
-
-if language in punct_model_langs:
-    # restoring punctuation in the transcript to help realign the sentences
-    punct_model = PunctuationModel(model="kredor/punctuate-all")
+parser.add_argument(
+    "--chunk-workers",
+    type=int,
+    dest="chunk_workers",
+    default=2,
+    help="Number of chunks processed at the same time, each worker process loads its own models",
+)
 
-    words_list = list(map(lambda x: x["word"], wsm))
+parser.add_argument(
+    "--stitch-threshold",
+    type=float,
+    dest="stitch_threshold",
+    default=0.6,
+    help="Cosine similarity above which speakers of different chunks are the same speaker",
+)
 
-    labled_words = punct_model.predict(words_list, chunk_size=230)
+parser.add_argument(
+    "--model-store",
+    dest="model_store",
+    default=os.environ.get(MODEL_STORE_ENV),
+    help="Directory filled by prefetch_models.py every model is loaded from, "
+    f"nothing is downloaded, defaults to ${MODEL_STORE_ENV}",
+)
 
-    ending_puncts = ".?!"
-    model_puncts = ".,;:!?"
+args = parser.parse_args()
+try:
+    options = pipeline_options_from_args(args)
+except ValueError as e:
+    parser.error(str(e))
+if args.device is None:
+    args.device = default_device()
+if args.model_store is not None:
+    use_model_store(args.model_store)
+    saved = check_model_store(args.model_store, [args.model_name])
+    print(f"Using the model store {args.model_store}, {saved:.1f}s of cold start saved")
+
+models = ModelManager(args.device, temp_root=args.temp_dir)
+cache = StageCache(args.cache_dir, max_size=int(args.cache_size * 1024**3))
+profiler = StageProfiler(args.stage_report, args.profile_stage, args.profiler)
+
+if args.audio is not None and args.long_audio:
+    process_long_audio(
+        models,
+        args.audio,
+        profiler=profiler,
+        chunk_length=args.chunk_length * 60,
+        chunk_overlap=args.chunk_overlap,
+        workers=args.chunk_workers,
+        stitch_threshold=args.stitch_threshold,
+        **options,
+    )
+    models.close()
+    sys.exit(0)
+
+if args.audio is not None:
+    process_audio(
+        models,
+        args.audio,
+        cache=cache,
+        profiler=profiler,
+        **options,
+    )
+    sys.exit(0)
 
-    # We don't want to punctuate U.S.A. with a period. Right?
-    is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
+if args.input_dir is not None:
+    audio_paths = find_audio_files(args.input_dir)
+else:
+    audio_paths = read_manifest(args.manifest)
 
-    for word_dict, labeled_tuple in zip(wsm, labled_words):
-        word = word_dict["word"]
-        if (
-            word
-            and labeled_tuple[1] in ending_puncts
-            and (word[-1] not in model_puncts or is_acronym(word))
-        ):
-            word += labeled_tuple[1]
-            if word.endswith(".."):
-                word = word.rstrip(".")
-            word_dict["word"] = word
 
-else:
-    logging.warning(
-        f"Punctuation restoration is not available for {language} language. Using the original punctuation."
-    )
+def report_file(audio_path, result):
+    if result["status"] == "ok":
+        print(f"Finished {audio_path}")
+    else:
+        logging.error(f"Failed {audio_path} at {result['stage']}: {result['error']}")
 
-wsm = get_realigned_ws_mapping_with_punctuation(wsm)
-ssm = get_sentences_speaker_mapping(wsm, speaker_ts)
 
-with open(f"{os.path.splitext(args.audio)[0]}.txt", "w", encoding="utf-8-sig") as f:
-    get_speaker_aware_transcript(ssm, f)
+results = process_batch(
+    models,
+    audio_paths,
+    cache=cache,
+    profiler=profiler,
+    group_size=args.group_size,
+    on_file_done=report_file,
+    **options,
+)
+models.close()
 
-with open(f"{os.path.splitext(args.audio)[0]}.srt", "w", encoding="utf-8-sig") as srt:
-    write_srt(ssm, srt)
+if args.batch_report is not None:
+    with open(args.batch_report, "w") as f:
+        json.dump(results, f, indent=2)
 
-cleanup(temp_path)
+failed = [path for path, result in results.items() if result["status"] != "ok"]
+if failed:
+    logging.error(f"{len(failed)} of {len(results)} files failed")
+    sys.exit(1)
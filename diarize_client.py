@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+from pipeline import add_pipeline_arguments, pipeline_options_from_args
+
+
+def send_request(request: dict, host: str = "127.0.0.1", port: int = 8765):
+    """Send one request to a running `diarize_server.py` and return its response."""
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Submits a job to a running diarize_server.py."
+    )
+    parser.add_argument("-a", "--audio", help="name of the target audio file")
+    add_pipeline_arguments(parser)
+    parser.add_argument(
+        "--command",
+        default="transcribe",
+        choices=["transcribe", "status", "unload", "shutdown"],
+        help="what to ask the server, defaults to transcribing the audio file",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address of the server")
+    parser.add_argument("--port", type=int, default=8765, help="port of the server")
+    args = parser.parse_args()
+
+    if args.command == "transcribe":
+        if args.audio is None:
+            parser.error("-a/--audio is required to transcribe")
+        try:
+            options = pipeline_options_from_args(args)
+        except ValueError as e:
+            parser.error(str(e))
+        request = {
+            "command": "transcribe",
+            # the server may run from another directory
+            "audio": os.path.abspath(args.audio),
+            **options,
+        }
+    else:
+        request = {"command": args.command}
+
+    response = send_request(request, args.host, args.port)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get("status") == "ok" else 1)
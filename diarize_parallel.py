@@ -1,227 +1,341 @@
 import argparse
+import json
 import logging
 import os
-import re
 import subprocess
+import sys
+import threading
+import time
 
-import torch
-from ctc_forced_aligner import (
-    generate_emissions,
-    get_alignments,
-    get_spans,
-    load_alignment_model,
-    postprocess_results,
-    preprocess_text,
-)
-from deepmultilingualpunctuation import PunctuationModel
+import numpy as np
 
 from helpers import (
+    SPEECH_RTTM_NAME,
     cleanup,
-    get_realigned_ws_mapping_with_punctuation,
-    get_sentences_speaker_mapping,
-    get_speaker_aware_transcript,
-    get_words_speaker_mapping,
-    langs_to_iso,
-    process_language_arg,
-    punct_model_langs,
-    whisper_langs,
-    write_srt,
+    create_temp_dir,
+    default_device,
+)
+from model_store import MODEL_STORE_ENV, check_model_store, use_model_store
+from pipeline import (
+    ModelManager,
+    add_pipeline_arguments,
+    find_audio_files,
+    pipeline_options_from_args,
+    process_pipelined,
+    read_manifest,
+    write_mono_wav,
+    write_speech_rttm,
 )
-from transcription_helpers import transcribe_batched
+from stage_profiler import PROFILED_STAGES, PROFILERS, StageProfiler
+
+
+class NemoDiarizer:
+    """
+    Diarizes in `nemo_process.py` subprocesses so NeMo doesn't compete with the
+    other stages for the GIL.
+
+    Every calling thread gets a process of its own, started on first use and kept
+    running with the model loaded until `close`. The audio is handed over as the
+    mono_file.wav of the process' scratch directory, on tmpfs when available, the
+    speaker turns come back in the answer.
+    With `oracle_vad` the processes diarize the speech regions they are given
+    instead of running NeMo's VAD. The speaker count hints are fixed when the
+    processes start, as `diarize` takes them.
+    """
+
+    def __init__(
+        self,
+        device: str,
+        temp_root: str = None,
+        oracle_vad: bool = False,
+        num_speakers: int = None,
+        min_speakers: int = None,
+        max_speakers: int = None,
+    ):
+        self.device = device
+        self.temp_root = temp_root
+        self.oracle_vad = oracle_vad
+        self.speaker_counts = {
+            "num_speakers": num_speakers,
+            "min_speakers": min_speakers,
+            "max_speakers": max_speakers,
+        }
+        self._local = threading.local()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        if not hasattr(self._local, "worker"):
+            workspace = create_temp_dir(self.temp_root)
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(
+                        os.path.dirname(os.path.abspath(__file__)), "nemo_process.py"
+                    ),
+                    "--device",
+                    self.device,
+                    "--temp-path",
+                    workspace,
+                    "--serve",
+                    *(["--oracle-vad"] if self.oracle_vad else []),
+                    *(
+                        arg
+                        for name, value in self.speaker_counts.items()
+                        if value is not None
+                        for arg in (f"--{name.replace('_', '-')}", str(value))
+                    ),
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            self._local.worker = (process, workspace)
+            with self._lock:
+                self._workers.append(self._local.worker)
+        return self._local.worker
+
+    def __call__(
+        self, models, audio_waveform, temp_path, speech_regions=None, **speaker_counts
+    ):
+        if (speech_regions is not None) != self.oracle_vad:
+            raise ValueError(
+                "Speech regions are given to a diarizer with oracle_vad, and only to it"
+            )
+        if speaker_counts != {
+            name: value
+            for name, value in self.speaker_counts.items()
+            if value is not None
+        }:
+            raise ValueError(
+                "The speaker count hints differ from those the diarizer was made with"
+            )
+        if speech_regions is not None and not speech_regions:
+            return np.zeros((0, 3), dtype=np.int64)
+        process, workspace = self._worker()
+        write_mono_wav(os.path.join(workspace, "mono_file.wav"), audio_waveform)
+        if speech_regions is not None:
+            write_speech_rttm(os.path.join(workspace, SPEECH_RTTM_NAME), speech_regions)
+        process.stdin.write("\n")
+        process.stdin.flush()
+        for line in process.stdout:
+            if not line.startswith("DIARIZATION_RESULT"):
+                # pass NeMo's own logging through
+                sys.stdout.write(line)
+                continue
+            result = json.loads(line.split(" ", 1)[1])
+            if result["status"] != "ok":
+                raise RuntimeError(
+                    f"Diarization failed with the following error: {result['error']}"
+                )
+            return np.array(result["speaker_ts"], dtype=np.int64).reshape(-1, 3)
+        raise RuntimeError(f"nemo_process.py exited with return code {process.wait()}")
+
+    def close(self):
+        with self._lock:
+            for process, workspace in self._workers:
+                process.stdin.close()
+                process.wait()
+                cleanup(workspace)
+            self._workers = []
 
-mtypes = {"cpu": "int8", "cuda": "float16"}
 
 # Initialize parser
 parser = argparse.ArgumentParser()
-parser.add_argument(
-    "-a", "--audio", help="name of the target audio file", required=True
+inputs = parser.add_mutually_exclusive_group(required=True)
+inputs.add_argument("-a", "--audio", help="name of the target audio file")
+inputs.add_argument(
+    "--input-dir",
+    dest="input_dir",
+    help="directory of audio files to process as one batch",
 )
-parser.add_argument(
-    "--no-stem",
-    action="store_false",
-    dest="stemming",
-    default=True,
-    help="Disables source separation."
-    "This helps with long files that don't contain a lot of music.",
+inputs.add_argument(
+    "--manifest",
+    help="text file listing one audio file per line to process as one batch",
 )
+add_pipeline_arguments(parser)
 
 parser.add_argument(
-    "--suppress_numerals",
-    action="store_true",
-    dest="suppress_numerals",
-    default=False,
-    help="Suppresses Numerical Digits."
-    "This helps the diarization accuracy but converts all digits into written text.",
+    "--device",
+    dest="device",
+    default=None,
+    help="if you have a GPU use 'cuda', otherwise 'cpu', defaults to 'cuda' when "
+    "one is available",
 )
 
 parser.add_argument(
-    "--whisper-model",
-    dest="model_name",
-    default="medium.en",
-    help="name of the Whisper model to use",
+    "--temp-dir",
+    dest="temp_dir",
+    default=None,
+    help="Directory to create the job's scratch directory in, defaults to tmpfs when available",
 )
 
 parser.add_argument(
-    "--batch-size",
+    "--stem-workers",
     type=int,
-    dest="batch_size",
-    default=8,
-    help="Batch size for batched inference, reduce if you run out of memory, set to 0 for non-batched inference",
+    dest="stem_workers",
+    default=1,
+    help="Number of files separated at the same time, each worker loads its own model",
 )
 
 parser.add_argument(
-    "--language",
-    type=str,
-    default=None,
-    choices=whisper_langs,
-    help="Language spoken in the audio, specify None to perform language detection",
+    "--asr-workers",
+    type=int,
+    dest="asr_workers",
+    default=1,
+    help="Number of files transcribed at the same time, each worker loads its own model",
 )
 
 parser.add_argument(
-    "--device",
-    dest="device",
-    default="cuda" if torch.cuda.is_available() else "cpu",
-    help="if you have a GPU use 'cuda', otherwise 'cpu'",
+    "--align-workers",
+    type=int,
+    dest="align_workers",
+    default=1,
+    help="Number of files aligned at the same time, each worker loads its own model",
 )
 
-args = parser.parse_args()
-language = process_language_arg(args.language, args.model_name)
-
-if args.stemming:
-    # Isolate vocals from the rest of the audio
-
-    return_code = os.system(
-        f'python3 -m demucs.separate -n htdemucs --two-stems=vocals "{args.audio}" -o "temp_outputs"'
-    )
-
-    if return_code != 0:
-        logging.warning(
-            "Source splitting failed, using original audio file. Use --no-stem argument to disable it."
-        )
-        vocal_target = args.audio
-    else:
-        vocal_target = os.path.join(
-            "temp_outputs",
-            "htdemucs",
-            os.path.splitext(os.path.basename(args.audio))[0],
-            "vocals.wav",
-        )
-else:
-    vocal_target = args.audio
-
-logging.info("Starting Nemo process with vocal_target: ", vocal_target)
-nemo_process = subprocess.Popen(
-    ["python3", "nemo_process.py", "-a", vocal_target, "--device", args.device],
-    stderr=subprocess.PIPE,
-)
-# Transcribe the audio file
-whisper_results, language, audio_waveform = transcribe_batched(
-    vocal_target,
-    language,
-    args.batch_size,
-    args.model_name,
-    mtypes[args.device],
-    args.suppress_numerals,
-    args.device,
+parser.add_argument(
+    "--diarize-workers",
+    type=int,
+    dest="diarize_workers",
+    default=1,
+    help="Number of NeMo processes diarizing files at the same time",
 )
 
-# Forced Alignment
-alignment_model, alignment_tokenizer = load_alignment_model(
-    args.device,
-    dtype=torch.float16 if args.device == "cuda" else torch.float32,
+parser.add_argument(
+    "--post-workers",
+    type=int,
+    dest="post_workers",
+    default=1,
+    help="Number of files punctuated and written at the same time",
 )
 
-audio_waveform = (
-    torch.from_numpy(audio_waveform)
-    .to(alignment_model.dtype)
-    .to(alignment_model.device)
-)
-emissions, stride = generate_emissions(
-    alignment_model, audio_waveform, batch_size=args.batch_size
+parser.add_argument(
+    "--queue-size",
+    type=int,
+    dest="queue_size",
+    default=2,
+    help="Number of files that may wait in front of each stage",
 )
 
-del alignment_model
-torch.cuda.empty_cache()
+parser.add_argument(
+    "--batch-report",
+    dest="batch_report",
+    default=None,
+    help="Path of a JSON file recording the outputs or the error of every file",
+)
 
-full_transcript = "".join(segment["text"] for segment in whisper_results)
 
-tokens_starred, text_starred = preprocess_text(
-    full_transcript,
-    romanize=True,
-    language=langs_to_iso[language],
+parser.add_argument(
+    "--stage-report",
+    action="store_true",
+    dest="stage_report",
+    default=False,
+    help="Write the wall time, CPU time, peak memory and real-time factor of every "
+    "stage to a JSON file next to the transcripts",
 )
 
-segments, scores, blank_token = get_alignments(
-    emissions,
-    tokens_starred,
-    alignment_tokenizer,
+parser.add_argument(
+    "--profile",
+    dest="profile_stage",
+    default=None,
+    choices=PROFILED_STAGES,
+    help="Stage to record a profiler trace of, written next to the transcripts",
 )
 
-spans = get_spans(tokens_starred, segments, blank_token)
-
-word_timestamps = postprocess_results(text_starred, spans, stride, scores)
-
-# Reading timestamps <> Speaker Labels mapping
-
-nemo_return_code = nemo_process.wait()
-nemo_error_trace = nemo_process.stderr.read()
-assert nemo_return_code == 0, (
-    "Diarization failed with the following error:"
-    f"\n{nemo_error_trace.decode('utf-8')}"
+parser.add_argument(
+    "--profiler",
+    dest="profiler",
+    default="cprofile",
+    choices=PROFILERS,
+    help="Profiler used by --profile, 'cprofile' writes a .prof file and 'torch' a "
+    "chrome trace",
 )
 
-ROOT = os.getcwd()
-temp_path = os.path.join(ROOT, "temp_outputs")
-
-speaker_ts = []
-with open(os.path.join(temp_path, "pred_rttms", "mono_file.rttm"), "r") as f:
-    lines = f.readlines()
-    for line in lines:
-        line_list = line.split(" ")
-        s = int(float(line_list[5]) * 1000)
-        e = s + int(float(line_list[8]) * 1000)
-        speaker_ts.append([s, e, int(line_list[11].split("_")[-1])])
-
-wsm = get_words_speaker_mapping(word_timestamps, speaker_ts, "start")
-
-if language in punct_model_langs:
-    # restoring punctuation in the transcript to help realign the sentences
-    punct_model = PunctuationModel(model="kredor/punctuate-all")
-
-    words_list = list(map(lambda x: x["word"], wsm))
-
-    labled_words = punct_model.predict(words_list, chunk_size=230)
-
-    ending_puncts = ".?!"
-    model_puncts = ".,;:!?"
-
-    # We don't want to punctuate U.S.A. with a period. Right?
-    is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
+parser.add_argument(
+    "--model-store",
+    dest="model_store",
+    default=os.environ.get(MODEL_STORE_ENV),
+    help="Directory filled by prefetch_models.py every model is loaded from, "
+    f"nothing is downloaded, defaults to ${MODEL_STORE_ENV}",
+)
 
-    for word_dict, labeled_tuple in zip(wsm, labled_words):
-        word = word_dict["word"]
-        if (
-            word
-            and labeled_tuple[1] in ending_puncts
-            and (word[-1] not in model_puncts or is_acronym(word))
-        ):
-            word += labeled_tuple[1]
-            if word.endswith(".."):
-                word = word.rstrip(".")
-            word_dict["word"] = word
+args = parser.parse_args()
+try:
+    options = pipeline_options_from_args(args)
+except ValueError as e:
+    parser.error(str(e))
+if args.device is None:
+    args.device = default_device()
+if args.model_store is not None:
+    use_model_store(args.model_store)
+    saved = check_model_store(args.model_store, [args.model_name])
+    print(f"Using the model store {args.model_store}, {saved:.1f}s of cold start saved")
+models = ModelManager(args.device, temp_root=args.temp_dir)
+diarizer = NemoDiarizer(
+    args.device,
+    args.temp_dir,
+    oracle_vad=options["shared_vad"],
+    num_speakers=options["num_speakers"],
+    min_speakers=options["min_speakers"],
+    max_speakers=options["max_speakers"],
+)
+profiler = StageProfiler(args.stage_report, args.profile_stage, args.profiler)
 
+if args.audio is not None:
+    audio_paths = [args.audio]
+elif args.input_dir is not None:
+    audio_paths = find_audio_files(args.input_dir)
 else:
-    logging.warning(
-        f"Punctuation restoration is not available for {language} language. Using the original punctuation."
-    )
+    audio_paths = read_manifest(args.manifest)
 
-wsm = get_realigned_ws_mapping_with_punctuation(wsm)
-ssm = get_sentences_speaker_mapping(wsm, speaker_ts)
 
-with open(f"{os.path.splitext(args.audio)[0]}.txt", "w", encoding="utf-8-sig") as f:
-    get_speaker_aware_transcript(ssm, f)
+def report_file(audio_path, result):
+    if result["status"] == "ok":
+        print(f"Finished {audio_path}")
+    else:
+        logging.error(f"Failed {audio_path} at {result['stage']}: {result['error']}")
+
+
+started = time.time()
+try:
+    # every stage works on a different file, transcription and diarization of the
+    # same file run side by side
+    results = process_pipelined(
+        models,
+        audio_paths,
+        profiler=profiler,
+        workers={
+            "separation": args.stem_workers,
+            "transcription": args.asr_workers,
+            "alignment": args.align_workers,
+            "diarization": args.diarize_workers,
+            "postprocessing": args.post_workers,
+        },
+        queue_size=args.queue_size,
+        diarize_fn=diarizer,
+        on_file_done=report_file,
+        **options,
+    )
+finally:
+    diarizer.close()
+    models.close()
+wall_hours = (time.time() - started) / 3600
+
+audio_hours = (
+    sum(result["duration"] or 0 for result in results.values() if "duration" in result)
+    / 3600
+)
+print(
+    f"Processed {audio_hours:.2f} audio hours in {wall_hours:.2f} wall hours, "
+    f"{audio_hours / wall_hours:.2f} audio-hours per wall-hour"
+)
 
-with open(f"{os.path.splitext(args.audio)[0]}.srt", "w", encoding="utf-8-sig") as srt:
-    write_srt(ssm, srt)
+if args.batch_report is not None:
+    with open(args.batch_report, "w") as f:
+        json.dump(results, f, indent=2)
 
-cleanup(temp_path)
+failed = [path for path, result in results.items() if result["status"] != "ok"]
+if failed:
+    logging.error(f"{len(failed)} of {len(results)} files failed")
+    sys.exit(1)
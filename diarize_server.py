@@ -0,0 +1,212 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import uuid
+
+from helpers import cleanup, create_temp_dir, default_device
+from model_store import MODEL_STORE_ENV, check_model_store, use_model_store
+from pipeline import MODEL_KINDS, PIPELINE_DEFAULTS, ModelManager, process_audio
+from stage_cache import StageCache
+
+
+class DiarizationWorker(threading.Thread):
+    """Runs the submitted jobs one at a time against a shared `ModelManager`."""
+
+    def __init__(self, models: ModelManager, workdir: str, cache: StageCache = None):
+        super().__init__(daemon=True)
+        self.models = models
+        self.workdir = workdir
+        self.cache = cache
+        self.jobs = queue.Queue()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, job: dict):
+        """Queue a job and block until it is done, returns the job report."""
+        done = threading.Event()
+        report = {"id": uuid.uuid4().hex, "submitted": time.time()}
+        self.jobs.put((job, report, done))
+        done.wait()
+        return report
+
+    def run(self):
+        while True:
+            job, report, done = self.jobs.get()
+            started = time.time()
+            temp_path = os.path.join(self.workdir, report["id"])
+            try:
+                # the options a client leaves out keep the defaults of diarize.py
+                options = {key: job[key] for key in PIPELINE_DEFAULTS if key in job}
+                report["outputs"] = process_audio(
+                    self.models,
+                    job["audio"],
+                    temp_path=temp_path,
+                    cache=self.cache,
+                    **options,
+                )
+                report["status"] = "ok"
+                self.completed += 1
+            except Exception as e:
+                logging.exception(f"Job {report['id']} failed")
+                report["status"] = "error"
+                report["error"] = f"{type(e).__name__}: {e}"
+                self.failed += 1
+            finally:
+                # whatever the job left behind, a failed job included
+                if os.path.exists(temp_path):
+                    cleanup(temp_path)
+            finished = time.time()
+            report["queued_s"] = round(started - report.pop("submitted"), 3)
+            report["processing_s"] = round(finished - started, 3)
+            report["total_s"] = round(report["queued_s"] + report["processing_s"], 3)
+            logging.info(
+                f"Job {report['id']} {report['status']} in {report['processing_s']}s"
+            )
+            done.set()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles newline delimited JSON requests, one response line per request."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(request)
+            except Exception as e:
+                response = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class DiarizationServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, worker: DiarizationWorker):
+        super().__init__(address, RequestHandler)
+        self.worker = worker
+
+    def dispatch(self, request: dict):
+        command = request.get("command", "transcribe")
+        if command == "transcribe":
+            if "audio" not in request:
+                raise ValueError("'audio' is required")
+            return self.worker.submit(request)
+        if command == "status":
+            return {
+                "status": "ok",
+                "loaded_models": self.worker.models.loaded(),
+                "queued_jobs": self.worker.jobs.qsize(),
+                "completed_jobs": self.worker.completed,
+                "failed_jobs": self.worker.failed,
+            }
+        if command == "unload":
+            self.worker.models.evict(request.get("kind"))
+            return {"status": "ok", "loaded_models": self.worker.models.loaded()}
+        if command == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"status": "ok"}
+        raise ValueError(f"Unknown command: {command}")
+
+
+def parse_model_kinds(value: str):
+    kinds = [kind.strip() for kind in value.split(",") if kind.strip()]
+    if kinds == ["all"]:
+        return list(MODEL_KINDS)
+    if kinds == ["none"]:
+        return []
+    for kind in kinds:
+        if kind not in MODEL_KINDS:
+            raise argparse.ArgumentTypeError(
+                f"unknown model kind '{kind}', choose from {', '.join(MODEL_KINDS)}"
+            )
+    return kinds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keeps the pipeline models loaded and serves transcription jobs."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument(
+        "--device",
+        dest="device",
+        default=None,
+        help="if you have a GPU use 'cuda', otherwise 'cpu', defaults to 'cuda' when "
+        "one is available",
+    )
+    parser.add_argument(
+        "--keep-models",
+        type=parse_model_kinds,
+        default=list(MODEL_KINDS),
+        help="comma separated model kinds that stay loaded between jobs "
+        f"({', '.join(MODEL_KINDS)}), 'all' or 'none', defaults to all",
+    )
+    parser.add_argument(
+        "--max-resident-models",
+        type=int,
+        default=None,
+        help="maximum number of models kept loaded, the least recently used one is evicted first",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=None,
+        help="directory caching the output of every stage, re-submitted files skip the stages whose inputs didn't change",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        dest="cache_size",
+        default=20,
+        help="maximum size of the stage cache in GB, least recently used entries are evicted first",
+    )
+    parser.add_argument(
+        "--temp-dir",
+        dest="temp_dir",
+        default=None,
+        help="directory to create the job scratch directories in, defaults to tmpfs when available",
+    )
+    parser.add_argument(
+        "--model-store",
+        dest="model_store",
+        default=os.environ.get(MODEL_STORE_ENV),
+        help="directory filled by prefetch_models.py every model is loaded from, "
+        f"nothing is downloaded, defaults to ${MODEL_STORE_ENV}",
+    )
+    args = parser.parse_args()
+    if args.device is None:
+        args.device = default_device()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.model_store is not None:
+        use_model_store(args.model_store)
+        check_model_store(args.model_store)
+
+    models = ModelManager(
+        args.device,
+        keep=args.keep_models,
+        max_resident=args.max_resident_models,
+        temp_root=args.temp_dir,
+    )
+    workdir = create_temp_dir(args.temp_dir, prefix="whisper_diarization_jobs_")
+    cache = StageCache(args.cache_dir, max_size=int(args.cache_size * 1024**3))
+    worker = DiarizationWorker(models, workdir, cache)
+    worker.start()
+
+    with DiarizationServer((args.host, args.port), worker) as server:
+        logging.info(f"Serving on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        finally:
+            models.close()
+            cleanup(workdir)
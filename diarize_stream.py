@@ -0,0 +1,213 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from helpers import default_device, process_language_arg, whisper_langs
+from model_store import MODEL_STORE_ENV, check_model_store, use_model_store
+from pipeline import MODEL_KINDS, ModelManager
+from streaming import SpeakerTracker, StreamingTranscriber, read_windows
+from transcript_writers import srt_cue
+
+# Initialize parser
+parser = argparse.ArgumentParser(
+    description="Transcribes live 16kHz mono 16-bit PCM audio with speaker labels, "
+    "window by window, e.g. ffmpeg -i INPUT -f s16le -ac 1 -ar 16000 - | "
+    "python diarize_stream.py"
+)
+parser.add_argument(
+    "-a",
+    "--audio",
+    default="-",
+    help="raw PCM or WAV file to read, '-' (default) reads stdin",
+)
+
+parser.add_argument(
+    "--follow",
+    action="store_true",
+    default=False,
+    help="Keep reading the audio file while it is being written",
+)
+
+parser.add_argument(
+    "--idle-timeout",
+    type=float,
+    dest="idle_timeout",
+    default=10.0,
+    help="Seconds without new audio after which a followed file is considered done",
+)
+
+parser.add_argument(
+    "--window",
+    type=float,
+    default=10.0,
+    help="Seconds of audio transcribed at a time, shorter windows lower the latency",
+)
+
+parser.add_argument(
+    "--format",
+    dest="output_format",
+    default="jsonl",
+    choices=("jsonl", "srt"),
+    help="Format of the emitted cues, jsonl also emits the latency of every window",
+)
+
+parser.add_argument(
+    "-o",
+    "--output",
+    default=None,
+    help="File the cues are appended to, defaults to stdout",
+)
+
+parser.add_argument(
+    "--speaker-threshold",
+    type=float,
+    dest="speaker_threshold",
+    default=0.6,
+    help="Cosine similarity to the closest speaker below which a new speaker starts",
+)
+
+parser.add_argument(
+    "--max-speakers",
+    type=int,
+    dest="max_speakers",
+    default=None,
+    help="Maximum number of speakers in the stream",
+)
+
+parser.add_argument(
+    "--suppress_numerals",
+    action="store_true",
+    dest="suppress_numerals",
+    default=False,
+    help="Suppresses Numerical Digits."
+    "This helps the diarization accuracy but converts all digits into written text.",
+)
+
+parser.add_argument(
+    "--whisper-model",
+    dest="model_name",
+    default="medium.en",
+    help="name of the Whisper model to use",
+)
+
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    dest="batch_size",
+    default=8,
+    help="Batch size for batched inference, reduce if you run out of memory, set to 0 for non-batched inference",
+)
+
+parser.add_argument(
+    "--language",
+    type=str,
+    default=None,
+    choices=whisper_langs,
+    help="Language spoken in the audio, specify None to perform language detection",
+)
+
+parser.add_argument(
+    "--device",
+    dest="device",
+    default=None,
+    help="if you have a GPU use 'cuda', otherwise 'cpu', defaults to 'cuda' when "
+    "one is available",
+)
+
+parser.add_argument(
+    "--model-store",
+    dest="model_store",
+    default=os.environ.get(MODEL_STORE_ENV),
+    help="Directory filled by prefetch_models.py every model is loaded from, "
+    f"nothing is downloaded, defaults to ${MODEL_STORE_ENV}",
+)
+
+args = parser.parse_args()
+if args.device is None:
+    args.device = default_device()
+
+logging.basicConfig(level=logging.INFO)
+if args.model_store is not None:
+    use_model_store(args.model_store)
+    check_model_store(args.model_store, [args.model_name])
+
+# every model stays loaded for the whole stream
+models = ModelManager(args.device, keep=(*MODEL_KINDS, "speaker_embedding"))
+transcriber = StreamingTranscriber(
+    models,
+    language=process_language_arg(args.language, args.model_name),
+    model_name=args.model_name,
+    batch_size=args.batch_size,
+    suppress_numerals=args.suppress_numerals,
+    tracker=SpeakerTracker(args.speaker_threshold, args.max_speakers),
+)
+
+audio = sys.stdin.buffer if args.audio == "-" else open(args.audio, "rb")
+output = sys.stdout if args.output is None else open(args.output, "a", encoding="utf-8")
+
+cue_index = 0
+
+
+def emit(cues, window_idx, latency, processing):
+    global cue_index
+    for cue in cues:
+        cue_index += 1
+        if args.output_format == "srt":
+            output.write(
+                srt_cue(
+                    cue_index,
+                    cue["speaker"],
+                    cue["start_time"],
+                    cue["end_time"],
+                    cue["text"],
+                )
+            )
+        else:
+            record = {
+                "type": "cue",
+                "window": window_idx,
+                "start": cue["start_time"] / 1000,
+                "end": cue["end_time"] / 1000,
+                "speaker": cue["speaker"],
+                "text": cue["text"],
+            }
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if args.output_format == "jsonl":
+        record = {
+            "type": "window",
+            "window": window_idx,
+            "cues": len(cues),
+            "latency_s": round(latency, 3),
+            "processing_s": round(processing, 3),
+        }
+        output.write(json.dumps(record) + "\n")
+    output.flush()
+    logging.info(
+        f"Window {window_idx}: {len(cues)} cues, {latency:.2f}s end-to-end latency"
+    )
+
+
+try:
+    window_idx = -1
+    for window_idx, (window, arrived) in enumerate(
+        read_windows(audio, args.window, args.follow, idle_timeout=args.idle_timeout)
+    ):
+        started = time.time()
+        cues = transcriber.process(window)
+        # latency from the moment the last sample of the window was read
+        emit(cues, window_idx, time.time() - arrived, time.time() - started)
+
+    # the word held back from the last window
+    started = time.time()
+    cues = transcriber.flush()
+    if cues:
+        emit(cues, window_idx + 1, time.time() - started, time.time() - started)
+finally:
+    if audio is not sys.stdin.buffer:
+        audio.close()
+    if output is not sys.stdout:
+        output.close()
+    models.close()
@@ -2,232 +2,79 @@ import json
 import logging
 import os
 import shutil
-
-import nltk
-import wget
-from omegaconf import OmegaConf
-from whisperx.alignment import DEFAULT_ALIGN_MODELS_HF, DEFAULT_ALIGN_MODELS_TORCH
-from whisperx.utils import LANGUAGES, TO_LANGUAGE_CODE
-
-punct_model_langs = [
-    "en",
-    "fr",
-    "de",
-    "es",
-    "it",
-    "nl",
-    "pt",
-    "bg",
-    "pl",
-    "cs",
-    "sk",
-    "sl",
-]
-wav2vec2_langs = list(DEFAULT_ALIGN_MODELS_TORCH.keys()) + list(
-    DEFAULT_ALIGN_MODELS_HF.keys()
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+from languages import (  # noqa: F401
+    LANGUAGES,
+    TO_LANGUAGE_CODE,
+    langs_to_iso,
+    punct_model_langs,
+    wav2vec2_langs,
+    whisper_langs,
 )
+from model_store import MODEL_STORE_ENV
+from transcript import Sentences, Transcript
 
-whisper_langs = sorted(LANGUAGES.keys()) + sorted(
-    [k.title() for k in TO_LANGUAGE_CODE.keys()]
+MSDD_DOMAIN_TYPE = "telephonic"  # Can be meeting, telephonic, or general based on domain type of the audio file
+MSDD_CONFIG_LOCAL_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "nemo_msdd_configs"
 )
 
-langs_to_iso = {
-    "aa": "aar",
-    "ab": "abk",
-    "ae": "ave",
-    "af": "afr",
-    "ak": "aka",
-    "am": "amh",
-    "an": "arg",
-    "ar": "ara",
-    "as": "asm",
-    "av": "ava",
-    "ay": "aym",
-    "az": "aze",
-    "ba": "bak",
-    "be": "bel",
-    "bg": "bul",
-    "bh": "bih",
-    "bi": "bis",
-    "bm": "bam",
-    "bn": "ben",
-    "bo": "tib",
-    "br": "bre",
-    "bs": "bos",
-    "ca": "cat",
-    "ce": "che",
-    "ch": "cha",
-    "co": "cos",
-    "cr": "cre",
-    "cs": "cze",
-    "cu": "chu",
-    "cv": "chv",
-    "cy": "wel",
-    "da": "dan",
-    "de": "ger",
-    "dv": "div",
-    "dz": "dzo",
-    "ee": "ewe",
-    "el": "gre",
-    "en": "eng",
-    "eo": "epo",
-    "es": "spa",
-    "et": "est",
-    "eu": "baq",
-    "fa": "per",
-    "ff": "ful",
-    "fi": "fin",
-    "fj": "fij",
-    "fo": "fao",
-    "fr": "fre",
-    "fy": "fry",
-    "ga": "gle",
-    "gd": "gla",
-    "gl": "glg",
-    "gn": "grn",
-    "gu": "guj",
-    "gv": "glv",
-    "ha": "hau",
-    "he": "heb",
-    "hi": "hin",
-    "ho": "hmo",
-    "hr": "hrv",
-    "ht": "hat",
-    "hu": "hun",
-    "hy": "arm",
-    "hz": "her",
-    "ia": "ina",
-    "id": "ind",
-    "ie": "ile",
-    "ig": "ibo",
-    "ii": "iii",
-    "ik": "ipk",
-    "io": "ido",
-    "is": "ice",
-    "it": "ita",
-    "iu": "iku",
-    "ja": "jpn",
-    "jv": "jav",
-    "ka": "geo",
-    "kg": "kon",
-    "ki": "kik",
-    "kj": "kua",
-    "kk": "kaz",
-    "kl": "kal",
-    "km": "khm",
-    "kn": "kan",
-    "ko": "kor",
-    "kr": "kau",
-    "ks": "kas",
-    "ku": "kur",
-    "kv": "kom",
-    "kw": "cor",
-    "ky": "kir",
-    "la": "lat",
-    "lb": "ltz",
-    "lg": "lug",
-    "li": "lim",
-    "ln": "lin",
-    "lo": "lao",
-    "lt": "lit",
-    "lu": "lub",
-    "lv": "lav",
-    "mg": "mlg",
-    "mh": "mah",
-    "mi": "mao",
-    "mk": "mac",
-    "ml": "mal",
-    "mn": "mon",
-    "mr": "mar",
-    "ms": "may",
-    "mt": "mlt",
-    "my": "bur",
-    "na": "nau",
-    "nb": "nob",
-    "nd": "nde",
-    "ne": "nep",
-    "ng": "ndo",
-    "nl": "dut",
-    "nn": "nno",
-    "no": "nor",
-    "nr": "nbl",
-    "nv": "nav",
-    "ny": "nya",
-    "oc": "oci",
-    "oj": "oji",
-    "om": "orm",
-    "or": "ori",
-    "os": "oss",
-    "pa": "pan",
-    "pi": "pli",
-    "pl": "pol",
-    "ps": "pus",
-    "pt": "por",
-    "qu": "que",
-    "rm": "roh",
-    "rn": "run",
-    "ro": "rum",
-    "ru": "rus",
-    "rw": "kin",
-    "sa": "san",
-    "sc": "srd",
-    "sd": "snd",
-    "se": "sme",
-    "sg": "sag",
-    "si": "sin",
-    "sk": "slo",
-    "sl": "slv",
-    "sm": "smo",
-    "sn": "sna",
-    "so": "som",
-    "sq": "alb",
-    "sr": "srp",
-    "ss": "ssw",
-    "st": "sot",
-    "su": "sun",
-    "sv": "swe",
-    "sw": "swa",
-    "ta": "tam",
-    "te": "tel",
-    "tg": "tgk",
-    "th": "tha",
-    "ti": "tir",
-    "tk": "tuk",
-    "tl": "tgl",
-    "tn": "tsn",
-    "to": "ton",
-    "tr": "tur",
-    "ts": "tso",
-    "tt": "tat",
-    "tw": "twi",
-    "ty": "tah",
-    "ug": "uig",
-    "uk": "ukr",
-    "ur": "urd",
-    "uz": "uzb",
-    "ve": "ven",
-    "vi": "vie",
-    "vo": "vol",
-    "wa": "wln",
-    "wo": "wol",
-    "xh": "xho",
-    "yi": "yid",
-    "yo": "yor",
-    "za": "zha",
-    "zh": "chi",
-    "zu": "zul",
-}
-
-
-def create_config(output_dir):
-    DOMAIN_TYPE = "telephonic"  # Can be meeting, telephonic, or general based on domain type of the audio file
-    CONFIG_LOCAL_DIRECTORY = "nemo_msdd_configs"
-    CONFIG_FILE_NAME = f"diar_infer_{DOMAIN_TYPE}.yaml"
-    MODEL_CONFIG_PATH = os.path.join(CONFIG_LOCAL_DIRECTORY, CONFIG_FILE_NAME)
+
+def msdd_config_directory():
+    """The MSDD config lives in the model store when one is used, see model_store.py."""
+    store = os.environ.get(MODEL_STORE_ENV)
+    if store:
+        return os.path.join(store, "nemo_msdd_configs")
+    return MSDD_CONFIG_LOCAL_DIRECTORY
+
+
+def msdd_config_path():
+    return os.path.join(msdd_config_directory(), f"diar_infer_{MSDD_DOMAIN_TYPE}.yaml")
+
+
+def download_msdd_config():
+    import wget
+
+    config_directory = msdd_config_directory()
+    os.makedirs(config_directory, exist_ok=True)
+    CONFIG_FILE_NAME = f"diar_infer_{MSDD_DOMAIN_TYPE}.yaml"
+    CONFIG_URL = f"https://raw.githubusercontent.com/NVIDIA/NeMo/main/examples/speaker_tasks/diarization/conf/inference/{CONFIG_FILE_NAME}"
+    # download next to the target and move it in place, concurrent jobs may race here
+    fd, download_path = tempfile.mkstemp(dir=config_directory, suffix=".yaml")
+    os.close(fd)
+    os.remove(download_path)
+    wget.download(CONFIG_URL, download_path)
+    os.replace(download_path, msdd_config_path())
+
+
+# speech regions found beforehand, NeMo reads them instead of running its own VAD
+SPEECH_RTTM_NAME = "speech.rttm"
+
+# max_num_speakers of the MSDD config, the most speakers estimated without a hint
+DEFAULT_MAX_SPEAKERS = 8
+
+
+def create_config(output_dir, oracle_vad: bool = False):
+    """
+    NeMo MSDD config diarizing the mono_file.wav in `output_dir`, estimating the
+    number of speakers until `set_speaker_counts` says otherwise.
+    """
+    from omegaconf import OmegaConf
+
+    MODEL_CONFIG_PATH = msdd_config_path()
     if not os.path.exists(MODEL_CONFIG_PATH):
-        os.makedirs(CONFIG_LOCAL_DIRECTORY, exist_ok=True)
-        CONFIG_URL = f"https://raw.githubusercontent.com/NVIDIA/NeMo/main/examples/speaker_tasks/diarization/conf/inference/{CONFIG_FILE_NAME}"
-        MODEL_CONFIG_PATH = wget.download(CONFIG_URL, MODEL_CONFIG_PATH)
+        if os.environ.get(MODEL_STORE_ENV):
+            raise FileNotFoundError(
+                f"{MODEL_CONFIG_PATH} is missing from the model store, fill it with "
+                "prefetch_models.py"
+            )
+        download_msdd_config()
 
     config = OmegaConf.load(MODEL_CONFIG_PATH)
 
@@ -240,25 +87,29 @@ def create_config(output_dir):
         "duration": None,
         "label": "infer",
         "text": "-",
-        "rttm_filepath": None,
+        "rttm_filepath": (
+            os.path.join(output_dir, SPEECH_RTTM_NAME) if oracle_vad else None
+        ),
         "uem_filepath": None,
     }
-    with open(os.path.join(data_dir, "input_manifest.json"), "w") as fp:
+    # both kinds of diarizer may share a workspace
+    manifest_name = "oracle_vad_manifest.json" if oracle_vad else "input_manifest.json"
+    with open(os.path.join(data_dir, manifest_name), "w") as fp:
         json.dump(meta, fp)
         fp.write("\n")
 
     pretrained_vad = "vad_multilingual_marblenet"
     pretrained_speaker_model = "titanet_large"
     config.num_workers = 0
-    config.diarizer.manifest_filepath = os.path.join(data_dir, "input_manifest.json")
+    config.diarizer.manifest_filepath = os.path.join(data_dir, manifest_name)
     config.diarizer.out_dir = (
         output_dir  # Directory to store intermediate files and prediction outputs
     )
 
     config.diarizer.speaker_embeddings.model_path = pretrained_speaker_model
-    config.diarizer.oracle_vad = (
-        False  # compute VAD provided with model_path to vad config
-    )
+    # compute VAD provided with model_path to vad config, or take the speech
+    # regions from the RTTM of the manifest
+    config.diarizer.oracle_vad = oracle_vad
     config.diarizer.clustering.parameters.oracle_num_speakers = False
 
     # Here, we use our in-house pretrained NeMo VAD model
@@ -273,6 +124,271 @@ def create_config(output_dir):
     return config
 
 
+# NeMo's label strings are captured, per thread, while it turns them into its
+# hypothesis, see `diarize_in_memory`
+_nemo_labels_lock = threading.Lock()
+_nemo_labels = threading.local()
+
+
+def label_turns(labels):
+    """
+    NeMo's "start end speaker_N" label strings as the (N, 3) int64 array of
+    turns, in the order and with the truncation of NeMo's RTTM file as it was
+    parsed before: the start and the duration are cut to whole ms after
+    rounding to the three decimals the RTTM holds.
+    """
+    turns = []
+    for label in sorted(labels, key=lambda label: float(label.split()[0])):
+        start, end, speaker = label.split()
+        start_ms = int(float(f"{float(start):.3f}") * 1000)
+        duration_ms = int(float(f"{float(end) - float(start):.3f}") * 1000)
+        turns.append((start_ms, start_ms + duration_ms, int(speaker.split("_")[-1])))
+    return np.array(turns, dtype=np.int64).reshape(-1, 3)
+
+
+def rttm_turns(rttm_path: str):
+    """The turns of NeMo's RTTM file as `label_turns` builds them."""
+    labels = []
+    with open(rttm_path) as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                start, duration = float(fields[3]), float(fields[4])
+                labels.append(f"{start} {start + duration} {fields[7]}")
+    return label_turns(labels)
+
+
+def _capture_nemo_labels(speaker_utils):
+    """
+    Wrap `speaker_utils.labels_to_pyannote_object` once so that it also hands
+    the label strings over to the thread running `diarize_in_memory`. Returns
+    False when the NeMo version doesn't have the functions this relies on.
+    """
+    with _nemo_labels_lock:
+        if getattr(speaker_utils, "_captures_labels", False):
+            return True
+        if not all(
+            hasattr(speaker_utils, name)
+            for name in ("labels_to_pyannote_object", "make_rttm_with_overlap")
+        ):
+            return False
+        labels_to_pyannote_object = speaker_utils.labels_to_pyannote_object
+
+        def capture_labels(hyp_labels, *args, **kwargs):
+            captured = getattr(_nemo_labels, "captured", None)
+            if captured is not None:
+                captured.extend(hyp_labels)
+            return labels_to_pyannote_object(hyp_labels, *args, **kwargs)
+
+        speaker_utils.labels_to_pyannote_object = capture_labels
+        speaker_utils._captures_labels = True
+        return True
+
+
+def diarize_in_memory(msdd_model):
+    """
+    Run NeMo's `NeuralDiarizer.diarize` and return its speaker turns as an (N, 3)
+    int64 array of start_ms, end_ms and speaker id.
+
+    The turns are built from the label strings NeMo would write to its RTTM
+    file, instead of writing it and parsing it back, and the hypothesis isn't
+    scored against the manifest's RTTM, which holds no reference here. NeMo's
+    pyannote hypothesis isn't used, it keeps one label per segment and so drops
+    overlapping speakers with the same start and end. This follows the internals
+    of the pinned nemo_toolkit 2.0.0rc0, with other versions lacking them the
+    diarizer's own `diarize` writes the RTTM file and it is read back.
+    """
+    import torch
+    from nemo.collections.asr.parts.utils import speaker_utils
+
+    if not _capture_nemo_labels(speaker_utils) or not all(
+        hasattr(msdd_model, name)
+        for name in ("get_emb_clus_infer", "run_pairwise_diarization")
+    ):
+        return diarize_to_rttm(msdd_model)
+
+    with torch.no_grad():
+        msdd_model.clustering_embedding.prepare_cluster_embs_infer()
+        msdd_model.msdd_model.pairwise_infer = True
+        msdd_model.get_emb_clus_infer(msdd_model.clustering_embedding)
+        preds_list, _, _ = msdd_model.run_pairwise_diarization()
+
+    # the RTTM NeMo writes is that of its last threshold
+    threshold = list(msdd_model._cfg.diarizer.msdd_model.parameters.sigmoid_threshold)[
+        -1
+    ]
+    _nemo_labels.captured = labels = []
+    try:
+        speaker_utils.make_rttm_with_overlap(
+            msdd_model.msdd_model.cfg.test_ds.manifest_filepath,
+            msdd_model.msdd_model.clus_label_dict,
+            preds_list,
+            threshold=threshold,
+            infer_overlap=True,
+            use_clus_as_main=msdd_model.use_clus_as_main,
+            overlap_infer_spk_limit=msdd_model.overlap_infer_spk_limit,
+            use_adaptive_thres=msdd_model.use_adaptive_thres,
+            max_overlap_spks=msdd_model.max_overlap_spks,
+            out_rttm_dir=None,
+        )
+    finally:
+        _nemo_labels.captured = None
+    if not labels:
+        # NeMo fails before this without speech, no labels means the hook missed
+        logging.warning("NeMo's speaker labels weren't captured, writing its RTTM")
+        return diarize_to_rttm(msdd_model)
+    return label_turns(labels)
+
+
+def diarize_to_rttm(msdd_model):
+    """Run NeMo's `NeuralDiarizer.diarize` and read the RTTM file it writes."""
+    msdd_model.diarize()
+    return rttm_turns(
+        os.path.join(msdd_model._cfg.diarizer.out_dir, "pred_rttms", "mono_file.rttm")
+    )
+
+
+def set_speaker_counts(msdd_model, num_speakers: int = None, max_speakers: int = None):
+    """
+    Make the next run of a diarizer from `create_config` look for exactly
+    `num_speakers` speakers, or estimate up to `max_speakers` of them.
+
+    NeMo's clustering reads its parameters from the config and the number of
+    speakers from the manifest on every run, so one loaded diarizer serves every
+    hint.
+    """
+    config = msdd_model._cfg
+    parameters = config.diarizer.clustering.parameters
+    parameters.oracle_num_speakers = num_speakers is not None
+    parameters.max_num_speakers = max(
+        num_speakers or 0, max_speakers or DEFAULT_MAX_SPEAKERS
+    )
+
+    with open(config.diarizer.manifest_filepath) as fp:
+        meta = json.loads(fp.readline())
+    meta.pop("num_speakers", None)
+    if num_speakers is not None:
+        meta["num_speakers"] = num_speakers
+    with open(config.diarizer.manifest_filepath, "w") as fp:
+        json.dump(meta, fp)
+        fp.write("\n")
+
+
+# the ClusteringDiarizer methods `reused_embeddings` replaces
+REUSED_EMBEDDINGS_METHODS = (
+    "_perform_speech_activity_detection",
+    "_run_segmentation",
+    "_extract_embeddings",
+)
+
+
+def can_reuse_embeddings(clustering_diarizer):
+    """Whether `reused_embeddings` works with this NeMo version's diarizer."""
+    return all(
+        callable(getattr(clustering_diarizer, name, None))
+        for name in REUSED_EMBEDDINGS_METHODS
+    ) and isinstance(
+        getattr(clustering_diarizer, "multiscale_embeddings_and_timestamps", None),
+        dict,
+    )
+
+
+@contextmanager
+def reused_embeddings(clustering_diarizer):
+    """
+    Make the next run of NeMo's `ClusteringDiarizer` cluster the embeddings of
+    its last run again, skipping the VAD, the segmentation and the embedding
+    extraction.
+
+    The methods are replaced on this diarizer only, not on its class, so the
+    diarizers running in other threads are left alone.
+    """
+    if any(name in vars(clustering_diarizer) for name in REUSED_EMBEDDINGS_METHODS):
+        raise RuntimeError("The diarizer already reuses its embeddings")
+    saved = dict(clustering_diarizer.multiscale_embeddings_and_timestamps)
+
+    def extract_embeddings(manifest_file, scale_idx, num_scales):
+        embeddings, time_stamps = saved[scale_idx]
+        clustering_diarizer.embeddings = embeddings
+        clustering_diarizer.time_stamps = time_stamps
+
+    skipped = {
+        "_perform_speech_activity_detection": lambda: None,
+        "_run_segmentation": lambda *args, **kwargs: None,
+        "_extract_embeddings": extract_embeddings,
+    }
+    for name, method in skipped.items():
+        setattr(clustering_diarizer, name, method)
+    try:
+        yield
+    finally:
+        for name in skipped:
+            delattr(clustering_diarizer, name)
+
+
+def diarize_with_speaker_counts(
+    msdd_model,
+    num_speakers: int = None,
+    min_speakers: int = None,
+    max_speakers: int = None,
+):
+    """
+    `diarize_in_memory` with the speaker count hints, one clustering for
+    `num_speakers` speakers or estimating up to `max_speakers` of them.
+
+    NeMo's clustering has no minimum number of speakers, when it estimates fewer
+    than `min_speakers` the embeddings of the first run are clustered again for
+    exactly `min_speakers` by the same diarizer, or diarized again from scratch
+    when this NeMo version's diarizer doesn't allow reusing them.
+    """
+    set_speaker_counts(msdd_model, num_speakers, max_speakers)
+    speaker_ts = diarize_in_memory(msdd_model)
+    if num_speakers is None and min_speakers is not None:
+        found = len(np.unique(speaker_ts[:, 2]))
+        if 0 < found < min_speakers:
+            logging.info(
+                f"Found {found} speakers, fewer than the minimum of {min_speakers}, "
+                f"clustering again for {min_speakers} speakers"
+            )
+            set_speaker_counts(msdd_model, min_speakers, max_speakers)
+            clustering_diarizer = msdd_model.clustering_embedding.clus_diar_model
+            if not can_reuse_embeddings(clustering_diarizer):
+                logging.warning("Can't reuse NeMo's embeddings, diarizing again")
+                return diarize_in_memory(msdd_model)
+            with reused_embeddings(clustering_diarizer):
+                speaker_ts = diarize_in_memory(msdd_model)
+    return speaker_ts
+
+
+def check_speaker_counts(
+    num_speakers: int = None, min_speakers: int = None, max_speakers: int = None
+):
+    """Raise a ValueError when the speaker count hints contradict each other."""
+    for name, value in (
+        ("num_speakers", num_speakers),
+        ("min_speakers", min_speakers),
+        ("max_speakers", max_speakers),
+    ):
+        if value is not None and value < 1:
+            raise ValueError(f"{name} must be at least 1, got {value}")
+    if num_speakers is not None and (
+        min_speakers is not None or max_speakers is not None
+    ):
+        raise ValueError("num_speakers can't be combined with min or max_speakers")
+    if (
+        min_speakers is not None
+        and max_speakers is not None
+        and min_speakers > max_speakers
+    ):
+        raise ValueError(
+            f"min_speakers {min_speakers} is larger than max_speakers {max_speakers}"
+        )
+
+
+# the point of a word that places it in a speaker turn, see get_words_speaker_mapping
+WORD_ANCHORS = ("start", "mid", "end", "overlap")
+
+
 def get_word_ts_anchor(s, e, option="start"):
     if option == "end":
         return e
@@ -282,169 +398,255 @@ def get_word_ts_anchor(s, e, option="start"):
 
 
 def get_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
-    s, e, sp = spk_ts[0]
-    wrd_pos, turn_idx = 0, 0
-    wrd_spk_mapping = []
-    for wrd_dict in wrd_ts:
-        ws, we, wrd = (
-            int(wrd_dict["start"] * 1000),
-            int(wrd_dict["end"] * 1000),
-            wrd_dict["text"],
+    """
+    Assign every word of the aligned `wrd_ts` to a speaker turn, returns them as
+    a `Transcript`.
+
+    With the "start", "mid" or "end" anchor a word goes to the first turn, at or
+    after the previous word's turn, that ends at or after the anchor. The words
+    are assigned all at once with numpy when the turns end in order, which is the
+    case for the non-overlapping turns NeMo outputs, with the same results as the
+    word by word walk used otherwise. With "overlap" a word goes to the turn it
+    overlaps the most, words overlapping no turn fall back to the "start" anchor.
+    Without any turns, when no speech was found, the transcript is empty.
+    """
+    if len(spk_ts) == 0 and wrd_ts:
+        logging.warning(
+            f"No speaker turns were found, dropping {len(wrd_ts)} transcribed words"
+        )
+    if not wrd_ts or len(spk_ts) == 0:
+        return Transcript([], [], [], [])
+    starts = np.array([wrd_dict["start"] for wrd_dict in wrd_ts], dtype=np.float64)
+    ends = np.array([wrd_dict["end"] for wrd_dict in wrd_ts], dtype=np.float64)
+    # same truncation as int(x * 1000)
+    ws = (starts * 1000).astype(np.int64)
+    we = (ends * 1000).astype(np.int64)
+    turn_starts = np.array([s for s, _, _ in spk_ts], dtype=np.float64)
+    turn_ends = np.array([e for _, e, _ in spk_ts], dtype=np.float64)
+    turn_speakers = np.array([sp for _, _, sp in spk_ts], dtype=np.int64)
+
+    if word_anchor_option == "overlap":
+        turn_idx = _max_overlap_turns(ws, we, turn_starts, turn_ends)
+        unassigned = turn_idx < 0
+        if unassigned.any():
+            turn_idx[unassigned] = _anchor_turns(
+                ws, we, turn_ends, spk_ts, wrd_ts, "start"
+            )[unassigned]
+    else:
+        turn_idx = _anchor_turns(ws, we, turn_ends, spk_ts, wrd_ts, word_anchor_option)
+
+    return Transcript(
+        [wrd_dict["text"] for wrd_dict in wrd_ts], ws, we, turn_speakers[turn_idx]
+    )
+
+
+def _anchor_turns(ws, we, turn_ends, spk_ts, wrd_ts, word_anchor_option):
+    if np.any(np.diff(turn_ends) < 0):
+        return np.array(
+            _walk_anchor_turns(ws.tolist(), we.tolist(), spk_ts, word_anchor_option)
         )
-        wrd_pos = get_word_ts_anchor(ws, we, word_anchor_option)
+    anchors = get_word_ts_anchor(
+        ws.astype(np.float64), we.astype(np.float64), word_anchor_option
+    )
+    # the first turn ending at or after the anchor, the turn never moves back and
+    # the last turn takes every word after it
+    turn_idx = np.maximum.accumulate(np.searchsorted(turn_ends, anchors, "left"))
+    return np.minimum(turn_idx, len(spk_ts) - 1)
+
+
+def _walk_anchor_turns(ws, we, spk_ts, word_anchor_option):
+    s, e, sp = spk_ts[0]
+    turn_idx = 0
+    turn_indices = []
+    for word_start, word_end in zip(ws, we):
+        wrd_pos = get_word_ts_anchor(word_start, word_end, word_anchor_option)
         while wrd_pos > float(e):
             turn_idx += 1
             turn_idx = min(turn_idx, len(spk_ts) - 1)
             s, e, sp = spk_ts[turn_idx]
             if turn_idx == len(spk_ts) - 1:
-                e = get_word_ts_anchor(ws, we, option="end")
-        wrd_spk_mapping.append(
-            {"word": wrd, "start_time": ws, "end_time": we, "speaker": sp}
+                e = get_word_ts_anchor(word_start, word_end, option="end")
+        turn_indices.append(turn_idx)
+    return turn_indices
+
+
+def _max_overlap_turns(ws, we, turn_starts, turn_ends):
+    """Index of the turn each word overlaps the most, -1 for words overlapping none."""
+    order = np.argsort(turn_starts, kind="stable")
+    sorted_starts, sorted_ends = turn_starts[order], turn_ends[order]
+    # candidate turns start before the word ends and end after it starts
+    first = np.searchsorted(np.maximum.accumulate(sorted_ends), ws, "right")
+    last = np.searchsorted(sorted_starts, we, "left")
+
+    best_idx = np.full(len(ws), -1, dtype=np.int64)
+    best_overlap = np.zeros(len(ws), dtype=np.float64)
+    for offset in range(int(np.max(last - first, initial=0))):
+        candidate = first + offset
+        valid = candidate < last
+        candidate = np.minimum(candidate, len(order) - 1)
+        overlap = np.minimum(we, sorted_ends[candidate]) - np.maximum(
+            ws, sorted_starts[candidate]
         )
-    return wrd_spk_mapping
+        better = valid & (overlap > best_overlap)
+        best_idx[better] = order[candidate[better]]
+        best_overlap[better] = overlap[better]
+    return best_idx
 
 
 sentence_ending_punctuations = ".?!"
 
 
-def get_first_word_idx_of_sentence(word_idx, word_list, speaker_list, max_words):
-    is_word_sentence_end = (
-        lambda x: x >= 0 and word_list[x][-1] in sentence_ending_punctuations
-    )
-    left_idx = word_idx
-    while (
-        left_idx > 0
-        and word_idx - left_idx < max_words
-        and speaker_list[left_idx - 1] == speaker_list[left_idx]
-        and not is_word_sentence_end(left_idx - 1)
-    ):
-        left_idx -= 1
-
-    return left_idx if left_idx == 0 or is_word_sentence_end(left_idx - 1) else -1
+def get_realigned_ws_mapping_with_punctuation(
+    transcript: Transcript, max_words_in_sentence=50
+):
+    """
+    Give each sentence that changes speaker midway to its majority speaker.
 
+    Only sentences of at most `max_words_in_sentence` words are realigned, and
+    only when the majority speaker has at least half of the words. The speakers
+    of `transcript` are updated in place and it is returned.
+    """
+    speakers = transcript.speaker
+    if not len(speakers):
+        return transcript
 
-def get_last_word_idx_of_sentence(word_idx, word_list, max_words):
-    is_word_sentence_end = (
-        lambda x: x >= 0 and word_list[x][-1] in sentence_ending_punctuations
+    # a sentence ends with punctuation or with the transcript
+    is_end = transcript.vocabulary_mask(
+        lambda word: bool(word) and word[-1] in sentence_ending_punctuations
     )
-    right_idx = word_idx
-    while (
-        right_idx < len(word_list) - 1
-        and right_idx - word_idx < max_words
-        and not is_word_sentence_end(right_idx)
+    is_end[-1] = True
+    sentence_ends = np.flatnonzero(is_end)
+    sentence_starts = np.concatenate(([0], sentence_ends[:-1] + 1))
+    sentence_idx = np.cumsum(is_end) - is_end
+
+    mixed = np.zeros(len(sentence_starts), dtype=bool)
+    mixed[sentence_idx[speakers != speakers[sentence_starts][sentence_idx]]] = True
+    mixed &= sentence_ends - sentence_starts + 1 <= max_words_in_sentence
+
+    for left_idx, right_idx in zip(
+        sentence_starts[mixed].tolist(), sentence_ends[mixed].tolist()
     ):
-        right_idx += 1
+        spk_labels = speakers[left_idx : right_idx + 1].tolist()
+        spk_counts = Counter(spk_labels)
+        # same tie breaking as max(set(spk_labels), key=spk_labels.count)
+        mod_speaker = max(set(spk_labels), key=spk_counts.__getitem__)
+        if spk_counts[mod_speaker] < len(spk_labels) // 2:
+            continue
+        speakers[left_idx : right_idx + 1] = mod_speaker
 
-    return (
-        right_idx
-        if right_idx == len(word_list) - 1 or is_word_sentence_end(right_idx)
-        else -1
-    )
+    return transcript
 
 
-def get_realigned_ws_mapping_with_punctuation(
-    word_speaker_mapping, max_words_in_sentence=50
-):
-    is_word_sentence_end = (
-        lambda x: x >= 0
-        and word_speaker_mapping[x]["word"][-1] in sentence_ending_punctuations
-    )
-    wsp_len = len(word_speaker_mapping)
-
-    words_list, speaker_list = [], []
-    for k, line_dict in enumerate(word_speaker_mapping):
-        word, speaker = line_dict["word"], line_dict["speaker"]
-        words_list.append(word)
-        speaker_list.append(speaker)
-
-    k = 0
-    while k < len(word_speaker_mapping):
-        line_dict = word_speaker_mapping[k]
-        if (
-            k < wsp_len - 1
-            and speaker_list[k] != speaker_list[k + 1]
-            and not is_word_sentence_end(k)
-        ):
-            left_idx = get_first_word_idx_of_sentence(
-                k, words_list, speaker_list, max_words_in_sentence
-            )
-            right_idx = (
-                get_last_word_idx_of_sentence(
-                    k, words_list, max_words_in_sentence - k + left_idx - 1
-                )
-                if left_idx > -1
-                else -1
-            )
-            if min(left_idx, right_idx) == -1:
-                k += 1
-                continue
-
-            spk_labels = speaker_list[left_idx : right_idx + 1]
-            mod_speaker = max(set(spk_labels), key=spk_labels.count)
-            if spk_labels.count(mod_speaker) < len(spk_labels) // 2:
-                k += 1
-                continue
-
-            speaker_list[left_idx : right_idx + 1] = [mod_speaker] * (
-                right_idx - left_idx + 1
-            )
-            k = right_idx
+class SentenceBreakDetector:
+    """
+    Incremental `PunktSentenceTokenizer.text_contains_sentbreak` for a sentence
+    that grows one word at a time.
 
-        k += 1
+    Punkt decides whether a token ends a sentence from that token and the one
+    after it, so each new word only needs the last token before it annotated
+    again instead of re-tokenizing the whole sentence.
+    """
 
-    k, realigned_list = 0, []
-    while k < len(word_speaker_mapping):
-        line_dict = word_speaker_mapping[k].copy()
-        line_dict["speaker"] = speaker_list[k]
-        realigned_list.append(line_dict)
-        k += 1
+    def __init__(self):
+        import nltk
+
+        self._tokenizer = nltk.tokenize.PunktSentenceTokenizer()
+        self.reset()
+
+    def reset(self):
+        """Start an empty sentence."""
+        self._words = []
+        self._last_token = None
+        # a token before the last one ends a sentence
+        self._broken = False
+        # words that don't split into tokens on their own fall back to re-scanning
+        self._rescan = False
+        self._pending = None
+
+    def breaks_with(self, word: str):
+        """Whether the sentence followed by `word` contains a sentence break."""
+        if self._rescan or self._needs_rescan(word):
+            return self._tokenizer.text_contains_sentbreak(
+                "".join(w + " " for w in self._words) + " " + word
+            )
+        broken, last_token = self._annotate(word)
+        self._pending = (word, broken, last_token)
+        return broken
+
+    def add(self, word: str):
+        """Append `word` to the sentence."""
+        if not self._rescan and self._needs_rescan(word):
+            self._rescan = True
+        if not self._rescan:
+            if self._pending is not None and self._pending[0] == word:
+                _, self._broken, self._last_token = self._pending
+            else:
+                self._broken, self._last_token = self._annotate(word)
+        self._pending = None
+        self._words.append(word)
+
+    def _needs_rescan(self, word: str):
+        # an ellipsis written as ". . ." is a single token spanning words
+        return (
+            word.split() != [word]
+            or bool(self._words)
+            and self._words[-1].endswith(".")
+            and word.startswith(".")
+        )
 
-    return realigned_list
+    def _annotate(self, word: str):
+        tokens = self._tokenizer._lang_vars.word_tokenize(word)
+        if self._last_token is not None:
+            tokens.insert(0, self._last_token)
+        annotated = list(
+            self._tokenizer._annotate_tokens(
+                self._tokenizer._Token(tok) for tok in tokens
+            )
+        )
+        broken = self._broken or any(tok.sentbreak for tok in annotated[:-1])
+        return broken, tokens[-1] if tokens else self._last_token
 
 
-def get_sentences_speaker_mapping(word_speaker_mapping, spk_ts):
-    sentence_checker = nltk.tokenize.PunktSentenceTokenizer().text_contains_sentbreak
-    s, e, spk = spk_ts[0]
+def get_sentences_speaker_mapping(transcript: Transcript, spk_ts):
+    """
+    Split the words of `transcript` into sentences, at every speaker change and
+    sentence break, returns them as `Sentences`, none without any turns.
+    """
+    if len(spk_ts) == 0:
+        return Sentences(transcript, [], [], [], [], [])
+    sentence_checker = SentenceBreakDetector()
+    s, e, spk = (int(value) for value in spk_ts[0])
     prev_spk = spk
 
-    snts = []
-    snt = {"speaker": f"Speaker {spk}", "start_time": s, "end_time": e, "text": ""}
-
-    for wrd_dict in word_speaker_mapping:
-        wrd, spk = wrd_dict["word"], wrd_dict["speaker"]
-        s, e = wrd_dict["start_time"], wrd_dict["end_time"]
-        if spk != prev_spk or sentence_checker(snt["text"] + " " + wrd):
-            snts.append(snt)
-            snt = {
-                "speaker": f"Speaker {spk}",
-                "start_time": s,
-                "end_time": e,
-                "text": "",
-            }
+    starts, ends, speakers, word_starts = [s], [e], [spk], [0]
+
+    for k, (wrd, spk, s, e) in enumerate(
+        zip(
+            transcript.words(),
+            transcript.speaker.tolist(),
+            transcript.start_time.tolist(),
+            transcript.end_time.tolist(),
+        )
+    ):
+        if spk != prev_spk or sentence_checker.breaks_with(wrd):
+            starts.append(s)
+            ends.append(e)
+            speakers.append(spk)
+            word_starts.append(k)
+            sentence_checker.reset()
         else:
-            snt["end_time"] = e
-        snt["text"] += wrd + " "
+            ends[-1] = e
+        sentence_checker.add(wrd)
         prev_spk = spk
 
-    snts.append(snt)
-    return snts
-
-
-def get_speaker_aware_transcript(sentences_speaker_mapping, f):
-    previous_speaker = sentences_speaker_mapping[0]["speaker"]
-    f.write(f"{previous_speaker}: ")
-
-    for sentence_dict in sentences_speaker_mapping:
-        speaker = sentence_dict["speaker"]
-        sentence = sentence_dict["text"]
-
-        # If this speaker doesn't match the previous one, start a new paragraph
-        if speaker != previous_speaker:
-            f.write(f"\n\n{speaker}: ")
-            previous_speaker = speaker
-
-        # No matter what, write the current sentence
-        f.write(sentence + " ")
+    return Sentences(
+        transcript,
+        starts,
+        ends,
+        speakers,
+        word_starts,
+        word_starts[1:] + [len(transcript)],
+    )
 
 
 def format_timestamp(
@@ -467,23 +669,6 @@ def format_timestamp(
     )
 
 
-def write_srt(transcript, file):
-    """
-    Write a transcript to a file in SRT format.
-
-    """
-    for i, segment in enumerate(transcript, start=1):
-        # write srt lines
-        print(
-            f"{i}\n"
-            f"{format_timestamp(segment['start_time'], always_include_hours=True, decimal_marker=',')} --> "
-            f"{format_timestamp(segment['end_time'], always_include_hours=True, decimal_marker=',')}\n"
-            f"{segment['speaker']}: {segment['text'].strip().replace('-->', '->')}\n",
-            file=file,
-            flush=True,
-        )
-
-
 def find_numeral_symbol_tokens(tokenizer):
     numeral_symbol_tokens = [
         -1,
@@ -546,6 +731,28 @@ def filter_missing_timestamps(
     return result
 
 
+def get_temp_root(min_free_bytes: int = 2 * 1024**3):
+    """
+    Directory to create job scratch directories in.
+
+    tmpfs (/dev/shm) is used when it is writable and has `min_free_bytes` free, so the
+    intermediate files never touch the disk, otherwise the system temp directory.
+    """
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        stat = os.statvfs(shm)
+        if stat.f_bavail * stat.f_frsize >= min_free_bytes:
+            return shm
+    return tempfile.gettempdir()
+
+
+def create_temp_dir(root: str = None, prefix: str = "whisper_diarization_"):
+    """Create a scratch directory private to one job, under `root` if given."""
+    if root is not None:
+        os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=root or get_temp_root())
+
+
 def cleanup(path: str):
     """path could either be relative or absolute."""
     # check if file or directory exists
@@ -559,6 +766,57 @@ def cleanup(path: str):
         raise ValueError("Path {} is not a file or dir.".format(path))
 
 
+def default_device():
+    """'cuda' if a GPU is available, otherwise 'cpu'."""
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+# torch's intra-op thread count is process wide, see torch_threads
+_torch_threads_lock = threading.Lock()
+# the counts of the torch_threads blocks running now, in the order they started
+_torch_threads_active = []
+_torch_threads_default = None
+
+
+@contextmanager
+def torch_threads(num_threads: int = None):
+    """
+    Run the block with `num_threads` torch intra-op threads. Without
+    `num_threads` the count is left alone.
+
+    torch's thread count applies to the whole process, not to the calling
+    thread, so blocks running at the same time in different threads share the
+    count of the one started last. The lock is only held while the count is
+    changed, the blocks themselves run in parallel. When a block ends the count
+    goes back to that of the latest block still running, or to the count from
+    before the first one once none is left.
+    """
+    global _torch_threads_default
+
+    if num_threads is None:
+        yield
+        return
+    import torch
+
+    with _torch_threads_lock:
+        if not _torch_threads_active:
+            _torch_threads_default = torch.get_num_threads()
+        _torch_threads_active.append(num_threads)
+        torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        with _torch_threads_lock:
+            _torch_threads_active.remove(num_threads)
+            torch.set_num_threads(
+                _torch_threads_active[-1]
+                if _torch_threads_active
+                else _torch_threads_default
+            )
+
+
 def process_language_arg(language: str, model_name: str):
     """
     Process the language argument to make sure it's valid and convert language names to language codes.
@@ -0,0 +1,484 @@
+import argparse
+import json
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from helpers import cleanup, create_temp_dir
+from pipeline import (
+    MODEL_KINDS,
+    SAMPLE_RATE,
+    ModelManager,
+    _job_steps,
+    _new_job,
+    align,
+    detect_speech,
+    diarize,
+    pipeline_options,
+    separate_vocals,
+    speech_regions,
+    transcribe,
+)
+from stage_cache import StageCache
+from stage_profiler import StageProfiler
+from streaming import embed_segments, load_speaker_model
+
+
+def decode_to_file(audio_path: str, samples_path: str, block_size: int = 1 << 22):
+    """
+    Decode an audio file to 16kHz mono float32 samples in a raw file, a block at
+    a time, so the whole recording is never held in memory. Returns the number of
+    samples.
+    """
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads",
+        "0",
+        "-i",
+        audio_path,
+        "-f",
+        "s16le",
+        "-ac",
+        "1",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-",
+    ]
+    num_samples = 0
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    ) as process, open(samples_path, "wb") as f:
+        while True:
+            block = process.stdout.read(block_size)
+            if not block:
+                break
+            # the same scaling as whisperx.load_audio
+            samples = np.frombuffer(block, "<i2").astype(np.float32) / 32768.0
+            samples.tofile(f)
+            num_samples += len(samples)
+    if process.returncode:
+        raise RuntimeError(f"ffmpeg failed to decode {audio_path}")
+    return num_samples
+
+
+def find_split_points(
+    samples,
+    chunk_length: float = 1800,
+    search: float = 60,
+    frame_length: float = 0.5,
+):
+    """
+    Split points roughly every `chunk_length` seconds, each placed in the quietest
+    `frame_length` second frame within `search` seconds of its target, so chunks
+    end in a pause rather than mid-word. Returns the sample indices.
+    """
+    chunk_samples = int(chunk_length * SAMPLE_RATE)
+    search_samples = int(search * SAMPLE_RATE)
+    frame_samples = int(frame_length * SAMPLE_RATE)
+    points, target = [], chunk_samples
+    # a last chunk shorter than the search range is not worth splitting off
+    while target + search_samples < len(samples):
+        region_start = target - search_samples
+        region = np.asarray(samples[region_start : target + search_samples])
+        num_frames = len(region) // frame_samples
+        energy = np.square(
+            region[: num_frames * frame_samples].reshape(num_frames, frame_samples)
+        ).mean(1)
+        split = region_start + int(energy.argmin()) * frame_samples + frame_samples // 2
+        points.append(split)
+        target = split + chunk_samples
+    return points
+
+
+def speaker_embeddings(
+    models: ModelManager,
+    audio,
+    speaker_ts,
+    max_speech: float = 30,
+    segment_length: float = 3,
+):
+    """
+    A TitaNet embedding of every speaker in `speaker_ts`, the mean of the
+    embeddings of up to `max_speech` seconds of their longest turns, cut into
+    `segment_length` second segments. Speakers with too little speech are left
+    out.
+    """
+    spans, owners = [], []
+    for speaker in sorted({speaker for _, _, speaker in speaker_ts}):
+        turns = sorted(
+            (
+                (start / 1000, end / 1000)
+                for start, end, turn_speaker in speaker_ts
+                if turn_speaker == speaker
+            ),
+            key=lambda turn: turn[0] - turn[1],
+        )
+        speech = 0.0
+        for start, end in turns:
+            for segment_start in np.arange(start, end - 0.5, segment_length):
+                segment_end = min(segment_start + segment_length, end)
+                spans.append((segment_start, segment_end))
+                owners.append(speaker)
+                speech += segment_end - segment_start
+            if speech >= max_speech:
+                break
+    if not spans:
+        return {}
+
+    speaker_model = load_speaker_model(models)
+    embeddings = np.concatenate(
+        [
+            embed_segments(speaker_model, audio, spans[idx : idx + 64])
+            for idx in range(0, len(spans), 64)
+        ]
+    )
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+    owners = np.array(owners)
+    return {
+        int(speaker): embeddings[owners == speaker].mean(0)
+        for speaker in np.unique(owners)
+    }
+
+
+def stitch_speakers(
+    chunk_embeddings,
+    threshold: float = 0.6,
+    min_speakers: int = None,
+    max_speakers: int = None,
+):
+    """
+    Map the speakers of every chunk to speakers of the whole recording.
+
+    `chunk_embeddings` holds a {speaker: embedding} dict per chunk. The speakers
+    are clustered agglomeratively by the cosine similarity of their mean
+    embeddings until no two clusters reach `threshold`, or while there are more
+    than `max_speakers` clusters, but never below `min_speakers`. Two speakers of
+    the same chunk are never merged, the diarizer already told them apart. Returns a
+    {(chunk index, speaker): global speaker} dict, the global speakers numbered in
+    order of appearance.
+    """
+    clusters = [
+        {"members": [(chunk_idx, speaker)], "chunks": {chunk_idx}, "sum": embedding}
+        for chunk_idx, embeddings in enumerate(chunk_embeddings)
+        for speaker, embedding in embeddings.items()
+    ]
+    while len(clusters) > max(1, min_speakers or 1):
+        centroids = np.stack([cluster["sum"] for cluster in clusters])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-8
+        similarities = centroids @ centroids.T
+        for i, cluster in enumerate(clusters):
+            for j in range(i, len(clusters)):
+                if i == j or cluster["chunks"] & clusters[j]["chunks"]:
+                    similarities[i, j] = similarities[j, i] = -np.inf
+        i, j = np.unravel_index(similarities.argmax(), similarities.shape)
+        if similarities[i, j] == -np.inf:
+            break
+        if similarities[i, j] < threshold and (
+            max_speakers is None or len(clusters) <= max_speakers
+        ):
+            break
+        i, j = min(i, j), max(i, j)
+        clusters[i]["members"] += clusters[j]["members"]
+        clusters[i]["chunks"] |= clusters[j]["chunks"]
+        clusters[i]["sum"] = clusters[i]["sum"] + clusters[j]["sum"]
+        del clusters[j]
+
+    clusters.sort(key=lambda cluster: min(cluster["members"]))
+    return {
+        member: global_speaker
+        for global_speaker, cluster in enumerate(clusters)
+        for member in cluster["members"]
+    }
+
+
+class ChunkWorkers:
+    """
+    Processes chunks in `long_audio.py` subprocesses, each holding its own models.
+
+    Every calling thread gets a process of its own, started on first use and kept
+    running with its models loaded until `close`. A chunk is handed over as a
+    JSON line and its result comes back pickled in the chunk's `result_path`.
+    """
+
+    def __init__(self, device: str, temp_root: str = None):
+        self.device = device
+        self.temp_root = temp_root
+        self._local = threading.local()
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def _process(self):
+        if not hasattr(self._local, "process"):
+            command = [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--device",
+                self.device,
+            ]
+            if self.temp_root is not None:
+                command += ["--temp-dir", self.temp_root]
+            self._local.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+            )
+            with self._lock:
+                self._processes.append(self._local.process)
+        return self._local.process
+
+    def __call__(self, chunk: dict):
+        process = self._process()
+        process.stdin.write(json.dumps(chunk) + "\n")
+        process.stdin.flush()
+        for line in process.stdout:
+            if not line.startswith("CHUNK_RESULT"):
+                # pass the models' own logging through
+                sys.stdout.write(line)
+                continue
+            result = json.loads(line.split(" ", 1)[1])
+            if result["status"] != "ok":
+                raise RuntimeError(
+                    f"Chunk processing failed with the following error: {result['error']}"
+                )
+            with open(chunk["result_path"], "rb") as f:
+                return pickle.load(f)
+        raise RuntimeError(f"long_audio.py exited with return code {process.wait()}")
+
+    def close(self):
+        with self._lock:
+            for process in self._processes:
+                process.stdin.close()
+                process.wait()
+            self._processes = []
+
+
+def process_chunk(models: ModelManager, chunk: dict):
+    """Separate, transcribe, align and diarize one chunk of a long recording."""
+    options = chunk["options"]
+    samples = np.memmap(chunk["samples_path"], dtype=np.float32, mode="r")
+    audio = np.array(samples[chunk["start"] : chunk["end"]])
+    del samples
+    temp_path = create_temp_dir(models.temp_root)
+    try:
+        if options["stemming"]:
+            # demucs separates the original audio, not the 16kHz decoded samples
+            try:
+                vocals = separate_vocals(
+                    models,
+                    chunk["audio_path"],
+                    num_threads=options["stem_threads"],
+                    offset=chunk["start"] / SAMPLE_RATE,
+                    duration=len(audio) / SAMPLE_RATE,
+                )
+                audio = np.pad(
+                    vocals[: len(audio)], (0, max(len(audio) - len(vocals), 0))
+                )
+            except Exception:
+                logging.exception(
+                    "Source splitting failed, using original audio file. Use --no-stem argument to disable it."
+                )
+
+        speech_scores = None
+        if options["shared_vad"]:
+            speech_scores = detect_speech(models, audio)
+        whisper_results, language, _ = transcribe(
+            models,
+            audio,
+            options["language"],
+            options["batch_size"],
+            options["model_name"],
+            options["suppress_numerals"],
+            word_timestamps=options["align_mode"] != "ctc",
+            speech_scores=speech_scores,
+        )
+        words, speaker_ts, embeddings = [], [], {}
+        # chunks without speech are not diarized
+        if "".join(segment["text"] for segment in whisper_results).strip():
+            memory_limit = options["align_memory_limit"]
+            words = align(
+                models,
+                audio,
+                whisper_results,
+                language,
+                options["batch_size"],
+                memory_limit * 1024**2 if memory_limit is not None else None,
+                options["align_mode"],
+                options["align_min_probability"],
+            )
+            speaker_ts = diarize(
+                models,
+                audio,
+                temp_path,
+                speech_regions(speech_scores) if speech_scores is not None else None,
+                # a chunk may hold fewer speakers than the whole recording
+                max_speakers=options["num_speakers"] or options["max_speakers"],
+            ).tolist()
+            embeddings = speaker_embeddings(models, audio, speaker_ts)
+    finally:
+        if os.path.exists(temp_path):
+            cleanup(temp_path)
+
+    # only the core of the chunk is kept, the overlap belongs to its neighbours
+    offset = chunk["start"] / SAMPLE_RATE
+    core_start, core_end = (
+        chunk["core_start"] / SAMPLE_RATE,
+        chunk["core_end"] / SAMPLE_RATE,
+    )
+    core_words = []
+    for word in words:
+        if core_start <= word["start"] + offset < core_end:
+            word = dict(word, start=word["start"] + offset, end=word["end"] + offset)
+            core_words.append(word)
+    core_turns = []
+    for start, end, speaker in speaker_ts:
+        start = max(start + int(offset * 1000), int(core_start * 1000))
+        end = min(end + int(offset * 1000), int(core_end * 1000))
+        if end > start:
+            core_turns.append([start, end, speaker])
+    return {
+        "words": core_words,
+        "speaker_ts": core_turns,
+        "language": language,
+        "embeddings": embeddings,
+    }
+
+
+def process_long_audio(
+    models: ModelManager,
+    audio_path: str,
+    temp_path: str = None,
+    profiler: StageProfiler = None,
+    chunk_length: float = 1800,
+    chunk_overlap: float = 5,
+    workers: int = 2,
+    stitch_threshold: float = 0.6,
+    **options,
+):
+    """
+    Run the pipeline on a long recording in chunks processed side by side.
+
+    The audio is decoded to a raw file on disk and split about every
+    `chunk_length` seconds at a pause. Every chunk plus `chunk_overlap` seconds on
+    each side is separated, transcribed, aligned and diarized in one of `workers`
+    processes, each holding its own models, so the memory of a worker depends on
+    the chunk length and not on the recording's. The speakers of the chunks are
+    stitched together by clustering their TitaNet embeddings, then the
+    transcript of the whole recording is punctuated and written like
+    `process_audio` does, with the `options` of `pipeline_options`. The speaker
+    count hints bound the speakers of each chunk from above and steer the
+    stitching, `num_speakers` acts as both the minimum and the maximum.
+    """
+    if temp_path is None:
+        temp_path = create_temp_dir(models.temp_root)
+    options = pipeline_options(**options)
+    # the decoded recording goes to disk, tmpfs would hold it in memory
+    samples_dir = create_temp_dir(
+        models.temp_root or tempfile.gettempdir(), prefix="whisper_diarization_long_"
+    )
+    try:
+        samples_path = os.path.join(samples_dir, "samples.f32")
+        num_samples = decode_to_file(audio_path, samples_path)
+        samples = np.memmap(samples_path, dtype=np.float32, mode="r")
+        bounds = [0, *find_split_points(samples, chunk_length), num_samples]
+        del samples
+
+        overlap_samples = int(chunk_overlap * SAMPLE_RATE)
+        chunks = [
+            {
+                "audio_path": audio_path,
+                "samples_path": samples_path,
+                "start": max(0, core_start - overlap_samples),
+                "end": min(num_samples, core_end + overlap_samples),
+                "core_start": core_start,
+                "core_end": core_end,
+                "options": options,
+                "result_path": os.path.join(samples_dir, f"chunk_{idx}.pkl"),
+            }
+            for idx, (core_start, core_end) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+        logging.info(
+            f"Processing {num_samples / SAMPLE_RATE / 3600:.2f} hours in "
+            f"{len(chunks)} chunks with {workers} workers"
+        )
+        chunk_workers = ChunkWorkers(models.device, models.temp_root)
+        try:
+            with ThreadPoolExecutor(min(workers, len(chunks))) as executor:
+                results = list(executor.map(chunk_workers, chunks))
+        finally:
+            chunk_workers.close()
+    finally:
+        cleanup(samples_dir)
+
+    speaker_map = stitch_speakers(
+        [result["embeddings"] for result in results],
+        stitch_threshold,
+        options["num_speakers"] or options["min_speakers"],
+        options["num_speakers"] or options["max_speakers"],
+    )
+    word_timestamps, speaker_ts = [], []
+    for chunk_idx, result in enumerate(results):
+        word_timestamps.extend(result["words"])
+        for start, end, speaker in result["speaker_ts"]:
+            # speakers without an embedding keep a label of their own
+            global_speaker = speaker_map.setdefault(
+                (chunk_idx, speaker), len(set(speaker_map.values()))
+            )
+            speaker_ts.append([start, end, global_speaker])
+    languages = Counter(
+        result["language"] for result in results if result["words"]
+    ).most_common(1)
+
+    job = _new_job(audio_path, temp_path)
+    job.update(
+        word_timestamps=word_timestamps,
+        speaker_ts=np.array(speaker_ts, dtype=np.int64).reshape(-1, 3),
+        language=languages[0][0] if languages else options["language"],
+        duration=num_samples / SAMPLE_RATE,
+    )
+    steps = _job_steps(models, StageCache(), options, profiler=profiler)
+    try:
+        postprocess = steps[-1][2]
+        postprocess(job)
+    finally:
+        if os.path.exists(temp_path):
+            cleanup(temp_path)
+    return job["outputs"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Processes the chunks of a long recording sent as JSON lines on stdin."
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--temp-dir", dest="temp_dir", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # the models stay loaded for every chunk this worker gets
+    models = ModelManager(
+        args.device, keep=(*MODEL_KINDS, "speaker_embedding"), temp_root=args.temp_dir
+    )
+    try:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            try:
+                with open(chunk["result_path"], "wb") as f:
+                    pickle.dump(process_chunk(models, chunk), f)
+                response = {"status": "ok"}
+            except Exception as e:
+                logging.exception("Chunk processing failed")
+                response = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            print(f"CHUNK_RESULT {json.dumps(response)}", flush=True)
+    finally:
+        models.close()
@@ -0,0 +1,221 @@
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# the model store every artifact is read from, inherited by the subprocesses
+MODEL_STORE_ENV = "WHISPER_DIARIZATION_MODEL_STORE"
+
+MANIFEST_NAME = "manifest.json"
+
+# frameworks that read the cache locations once, when they are imported
+_CACHE_READERS = ("torch", "huggingface_hub", "transformers", "nemo", "whisperx")
+
+
+def use_model_store(path: str, offline: bool = True):
+    """
+    Point the caches of torch hub, Hugging Face and NeMo, and the MSDD config, at
+    the model store in `path`.
+
+    With `offline` nothing is downloaded, an artifact missing from the store
+    fails to load instead. Must be called before the frameworks are imported,
+    the pipeline only imports them once a stage runs.
+    """
+    imported = [module for module in _CACHE_READERS if module in sys.modules]
+    if imported:
+        logging.warning(
+            f"{', '.join(imported)} already imported, they may not use the model store"
+        )
+    path = os.path.abspath(path)
+    os.environ[MODEL_STORE_ENV] = path
+    os.environ["TORCH_HOME"] = os.path.join(path, "torch")
+    os.environ["HF_HOME"] = os.path.join(path, "huggingface")
+    os.environ["NEMO_CACHE_DIR"] = os.path.join(path, "nemo")
+    if offline:
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    else:
+        os.environ.pop("HF_HUB_OFFLINE", None)
+        os.environ.pop("TRANSFORMERS_OFFLINE", None)
+
+
+def _artifact_loaders(whisper_models, device: str):
+    """(name, loader) of every artifact the pipeline loads, loaders return the model."""
+    import tempfile
+
+    from helpers import create_config, download_msdd_config, msdd_config_path
+    from pipeline import mtypes
+    from punctuation import PunctuationRestorer
+    from transcription_helpers import load_faster_whisper_model, load_whisper_model
+
+    def msdd_config():
+        if not os.path.exists(msdd_config_path()):
+            download_msdd_config()
+        return msdd_config_path()
+
+    def nemo_diarizer():
+        # MarbleNet VAD, TitaNet and the MSDD model, as the diarization stage loads them
+        from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+
+        with tempfile.TemporaryDirectory() as workspace:
+            return NeuralDiarizer(cfg=create_config(workspace)).to(device)
+
+    def whisper(model_name):
+        def load():
+            # the batched pipeline also loads whisperx's VAD model
+            load_whisper_model(model_name, device, mtypes[device], False)
+            return load_faster_whisper_model(model_name, device, mtypes[device])
+
+        return load
+
+    def alignment():
+        import torch
+        from ctc_forced_aligner import load_alignment_model
+
+        return load_alignment_model(device, dtype=torch.float32)
+
+    def separation():
+        from demucs.pretrained import get_model
+
+        return get_model("htdemucs")
+
+    return [
+        ("msdd_config", msdd_config),
+        ("nemo_diarizer", nemo_diarizer),
+        *((f"whisper:{name}", whisper(name)) for name in whisper_models),
+        ("alignment", alignment),
+        ("punctuation", lambda: PunctuationRestorer(device=device)),
+        ("separation", separation),
+    ]
+
+
+def load_artifacts(whisper_models, device: str):
+    """Load every artifact once, returns the seconds each took."""
+    timings = {}
+    for name, loader in _artifact_loaders(whisper_models, device):
+        started = time.perf_counter()
+        model = loader()
+        timings[name] = time.perf_counter() - started
+        del model
+        gc.collect()
+    return timings
+
+
+def prefetch(path: str, whisper_models=("medium.en",), device: str = "cpu"):
+    """
+    Download every artifact the pipeline uses into the model store in `path` and
+    verify each loads from there.
+
+    The artifacts are loaded once to resolve them into the store, then again in
+    an offline subprocess that may only read the store. The difference between
+    the two loads is the cold start time the store saves, it is recorded in the
+    store's manifest with the load times. Returns the manifest.
+    """
+    path = os.path.abspath(path)
+    os.makedirs(path, exist_ok=True)
+    use_model_store(path, offline=False)
+    cold = load_artifacts(whisper_models, device)
+
+    # the Hugging Face libraries read the offline switch once, when imported
+    process = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--model-store",
+            path,
+            "--device",
+            device,
+            "--whisper-model",
+            *whisper_models,
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    warm = None
+    for line in process.stdout.splitlines():
+        if line.startswith("VERIFY_RESULT"):
+            warm = json.loads(line.split(" ", 1)[1])
+    if process.returncode != 0 or warm is None:
+        raise RuntimeError(
+            f"Loading the artifacts from the model store {path} offline failed"
+        )
+
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    manifest = {"artifacts": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    for name in cold:
+        previous = manifest["artifacts"].get(name, {})
+        # a store that is filled again already holds the artifact, its first
+        # measurement is the one with the download
+        cold_s = max(cold[name], previous.get("cold_s", 0.0))
+        manifest["artifacts"][name] = {
+            "cold_s": round(cold_s, 3),
+            "warm_s": round(warm[name], 3),
+            "saved_s": round(max(0.0, cold_s - warm[name]), 3),
+        }
+        logging.info(
+            f"Prefetched {name}: {cold_s:.1f}s cold, {warm[name]:.1f}s from the store"
+        )
+    manifest["created"] = datetime.now(timezone.utc).isoformat()
+    manifest["device"] = device
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def check_model_store(path: str, whisper_models=()):
+    """
+    Check that `path` is a prefetched model store holding `whisper_models`, and
+    log the cold start time it saves. Returns the saved seconds.
+    """
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(
+            f"{path} is not a model store, fill it with "
+            f"python prefetch_models.py --model-store {path}"
+        )
+    with open(manifest_path) as f:
+        artifacts = json.load(f)["artifacts"]
+    missing = [
+        model_name
+        for model_name in whisper_models
+        if f"whisper:{model_name}" not in artifacts
+    ]
+    if missing:
+        raise FileNotFoundError(
+            f"The model store {path} doesn't hold the Whisper model "
+            f"{', '.join(missing)}, add it with python prefetch_models.py "
+            f"--model-store {path} --whisper-model {' '.join(missing)}"
+        )
+    saved = sum(artifact["saved_s"] for artifact in artifacts.values())
+    logging.info(
+        f"Loading {len(artifacts)} artifacts from the model store {path}, "
+        f"saving about {saved:.1f}s of cold start"
+    )
+    return saved
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Load every artifact from a model store offline, used by prefetch"
+    )
+    parser.add_argument("--model-store", dest="model_store", required=True)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--whisper-model", dest="whisper_models", nargs="+", default=["medium.en"]
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    use_model_store(args.model_store, offline=True)
+    timings = load_artifacts(args.whisper_models, args.device)
+    # NeMo logs to stdout as well, so the answer is marked
+    print("VERIFY_RESULT", json.dumps(timings), flush=True)
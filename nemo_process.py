@@ -1,31 +1,118 @@
 import argparse
+import json
 import os
+import sys
+import traceback
 
-import torch
-from nemo.collections.asr.models.msdd_models import NeuralDiarizer
-from pydub import AudioSegment
-
-from helpers import create_config
+from helpers import (
+    check_speaker_counts,
+    create_config,
+    default_device,
+    diarize_with_speaker_counts,
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
-    "-a", "--audio", help="name of the target audio file", required=True
+    "-a",
+    "--audio",
+    help="name of the target audio file, when omitted the 16kHz mono_file.wav "
+    "already written to the temp path is diarized",
+    default=None,
 )
 parser.add_argument(
     "--device",
     dest="device",
-    default="cuda" if torch.cuda.is_available() else "cpu",
-    help="if you have a GPU use 'cuda', otherwise 'cpu'",
+    default=None,
+    help="if you have a GPU use 'cuda', otherwise 'cpu', defaults to 'cuda' when "
+    "one is available",
+)
+parser.add_argument(
+    "--temp-path",
+    dest="temp_path",
+    default=os.path.join(os.getcwd(), "temp_outputs"),
+    help="scratch directory of the job, the RTTM is written to its pred_rttms folder",
+)
+parser.add_argument(
+    "--serve",
+    action="store_true",
+    default=False,
+    help="keep the model loaded and diarize the mono_file.wav in the temp path again "
+    "for every line read from stdin, each answered by a DIARIZATION_RESULT line "
+    "holding the speaker turns instead of an RTTM",
+)
+parser.add_argument(
+    "--oracle-vad",
+    action="store_true",
+    dest="oracle_vad",
+    default=False,
+    help="diarize the speech regions of the speech.rttm in the temp path instead of "
+    "running NeMo's VAD",
+)
+parser.add_argument(
+    "--num-speakers",
+    type=int,
+    dest="num_speakers",
+    default=None,
+    help="number of speakers when known, instead of estimating it",
+)
+parser.add_argument(
+    "--min-speakers",
+    type=int,
+    dest="min_speakers",
+    default=None,
+    help="fewest speakers to look for, the embeddings are clustered again for this "
+    "many when fewer are found",
+)
+parser.add_argument(
+    "--max-speakers",
+    type=int,
+    dest="max_speakers",
+    default=None,
+    help="most speakers to look for, defaults to the MSDD config's 8",
 )
 args = parser.parse_args()
+try:
+    check_speaker_counts(args.num_speakers, args.min_speakers, args.max_speakers)
+except ValueError as e:
+    parser.error(str(e))
+if args.device is None:
+    args.device = default_device()
 
-# convert audio to mono for NeMo combatibility
-sound = AudioSegment.from_file(args.audio).set_channels(1)
-ROOT = os.getcwd()
-temp_path = os.path.join(ROOT, "temp_outputs")
+temp_path = args.temp_path
 os.makedirs(temp_path, exist_ok=True)
-sound.export(os.path.join(temp_path, "mono_file.wav"), format="wav")
+if args.audio is not None:
+    # convert audio to mono for NeMo combatibility
+    from pydub import AudioSegment
+
+    sound = AudioSegment.from_file(args.audio).set_channels(1)
+    sound.export(os.path.join(temp_path, "mono_file.wav"), format="wav")
+
+# Initialize NeMo MSDD diarization model, imported only once the arguments are valid
+from nemo.collections.asr.models.msdd_models import NeuralDiarizer  # noqa: E402
+
+msdd_model = NeuralDiarizer(cfg=create_config(temp_path, args.oracle_vad)).to(
+    args.device
+)
+if not args.serve:
+    from pipeline import write_speaker_rttm
+
+    speaker_ts = diarize_with_speaker_counts(
+        msdd_model, args.num_speakers, args.min_speakers, args.max_speakers
+    )
+    os.makedirs(os.path.join(temp_path, "pred_rttms"), exist_ok=True)
+    write_speaker_rttm(
+        os.path.join(temp_path, "pred_rttms", "mono_file.rttm"), speaker_ts
+    )
+    sys.exit(0)
 
-# Initialize NeMo MSDD diarization model
-msdd_model = NeuralDiarizer(cfg=create_config(temp_path)).to(args.device)
-msdd_model.diarize()
+# NeMo logs to stdout as well, so the answers are marked
+for _ in sys.stdin:
+    try:
+        speaker_ts = diarize_with_speaker_counts(
+            msdd_model, args.num_speakers, args.min_speakers, args.max_speakers
+        )
+        result = {"status": "ok", "speaker_ts": speaker_ts.tolist()}
+    except Exception as e:
+        traceback.print_exc()
+        result = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    print("DIARIZATION_RESULT", json.dumps(result), flush=True)
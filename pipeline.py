@@ -0,0 +1,1676 @@
+import gc
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from helpers import (
+    MSDD_DOMAIN_TYPE,
+    SPEECH_RTTM_NAME,
+    WORD_ANCHORS,
+    check_speaker_counts,
+    cleanup,
+    create_config,
+    create_temp_dir,
+    diarize_with_speaker_counts,
+    filter_missing_timestamps,
+    get_realigned_ws_mapping_with_punctuation,
+    get_sentences_speaker_mapping,
+    get_words_speaker_mapping,
+    langs_to_iso,
+    msdd_config_path,
+    process_language_arg,
+    punct_model_langs,
+    torch_threads,
+    whisper_langs,
+)
+from punctuation import (
+    PUNCT_BACKENDS,
+    PUNCT_MODEL_NAME,
+    PunctuationRestorer,
+    speaker_change_spans,
+)
+from stage_cache import StageCache
+from stage_profiler import StageProfiler
+from transcript import Sentences, Transcript
+from transcript_writers import (
+    DEFAULT_OUTPUT_FORMATS,
+    OUTPUT_FORMATS,
+    parse_output_formats,
+    rttm_line,
+    write_transcripts,
+)
+from transcription_helpers import (
+    load_faster_whisper_model,
+    load_whisper_model,
+    transcribe_batched,
+    transcribe_with_word_timestamps,
+)
+
+mtypes = {"cpu": "int8", "cuda": "float16"}
+
+SAMPLE_RATE = 16000
+
+audio_extensions = (
+    ".wav",
+    ".mp3",
+    ".flac",
+    ".ogg",
+    ".opus",
+    ".m4a",
+    ".aac",
+    ".wma",
+    ".webm",
+    ".mp4",
+    ".mkv",
+    ".mov",
+)
+
+# where the word timestamps come from, see align_by_confidence
+ALIGN_MODES = ("ctc", "whisper", "auto")
+
+# the speaker count hints passed through to the diarization
+SPEAKER_COUNT_OPTIONS = ("num_speakers", "min_speakers", "max_speakers")
+
+MODEL_KINDS = ("demucs", "vad", "whisper", "alignment", "diarizer", "punctuation")
+
+# the options of a pipeline run with their defaults, see pipeline_options
+PIPELINE_DEFAULTS = {
+    "stemming": True,
+    "suppress_numerals": False,
+    "model_name": "medium.en",
+    "batch_size": 8,
+    "language": None,
+    "stem_threads": None,
+    "output_formats": DEFAULT_OUTPUT_FORMATS,
+    "compress_outputs": False,
+    "punct_backend": "torch",
+    "punct_threads": None,
+    "punct_batch_size": 8,
+    "lazy_punct": False,
+    "align_memory_limit": None,
+    "align_mode": "ctc",
+    "align_min_probability": 0.5,
+    "shared_vad": False,
+    "num_speakers": None,
+    "min_speakers": None,
+    "max_speakers": None,
+    "word_anchor": "start",
+}
+
+# the thresholds whisperx binarizes the speech probabilities of its VAD model with
+VAD_ONSET = 0.5
+VAD_OFFSET = 0.363
+
+
+class ModelManager:
+    """
+    Holds the models used by the pipeline stages and decides which ones stay loaded.
+
+    Models whose kind is listed in `keep` stay resident after the stage that used
+    them, every other model is released as soon as its stage is done, which is the
+    behaviour of a one-shot run. `max_resident` caps the number of resident models,
+    the least recently used one is evicted first.
+    """
+
+    def __init__(
+        self, device: str, keep=(), max_resident: int = None, temp_root: str = None
+    ):
+        if max_resident is not None and max_resident < 1:
+            raise ValueError("max_resident must be at least 1")
+        self.device = device
+        self.keep = set(keep)
+        self.max_resident = max_resident
+        self.temp_root = temp_root
+        self._models = OrderedDict()
+        self._workdir = None
+        self._lock = threading.RLock()
+
+    def get(self, kind: str, key, loader):
+        """Return the model stored under (`kind`, `key`), calling `loader` on a miss."""
+        with self._lock:
+            if (kind, key) in self._models:
+                self._models.move_to_end((kind, key))
+                return self._models[(kind, key)]
+
+            logging.info(f"Loading {kind} model {key}")
+            model = loader()
+            self._models[(kind, key)] = model
+            while self.max_resident and len(self._models) > self.max_resident:
+                evicted, _ = self._models.popitem(last=False)
+                logging.info(f"Evicting {evicted[0]} model {evicted[1]}")
+            self._free_memory()
+            return model
+
+    def release(self, kind: str):
+        """Drop the models of `kind` unless the memory policy keeps them resident."""
+        if kind not in self.keep:
+            self.evict(kind)
+
+    def evict(self, kind: str = None):
+        """Drop every model of `kind`, or every model if `kind` is None."""
+        with self._lock:
+            for model_key in list(self._models):
+                if kind is None or model_key[0] == kind:
+                    del self._models[model_key]
+            self._free_memory()
+
+    @contextmanager
+    def hold(self, *kinds: str):
+        """Keep the models of every kind in `kinds` loaded until the block exits."""
+        held = [kind for kind in dict.fromkeys(kinds) if kind not in self.keep]
+        self.keep.update(held)
+        try:
+            yield
+        finally:
+            for kind in held:
+                self.keep.discard(kind)
+                self.evict(kind)
+
+    def workspace(self, kind: str):
+        """
+        Scratch directory owned by a resident model of `kind`.
+
+        It outlives the jobs using the model and is removed by `close`.
+        """
+        with self._lock:
+            if self._workdir is None:
+                self._workdir = create_temp_dir(self.temp_root)
+            path = os.path.join(self._workdir, kind)
+            os.makedirs(path, exist_ok=True)
+            return path
+
+    def loaded(self):
+        with self._lock:
+            return [f"{kind}:{key}" for kind, key in self._models]
+
+    def close(self):
+        self.evict()
+        if self._workdir is not None:
+            cleanup(self._workdir)
+            self._workdir = None
+
+    @staticmethod
+    def _free_memory():
+        import torch
+
+        gc.collect()
+        torch.cuda.empty_cache()
+
+
+def find_audio_files(input_dir: str):
+    """List the audio files directly inside `input_dir`, sorted by name."""
+    return sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.lower().endswith(audio_extensions)
+        and os.path.isfile(os.path.join(input_dir, name))
+    )
+
+
+def read_manifest(manifest_path: str):
+    """
+    Read a manifest listing one audio file per line, lines starting with `#` are
+    ignored and relative paths are relative to the manifest.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    audio_paths = []
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                audio_paths.append(os.path.join(manifest_dir, line))
+    return audio_paths
+
+
+def separate_vocals(
+    models: ModelManager,
+    audio_path: str,
+    chunk_length: int = 600,
+    chunk_overlap: int = 5,
+    num_threads: int = None,
+    offset: float = 0,
+    duration: float = None,
+):
+    """
+    Isolate the vocals from the rest of the audio with htdemucs.
+
+    The file is decoded and separated `chunk_length` seconds at a time so memory
+    stays bounded for long files, consecutive chunks overlap by `chunk_overlap`
+    seconds and are crossfaded. Only the `duration` seconds from `offset` on are
+    separated when given. `num_threads` sets the torch threads used for the
+    separation. Returns the vocals as 16kHz mono float32 samples.
+    """
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import AudioFile, convert_audio
+    from demucs.pretrained import get_model
+
+    model = models.get(
+        "demucs", "htdemucs", lambda: get_model("htdemucs").to(models.device).eval()
+    )
+    vocals_idx = model.sources.index("vocals")
+    audio_file = AudioFile(audio_path)
+    remaining = max(audio_file.duration - offset, 0)
+    duration = remaining if duration is None else min(duration, remaining)
+    overlap_samples = chunk_overlap * SAMPLE_RATE
+
+    with torch_threads(num_threads):
+        pieces, tail = [], None
+        for chunk_start in range(
+            0, max(int(np.ceil(duration)), 1), chunk_length - chunk_overlap
+        ):
+            wav = audio_file.read(
+                seek_time=offset + chunk_start,
+                duration=min(chunk_length, duration - chunk_start),
+                streams=0,
+                samplerate=model.samplerate,
+                channels=model.audio_channels,
+            )
+            # same normalization as demucs.separate, computed per chunk
+            ref = wav.mean(0)
+            mean, std = ref.mean(), ref.std() + 1e-8
+            with torch.inference_mode():
+                sources = apply_model(
+                    model,
+                    ((wav - mean) / std)[None],
+                    device=models.device,
+                    split=True,
+                    overlap=0.25,
+                )
+            vocals = sources[0, vocals_idx] * std + mean
+            vocals = convert_audio(vocals, model.samplerate, SAMPLE_RATE, 1)[0]
+            vocals = vocals.cpu().numpy().astype(np.float32)
+            del wav, sources
+
+            if tail is not None:
+                n = min(len(tail), len(vocals))
+                fade = np.linspace(0.0, 1.0, n, dtype=np.float32)
+                vocals[:n] = tail[:n] * (1 - fade) + vocals[:n] * fade
+            if chunk_start + chunk_length >= duration:
+                pieces.append(vocals)
+                break
+            pieces.append(vocals[:-overlap_samples])
+            tail = vocals[-overlap_samples:]
+
+    del model
+    models.release("demucs")
+    return np.concatenate(pieces)
+
+
+def transcribe(
+    models: ModelManager,
+    audio,
+    language: str,
+    batch_size: int,
+    model_name: str,
+    suppress_numerals: bool,
+    word_timestamps: bool = False,
+    speech_scores=None,
+):
+    """
+    Transcribe with batched Whisper, or with sequential Whisper predicting the
+    timestamp of every word when `word_timestamps` is set. `speech_scores` from
+    `detect_speech` replace Whisper's own voice activity detection.
+    """
+    if word_timestamps:
+        whisper_model = models.get(
+            "whisper",
+            (model_name, "word_timestamps"),
+            lambda: load_faster_whisper_model(
+                model_name, models.device, mtypes[models.device]
+            ),
+        )
+        results = transcribe_with_word_timestamps(
+            audio,
+            language,
+            suppress_numerals,
+            whisper_model,
+            speech_regions(speech_scores) if speech_scores is not None else None,
+        )
+        del whisper_model
+        models.release("whisper")
+        return results
+
+    whisper_model = models.get(
+        "whisper",
+        (model_name, suppress_numerals),
+        lambda: load_whisper_model(
+            model_name, models.device, mtypes[models.device], suppress_numerals
+        ),
+    )
+    results = transcribe_batched(
+        audio,
+        language,
+        batch_size,
+        model_name,
+        mtypes[models.device],
+        suppress_numerals,
+        models.device,
+        whisper_model=whisper_model,
+        speech_scores=speech_scores,
+    )
+    del whisper_model
+    models.release("whisper")
+    return results
+
+
+def detect_speech(models: ModelManager, audio):
+    """
+    Speech probabilities of `audio` from whisperx's VAD model.
+
+    They are what the batched Whisper pipeline would compute itself, so a single
+    pass can serve both Whisper and NeMo, see `speech_regions`.
+    """
+    import torch
+    from whisperx.vad import load_vad_model
+
+    vad_model = models.get(
+        "vad",
+        (VAD_ONSET, VAD_OFFSET),
+        lambda: load_vad_model(
+            models.device, vad_onset=VAD_ONSET, vad_offset=VAD_OFFSET
+        ),
+    )
+    speech_scores = vad_model(
+        {
+            "waveform": torch.from_numpy(np.asarray(audio)).unsqueeze(0),
+            "sample_rate": SAMPLE_RATE,
+        }
+    )
+    del vad_model
+    models.release("vad")
+    return speech_scores
+
+
+def speech_regions(speech_scores):
+    """The (start, end) seconds of speech in the output of `detect_speech`."""
+    from whisperx.vad import Binarize
+
+    binarize = Binarize(onset=VAD_ONSET, offset=VAD_OFFSET)
+    return [
+        (segment.start, segment.end)
+        for segment in binarize(speech_scores).get_timeline()
+    ]
+
+
+def load_aligner(models: ModelManager):
+    """Return the forced alignment model and its tokenizer."""
+    import torch
+    from ctc_forced_aligner import load_alignment_model
+
+    dtype = torch.float16 if models.device == "cuda" else torch.float32
+    return models.get(
+        "alignment",
+        str(dtype),
+        lambda: load_alignment_model(models.device, dtype=dtype),
+    )
+
+
+def generate_alignment_emissions(alignment_model, audio_waveform, batch_size):
+    import torch
+    from ctc_forced_aligner import generate_emissions
+
+    audio_waveform = (
+        torch.from_numpy(audio_waveform)
+        .to(alignment_model.dtype)
+        .to(alignment_model.device)
+    )
+    return generate_emissions(alignment_model, audio_waveform, batch_size=batch_size)
+
+
+def align_words(emissions, stride, alignment_tokenizer, whisper_results, language):
+    from ctc_forced_aligner import (
+        get_alignments,
+        get_spans,
+        postprocess_results,
+        preprocess_text,
+    )
+
+    full_transcript = "".join(segment["text"] for segment in whisper_results)
+
+    tokens_starred, text_starred = preprocess_text(
+        full_transcript,
+        romanize=True,
+        language=langs_to_iso[language],
+    )
+
+    segments, scores, blank_token = get_alignments(
+        emissions,
+        tokens_starred,
+        alignment_tokenizer,
+    )
+
+    spans = get_spans(tokens_starred, segments, blank_token)
+
+    return postprocess_results(text_starred, spans, stride, scores)
+
+
+# emission frames per second of the alignment model
+ALIGNMENT_FRAME_RATE = 50
+
+
+def alignment_memory(num_samples: int, num_chars: int, vocab_size: int = 32):
+    """Estimated peak memory in bytes of aligning `num_chars` characters of text."""
+    frames = num_samples * ALIGNMENT_FRAME_RATE // SAMPLE_RATE + 1
+    # the samples and their tensor copy, the emissions and the frames x states
+    # backpointers of the forced aligner
+    return (
+        8 * num_samples + 4 * frames * (vocab_size + 1) + frames * (2 * num_chars + 1)
+    )
+
+
+def segment_boundaries(whisper_results, num_samples: int):
+    """
+    Sample indices splitting the audio between consecutive Whisper segments,
+    halfway through the pause between them, plus the start and end of the audio.
+    """
+    boundaries = [0]
+    for previous, segment in zip(whisper_results, whisper_results[1:]):
+        boundary = int((previous["end"] + segment["start"]) / 2 * SAMPLE_RATE)
+        boundaries.append(min(max(boundary, boundaries[-1]), num_samples))
+    boundaries.append(num_samples)
+    return boundaries
+
+
+def alignment_windows(whisper_results, num_samples: int, memory_limit: int):
+    """
+    Group consecutive Whisper segments into windows that are each aligned within
+    about `memory_limit` bytes, a segment that doesn't fit alone gets a window of
+    its own. The windows cover the whole audio, each boundary is halfway through
+    the pause between two segments. Returns (start sample, end sample, segments)
+    of every window.
+    """
+    boundaries = segment_boundaries(whisper_results, num_samples)
+    windows, first, num_chars = [], 0, 0
+    for idx, segment in enumerate(whisper_results):
+        if idx > first and (
+            alignment_memory(
+                boundaries[idx + 1] - boundaries[first],
+                num_chars + len(segment["text"]),
+            )
+            > memory_limit
+        ):
+            windows.append(
+                (boundaries[first], boundaries[idx], whisper_results[first:idx])
+            )
+            first, num_chars = idx, 0
+        num_chars += len(segment["text"])
+    if whisper_results:
+        windows.append((boundaries[first], num_samples, whisper_results[first:]))
+    return windows
+
+
+def align_windowed(
+    alignment_model,
+    alignment_tokenizer,
+    audio_waveform,
+    whisper_results,
+    language,
+    batch_size,
+    memory_limit: int,
+):
+    """
+    Align the transcript one window of segments at a time, see `alignment_windows`.
+
+    Every window's text is aligned against the emissions of its own audio only, so
+    the samples moved to the device, the emissions and the aligner state of a
+    single window are in memory at once instead of those of the whole file.
+    """
+    word_timestamps = []
+    for start, end, segments in alignment_windows(
+        whisper_results, len(audio_waveform), memory_limit
+    ):
+        if not "".join(segment["text"] for segment in segments).strip():
+            continue
+        emissions, stride = generate_alignment_emissions(
+            alignment_model, audio_waveform[start:end], batch_size
+        )
+        words = align_words(emissions, stride, alignment_tokenizer, segments, language)
+        del emissions
+        offset = start / SAMPLE_RATE
+        for word in words:
+            word_timestamps.append(
+                dict(
+                    word,
+                    start=round(word["start"] + offset, 3),
+                    end=round(word["end"] + offset, 3),
+                )
+            )
+    return word_timestamps
+
+
+def whisper_word_timestamps(whisper_results, final_timestamp: float = None):
+    """
+    The word timestamps Whisper predicted in `transcribe(..., word_timestamps=True)`,
+    cleaned up by `filter_missing_timestamps`, in the format of the forced aligner.
+    """
+    words = [
+        {"word": word["word"].strip(), "start": word["start"], "end": word["end"]}
+        for segment in whisper_results
+        for word in segment.get("words") or []
+        if word["word"].strip()
+    ]
+    if not words:
+        return []
+    return [
+        {"start": word["start"], "end": word["end"], "text": word["word"]}
+        for word in filter_missing_timestamps(words, 0, final_timestamp)
+    ]
+
+
+def whisper_timestamps_confident(segment, min_probability: float):
+    """
+    Whether the Whisper word timestamps of a segment can be used as they are, its
+    words are confident on average and none of them has collapsed to no length.
+    """
+    words = segment.get("words") or []
+    if not words:
+        return False
+    if any(word["end"] <= word["start"] for word in words):
+        return False
+    return np.mean([word["probability"] for word in words]) >= min_probability
+
+
+def align_by_confidence(
+    models: ModelManager,
+    audio_waveform,
+    whisper_results,
+    language,
+    batch_size,
+    mode: str = "whisper",
+    min_probability: float = 0.5,
+    memory_limit: int = None,
+):
+    """
+    Word timestamps of a transcript with Whisper's own word timestamps.
+
+    In "whisper" mode they are all used as they are, in "auto" mode the segments
+    that `whisper_timestamps_confident` rejects are force aligned with CTC instead,
+    consecutive ones together against their own stretch of audio. Returns the
+    word timestamps and the number of segments that took each path.
+    """
+    confident = [
+        mode == "whisper" or whisper_timestamps_confident(segment, min_probability)
+        for segment in whisper_results
+    ]
+    paths = {"whisper": sum(confident), "ctc": len(confident) - sum(confident)}
+    if paths["ctc"]:
+        alignment_model, alignment_tokenizer = load_aligner(models)
+        boundaries = segment_boundaries(whisper_results, len(audio_waveform))
+
+    word_timestamps, first = [], 0
+    for idx in range(1, len(whisper_results) + 1):
+        if idx < len(whisper_results) and confident[idx] == confident[first]:
+            continue
+        segments = whisper_results[first:idx]
+        if confident[first]:
+            word_timestamps.extend(
+                whisper_word_timestamps(segments, len(audio_waveform) / SAMPLE_RATE)
+            )
+        elif "".join(segment["text"] for segment in segments).strip():
+            start, end = boundaries[first], boundaries[idx]
+            offset = start / SAMPLE_RATE
+            words = align_windowed(
+                alignment_model,
+                alignment_tokenizer,
+                audio_waveform[start:end],
+                [
+                    dict(
+                        segment,
+                        start=segment["start"] - offset,
+                        end=segment["end"] - offset,
+                    )
+                    for segment in segments
+                ],
+                language,
+                batch_size,
+                memory_limit if memory_limit is not None else float("inf"),
+            )
+            for word in words:
+                word_timestamps.append(
+                    dict(
+                        word,
+                        start=round(word["start"] + offset, 3),
+                        end=round(word["end"] + offset, 3),
+                    )
+                )
+        first = idx
+
+    if paths["ctc"]:
+        del alignment_model
+        models.release("alignment")
+    logging.info(
+        f"Word timestamps of {paths['whisper']} segments from Whisper, "
+        f"{paths['ctc']} force aligned"
+    )
+    return word_timestamps, paths
+
+
+def align(
+    models: ModelManager,
+    audio_waveform,
+    whisper_results,
+    language,
+    batch_size,
+    memory_limit: int = None,
+    mode: str = "ctc",
+    min_probability: float = 0.5,
+):
+    """
+    Force align the words of `whisper_results`, a window at a time within
+    `memory_limit` bytes if given, see `align_windowed`. In the "whisper" and
+    "auto" `mode` Whisper's own word timestamps are used, see
+    `align_by_confidence`.
+    """
+    if mode != "ctc":
+        return align_by_confidence(
+            models,
+            audio_waveform,
+            whisper_results,
+            language,
+            batch_size,
+            mode,
+            min_probability,
+            memory_limit,
+        )[0]
+
+    alignment_model, alignment_tokenizer = load_aligner(models)
+    if memory_limit is not None:
+        word_timestamps = align_windowed(
+            alignment_model,
+            alignment_tokenizer,
+            audio_waveform,
+            whisper_results,
+            language,
+            batch_size,
+            memory_limit,
+        )
+        del alignment_model
+        models.release("alignment")
+        return word_timestamps
+
+    emissions, stride = generate_alignment_emissions(
+        alignment_model, audio_waveform, batch_size
+    )
+    del alignment_model
+    models.release("alignment")
+
+    return align_words(
+        emissions, stride, alignment_tokenizer, whisper_results, language
+    )
+
+
+def write_speaker_rttm(path: str, speaker_ts, file_id: str = "mono_file"):
+    """Export the turns `diarize` returns as an RTTM file."""
+    with open(path, "w") as f:
+        for start, end, speaker in speaker_ts:
+            f.write(rttm_line(file_id, f"speaker_{speaker}", start, end))
+
+
+def write_speech_rttm(path: str, speech_regions, uniq_id: str = "mono_file"):
+    """Write (start, end) second speech regions as an RTTM NeMo's oracle VAD reads."""
+    with open(path, "w") as f:
+        for start, end in speech_regions:
+            f.write(
+                f"SPEAKER {uniq_id} 1 {start:.3f} {end - start:.3f} "
+                "<NA> <NA> speech <NA> <NA>\n"
+            )
+
+
+def decode_audio(audio_path: str):
+    """Decode an audio file once to the 16kHz mono float32 samples every stage uses."""
+    import whisperx
+
+    return whisperx.load_audio(audio_path)
+
+
+def write_mono_wav(path: str, audio_waveform):
+    """
+    Write 16kHz mono float samples to a wav file for NeMo to read.
+
+    The samples are stored as they are in 32-bit float PCM behind a plain header,
+    so writing the file is a single copy of the buffer and nothing is re-encoded.
+    """
+    samples = np.ascontiguousarray(audio_waveform, dtype="<f4")
+    data_size = samples.nbytes
+    with open(path, "wb") as f:
+        # RIFF header, WAVE_FORMAT_IEEE_FLOAT fmt chunk and the fact chunk
+        # non-PCM formats require
+        f.write(b"RIFF" + struct.pack("<I", 50 + data_size) + b"WAVE")
+        f.write(
+            b"fmt "
+            + struct.pack("<IHHIIHHH", 18, 3, 1, SAMPLE_RATE, SAMPLE_RATE * 4, 4, 32, 0)
+        )
+        f.write(b"fact" + struct.pack("<II", 4, len(samples)))
+        f.write(b"data" + struct.pack("<I", data_size))
+        samples.tofile(f)
+
+
+def diarize(
+    models: ModelManager,
+    audio_waveform,
+    temp_path: str,
+    speech_regions=None,
+    num_speakers: int = None,
+    min_speakers: int = None,
+    max_speakers: int = None,
+):
+    """
+    Diarize with NeMo MSDD, returns the speaker turns as an (N, 3) int64 array of
+    start_ms, end_ms and speaker id.
+
+    The turns are handed over in memory, `write_speaker_rttm` exports them as an
+    RTTM file. NeMo runs its own VAD unless the (start, end) second
+    `speech_regions` are given, which are then diarized as they are. The
+    clustering looks for exactly `num_speakers` speakers when given, otherwise
+    for `min_speakers` to `max_speakers`, see `diarize_with_speaker_counts`.
+    """
+    from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+
+    if speech_regions is not None and not speech_regions:
+        # nothing to diarize, NeMo fails on an empty RTTM
+        return np.zeros((0, 3), dtype=np.int64)
+
+    # the input and output paths are baked into the diarizer config, so a resident
+    # diarizer gets a workspace of its own that every job writes its audio into
+    if "diarizer" in models.keep:
+        workspace = models.workspace("diarizer")
+    else:
+        workspace = temp_path
+    os.makedirs(workspace, exist_ok=True)
+
+    oracle_vad = speech_regions is not None
+
+    # the speaker count hints are set for every run, they aren't part of the key
+    msdd_model = models.get(
+        "diarizer",
+        (workspace, oracle_vad),
+        lambda: NeuralDiarizer(cfg=create_config(workspace, oracle_vad)).to(
+            models.device
+        ),
+    )
+
+    # NeMo reads its input from disk, the workspace is on tmpfs when available
+    write_mono_wav(os.path.join(workspace, "mono_file.wav"), audio_waveform)
+    if oracle_vad:
+        write_speech_rttm(os.path.join(workspace, SPEECH_RTTM_NAME), speech_regions)
+    speaker_ts = diarize_with_speaker_counts(
+        msdd_model, num_speakers, min_speakers, max_speakers
+    )
+
+    del msdd_model
+    models.release("diarizer")
+    return speaker_ts
+
+
+def restore_punctuation(
+    models: ModelManager,
+    transcript: Transcript,
+    language: str,
+    backend: str = "torch",
+    num_threads: int = None,
+    batch_size: int = 8,
+    lazy: bool = False,
+    max_words_in_sentence: int = 50,
+    context_words: int = 20,
+):
+    """
+    Add the sentence endings predicted by the punctuation model to the words of
+    `transcript`, in place.
+
+    With `lazy` only the words within `max_words_in_sentence` words of a speaker
+    change are punctuated, the only ones the realignment looks at, with
+    `context_words` more words on each side as context for the model. The rest
+    keep Whisper's punctuation.
+    """
+    if language not in punct_model_langs:
+        logging.warning(
+            f"Punctuation restoration is not available for {language} language. Using the original punctuation."
+        )
+        return transcript
+    if not len(transcript):
+        return transcript
+
+    if lazy:
+        spans = speaker_change_spans(
+            transcript.speaker.tolist(),
+            max_words_in_sentence,
+            context_words,
+        )
+        logging.info(
+            f"Punctuating {sum(end - start for start, end, _, _ in spans)} "
+            f"of {len(transcript)} words around speaker changes"
+        )
+    else:
+        spans = [(0, len(transcript), 0, len(transcript))]
+    if not spans:
+        return transcript
+
+    # restoring punctuation in the transcript to help realign the sentences
+    punct_model = models.get(
+        "punctuation",
+        (PUNCT_MODEL_NAME, backend, num_threads),
+        lambda: PunctuationRestorer(
+            PUNCT_MODEL_NAME, models.device, backend, num_threads
+        ),
+    )
+
+    tokens, seconds = punct_model.tokens, punct_model.seconds
+    labeled_spans = punct_model.predict_many(
+        [transcript.words(start, end) for start, end, _, _ in spans],
+        chunk_size=230,
+        batch_size=batch_size,
+    )
+    tokens, seconds = punct_model.tokens - tokens, punct_model.seconds - seconds
+    if seconds:
+        logging.info(
+            f"Punctuated {tokens} tokens in {seconds:.2f}s ({tokens / seconds:.0f} tokens/s)"
+        )
+
+    del punct_model
+    models.release("punctuation")
+
+    # only the core of a span keeps the predictions, its context is cut off
+    labled_words = []
+    for (start, _, core_start, core_end), labeled_span in zip(spans, labeled_spans):
+        labled_words.extend(
+            zip(
+                range(core_start, core_end),
+                labeled_span[core_start - start : core_end - start],
+            )
+        )
+
+    ending_puncts = ".?!"
+    model_puncts = ".,;:!?"
+
+    # We don't want to punctuate U.S.A. with a period. Right?
+    is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
+
+    for word_idx, labeled_tuple in labled_words:
+        word = transcript.word(word_idx)
+        if (
+            word
+            and labeled_tuple[1] in ending_puncts
+            and (word[-1] not in model_puncts or is_acronym(word))
+        ):
+            word += labeled_tuple[1]
+            if word.endswith(".."):
+                word = word.rstrip(".")
+            transcript.set_word(word_idx, word)
+
+    return transcript
+
+
+def write_outputs(
+    sentences: Sentences,
+    transcript: Transcript,
+    output_base: str,
+    formats=DEFAULT_OUTPUT_FORMATS,
+    compress=False,
+):
+    """Write the transcript in the selected formats, returns their paths."""
+    return write_transcripts(sentences, transcript, output_base, formats, compress)
+
+
+def _new_job(audio_path: str, temp_path: str):
+    return {
+        "audio": audio_path,
+        "output_base": os.path.splitext(audio_path)[0],
+        "temp_path": temp_path,
+        "lock": threading.Lock(),
+        "created": time.perf_counter(),
+    }
+
+
+def _job_duration(job):
+    """Duration of the job's audio in seconds, None if unknown."""
+    duration = job.get("duration")
+    if duration is None and len(job.get("speaker_ts", ())):
+        # fully cached files are never decoded
+        duration = max(end for _, end, _ in job["speaker_ts"]) / 1000
+    return duration
+
+
+def _job_steps(
+    models: ModelManager,
+    cache: StageCache,
+    options: dict,
+    diarize_fn=None,
+    profiler: StageProfiler = None,
+):
+    """
+    The per-file steps of the pipeline as (stage, model kinds, step) tuples.
+
+    Every step reads and updates the job dict of one file. The outputs of the
+    expensive stages go through `cache`, keyed by the input audio and the options
+    each output depends on, and whatever is computed is measured by `profiler`.
+    `diarize_fn` replaces `diarize` when given.
+    """
+    diarize_fn = diarize_fn or diarize
+    profiler = profiler or StageProfiler()
+    stem_params = {"stemming": options["stemming"], "stem_model": "htdemucs"}
+    # the stages after the separation are keyed by the audio they were given,
+    # `source_hash`, the separated vocals or the original audio when it failed
+    whisper_params = {
+        "model_name": options["model_name"],
+        "batch_size": options["batch_size"],
+        "language": options["language"],
+        "suppress_numerals": options["suppress_numerals"],
+    }
+    if options["align_mode"] != "ctc":
+        whisper_params["word_timestamps"] = True
+    diarization_params = {"msdd_config": msdd_config_params(cache)}
+    if options["shared_vad"]:
+        whisper_params["shared_vad"] = True
+        diarization_params["shared_vad"] = True
+    # the hints that are given, passed to the diarizer and part of its cache key
+    speaker_counts = {
+        name: options[name]
+        for name in SPEAKER_COUNT_OPTIONS
+        if options[name] is not None
+    }
+    diarization_params.update(speaker_counts)
+    alignment_params = {
+        "alignment_dtype": "float16" if models.device == "cuda" else "float32"
+    }
+
+    def run_separation(job):
+        if cache.enabled:
+            job["audio_hash"] = cache.file_hash(job["audio"])
+        job["source_hash"] = job.get("audio_hash")
+        if options["stemming"]:
+            separate(job)
+        if options["shared_vad"]:
+            # one VAD pass that transcription and diarization both use
+            job["speech_scores"] = cache.cached(
+                "speech",
+                job["source_hash"],
+                {"vad_onset": VAD_ONSET, "vad_offset": VAD_OFFSET},
+                lambda: compute_speech(job),
+            )
+
+    def separate(job):
+        def compute():
+            with profiler.measure(job, "separation"):
+                return separate_vocals(
+                    models, job["audio"], num_threads=options["stem_threads"]
+                )
+
+        try:
+            job["waveform"] = cache.cached(
+                "vocals", job.get("audio_hash"), stem_params, compute
+            )
+            job["duration"] = len(job["waveform"]) / SAMPLE_RATE
+            if cache.enabled:
+                job["source_hash"] = cache.key(
+                    "vocals", job.get("audio_hash"), stem_params
+                )
+        except Exception:
+            logging.exception(
+                "Source splitting failed, using original audio file. Use --no-stem argument to disable it."
+            )
+
+    def compute_speech(job):
+        audio = waveform(job)
+        with profiler.measure(job, "vad"):
+            return detect_speech(models, audio)
+
+    def run_transcription(job):
+        def compute():
+            audio = waveform(job)
+            with profiler.measure(job, "transcription"):
+                whisper_results, language, _ = transcribe(
+                    models,
+                    audio,
+                    options["language"],
+                    options["batch_size"],
+                    options["model_name"],
+                    options["suppress_numerals"],
+                    word_timestamps=options["align_mode"] != "ctc",
+                    speech_scores=job.get("speech_scores"),
+                )
+            return whisper_results, language
+
+        job["whisper_results"], job["language"] = cache.cached(
+            "whisper", job["source_hash"], whisper_params, compute
+        )
+
+    def waveform(job):
+        # decoded once on first use and shared by every later stage, the separated
+        # vocals take its place when stemming, fully cached jobs never decode
+        with job["lock"]:
+            if "waveform" not in job:
+                with profiler.measure(job, "decode"):
+                    job["waveform"] = decode_audio(job["audio"])
+                job["duration"] = len(job["waveform"]) / SAMPLE_RATE
+            return job["waveform"]
+
+    def release_waveform(job, stage):
+        # alignment and diarization may run side by side, the samples are dropped
+        # once both are done with them
+        with job["lock"]:
+            users = job.setdefault("waveform_users", {"alignment", "diarization"})
+            users.discard(stage)
+            if not users:
+                job.pop("waveform", None)
+
+    def run_alignment(job):
+        def compute_emissions():
+            audio = waveform(job)
+            with profiler.measure(job, "emissions"):
+                emissions, stride = generate_alignment_emissions(
+                    load_aligner(models)[0], audio, options["batch_size"]
+                )
+                return emissions.cpu(), stride
+
+        def compute_words():
+            emissions, stride = cache.cached(
+                "emissions",
+                job["source_hash"],
+                alignment_params,
+                compute_emissions,
+            )
+            alignment_tokenizer = load_aligner(models)[1]
+            models.release("alignment")
+            with profiler.measure(job, "forced_alignment"):
+                return align_words(
+                    emissions,
+                    stride,
+                    alignment_tokenizer,
+                    job["whisper_results"],
+                    job["language"],
+                )
+
+        def compute_words_windowed():
+            audio = waveform(job)
+            alignment_model, alignment_tokenizer = load_aligner(models)
+            with profiler.measure(job, "forced_alignment"):
+                word_timestamps = align_windowed(
+                    alignment_model,
+                    alignment_tokenizer,
+                    audio,
+                    job["whisper_results"],
+                    job["language"],
+                    options["batch_size"],
+                    options["align_memory_limit"] * 1024**2,
+                )
+            del alignment_model
+            models.release("alignment")
+            return word_timestamps
+
+        def compute_words_by_confidence():
+            audio = waveform(job)
+            memory_limit = options["align_memory_limit"]
+            with profiler.measure(job, "forced_alignment"):
+                return align_by_confidence(
+                    models,
+                    audio,
+                    job["whisper_results"],
+                    job["language"],
+                    options["batch_size"],
+                    options["align_mode"],
+                    options["align_min_probability"],
+                    memory_limit * 1024**2 if memory_limit is not None else None,
+                )
+
+        if options["align_mode"] != "ctc":
+            job["word_timestamps"], job["alignment_paths"] = cache.cached(
+                "word_timestamps",
+                job["source_hash"],
+                {
+                    **whisper_params,
+                    **alignment_params,
+                    "align_mode": options["align_mode"],
+                    "align_min_probability": options["align_min_probability"],
+                    "align_memory_limit": options["align_memory_limit"],
+                },
+                compute_words_by_confidence,
+            )
+        elif options["align_memory_limit"] is None:
+            job["word_timestamps"] = cache.cached(
+                "word_timestamps",
+                job["source_hash"],
+                {**whisper_params, **alignment_params},
+                compute_words,
+            )
+        else:
+            # the emissions of the whole file are never computed, nor cached
+            job["word_timestamps"] = cache.cached(
+                "word_timestamps",
+                job["source_hash"],
+                {
+                    **whisper_params,
+                    **alignment_params,
+                    "align_memory_limit": options["align_memory_limit"],
+                },
+                compute_words_windowed,
+            )
+        if options["align_mode"] == "ctc":
+            job["alignment_paths"] = {"whisper": 0, "ctc": len(job["whisper_results"])}
+        release_waveform(job, "alignment")
+
+    def run_diarization(job):
+        def compute():
+            audio = waveform(job)
+            with profiler.measure(job, "diarization"):
+                if not options["shared_vad"]:
+                    return diarize_fn(models, audio, job["temp_path"], **speaker_counts)
+                return diarize_fn(
+                    models,
+                    audio,
+                    job["temp_path"],
+                    speech_regions=speech_regions(job["speech_scores"]),
+                    **speaker_counts,
+                )
+
+        # entries cached before the turns were arrays are lists
+        job["speaker_ts"] = np.asarray(
+            cache.cached(
+                "speaker_rttm", job["source_hash"], diarization_params, compute
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        release_waveform(job, "diarization")
+
+    def run_postprocessing(job):
+        with profiler.measure(job, "speaker_mapping"):
+            transcript = get_words_speaker_mapping(
+                job["word_timestamps"], job["speaker_ts"], options["word_anchor"]
+            )
+        with profiler.measure(job, "punctuation"):
+            transcript = restore_punctuation(
+                models,
+                transcript,
+                job["language"],
+                options["punct_backend"],
+                options["punct_threads"],
+                options["punct_batch_size"],
+                options["lazy_punct"],
+            )
+        with profiler.measure(job, "realignment"):
+            transcript = get_realigned_ws_mapping_with_punctuation(transcript)
+        with profiler.measure(job, "sentence_mapping"):
+            sentences = get_sentences_speaker_mapping(transcript, job["speaker_ts"])
+        with profiler.measure(job, "writing"):
+            job["outputs"] = write_outputs(
+                sentences,
+                transcript,
+                job["output_base"],
+                options["output_formats"],
+                options["compress_outputs"],
+            )
+        if profiler.report:
+            job["outputs"].append(
+                profiler.write_report(job, _job_duration(job), models.device)
+            )
+        if os.path.exists(job["temp_path"]):
+            cleanup(job["temp_path"])
+
+    # the separation finds the speech too with the shared VAD
+    separation_kinds = ("demucs", "vad") if options["shared_vad"] else ("demucs",)
+    return [
+        ("separation", separation_kinds, run_separation),
+        ("transcription", ("whisper",), run_transcription),
+        ("alignment", ("alignment",), run_alignment),
+        ("diarization", ("diarizer",), run_diarization),
+        ("postprocessing", ("punctuation",), run_postprocessing),
+    ]
+
+
+def msdd_config_params(cache: StageCache):
+    """What the diarization output depends on, for the stage cache key."""
+    params = {"domain": MSDD_DOMAIN_TYPE}
+    config_path = msdd_config_path()
+    if cache.enabled and os.path.exists(config_path):
+        params["config"] = cache.file_hash(config_path)
+    return params
+
+
+def pipeline_options(**options):
+    """
+    The options of a pipeline run, the given ones over `PIPELINE_DEFAULTS`.
+
+    The transcripts are written in `output_formats`, gzip compressed if
+    `compress_outputs` is set. `align_memory_limit` aligns the words a window of
+    segments at a time within about that many MB instead of the whole file at
+    once. `align_mode` "whisper" takes the word timestamps from Whisper instead
+    of CTC forced alignment, "auto" does so for the segments whose mean word
+    probability reaches `align_min_probability`, see `align_by_confidence`.
+    `shared_vad` finds the speech once with whisperx's VAD model for both Whisper
+    and NeMo, instead of each running a VAD model of its own. `num_speakers`, or
+    `min_speakers` and `max_speakers`, tell the diarization how many speakers to
+    look for. `word_anchor` is the point of a word that places it in a speaker
+    turn, see `get_words_speaker_mapping`.
+
+    Raises a ValueError for an unknown option, an unsupported language or
+    contradicting speaker counts.
+    """
+    unknown = set(options) - set(PIPELINE_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown pipeline options: {', '.join(sorted(unknown))}")
+    options = {**PIPELINE_DEFAULTS, **options}
+    options["language"] = process_language_arg(
+        options["language"], options["model_name"]
+    )
+    check_speaker_counts(*(options[name] for name in SPEAKER_COUNT_OPTIONS))
+    return options
+
+
+def add_pipeline_arguments(parser):
+    """Add the command line arguments of every pipeline option to `parser`."""
+    parser.add_argument(
+        "--no-stem",
+        action="store_false",
+        dest="stemming",
+        default=True,
+        help="Disables source separation."
+        "This helps with long files that don't contain a lot of music.",
+    )
+    parser.add_argument(
+        "--suppress_numerals",
+        action="store_true",
+        dest="suppress_numerals",
+        default=False,
+        help="Suppresses Numerical Digits."
+        "This helps the diarization accuracy but converts all digits into written text.",
+    )
+    parser.add_argument(
+        "--whisper-model",
+        dest="model_name",
+        default="medium.en",
+        help="name of the Whisper model to use",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        dest="batch_size",
+        default=8,
+        help="Batch size for batched inference, reduce if you run out of memory, set to 0 for non-batched inference",
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        default=None,
+        choices=whisper_langs,
+        help="Language spoken in the audio, specify None to perform language detection",
+    )
+    parser.add_argument(
+        "--stem-threads",
+        type=int,
+        dest="stem_threads",
+        default=None,
+        help="Number of CPU threads used for source separation, defaults to torch's choice",
+    )
+    parser.add_argument(
+        "--output-formats",
+        type=parse_output_formats,
+        dest="output_formats",
+        default=list(DEFAULT_OUTPUT_FORMATS),
+        help="comma separated transcript formats to write "
+        f"({', '.join(OUTPUT_FORMATS)}) or 'all', defaults to txt,srt",
+    )
+    parser.add_argument(
+        "--gzip-outputs",
+        action="store_true",
+        dest="compress_outputs",
+        default=False,
+        help="gzip compress the transcripts",
+    )
+    parser.add_argument(
+        "--punct-backend",
+        dest="punct_backend",
+        default="torch",
+        choices=PUNCT_BACKENDS,
+        help="Backend of the punctuation model, 'int8' quantizes it dynamically and "
+        "'onnx' runs it with ONNX Runtime, both on the CPU",
+    )
+    parser.add_argument(
+        "--punct-threads",
+        type=int,
+        dest="punct_threads",
+        default=None,
+        help="Number of intra-op CPU threads of the punctuation model, defaults to the backend's choice",
+    )
+    parser.add_argument(
+        "--punct-batch-size",
+        type=int,
+        dest="punct_batch_size",
+        default=8,
+        help="Number of 230 word chunks punctuated in one forward pass",
+    )
+    parser.add_argument(
+        "--lazy-punct",
+        action="store_true",
+        dest="lazy_punct",
+        default=False,
+        help="Restore punctuation only around speaker changes and keep Whisper's punctuation elsewhere",
+    )
+    parser.add_argument(
+        "--align-memory-limit",
+        type=int,
+        dest="align_memory_limit",
+        default=None,
+        help="Align the words a window of segments at a time within about this many MB "
+        "instead of the whole file at once",
+    )
+    parser.add_argument(
+        "--align-mode",
+        dest="align_mode",
+        default="ctc",
+        choices=ALIGN_MODES,
+        help="Where the word timestamps come from, 'ctc' forced alignment, 'whisper' "
+        "itself, skipping the second model pass, or 'auto' to force align only the "
+        "segments whose Whisper timestamps aren't confident",
+    )
+    parser.add_argument(
+        "--align-min-probability",
+        type=float,
+        dest="align_min_probability",
+        default=0.5,
+        help="Mean word probability below which 'auto' force aligns a segment",
+    )
+    parser.add_argument(
+        "--shared-vad",
+        action="store_true",
+        dest="shared_vad",
+        default=False,
+        help="Find the speech once with Whisper's VAD model and diarize only that, "
+        "instead of NeMo running a VAD model of its own",
+    )
+    parser.add_argument(
+        "--num-speakers",
+        type=int,
+        dest="num_speakers",
+        default=None,
+        help="Number of speakers when it is known, e.g. 2 for a call, NeMo then skips "
+        "estimating it",
+    )
+    parser.add_argument(
+        "--min-speakers",
+        type=int,
+        dest="min_speakers",
+        default=None,
+        help="Fewest speakers to look for, the speaker embeddings are clustered again "
+        "for this many when NeMo finds fewer",
+    )
+    parser.add_argument(
+        "--max-speakers",
+        type=int,
+        dest="max_speakers",
+        default=None,
+        help="Most speakers to look for, defaults to 8",
+    )
+    parser.add_argument(
+        "--word-anchor",
+        dest="word_anchor",
+        default="start",
+        choices=WORD_ANCHORS,
+        help="Point of a word that places it in a speaker turn, its 'start', 'mid' or "
+        "'end', or 'overlap' for the turn it overlaps the most",
+    )
+
+
+def pipeline_options_from_args(args):
+    """The pipeline options parsed by a parser set up by `add_pipeline_arguments`."""
+    return pipeline_options(**{name: getattr(args, name) for name in PIPELINE_DEFAULTS})
+
+
+def process_audio(
+    models: ModelManager,
+    audio_path: str,
+    temp_path: str = None,
+    cache: StageCache = None,
+    profiler: StageProfiler = None,
+    **options,
+):
+    """
+    Run the whole pipeline on one audio file.
+
+    The transcripts are written next to the audio file and their paths returned,
+    `options` are those of `pipeline_options`. With a reporting `profiler` the
+    stage measurements are written next to them too.
+    Intermediate files go to `temp_path`, a fresh scratch directory by default,
+    which is removed once the file is done.
+    """
+    if temp_path is None:
+        temp_path = create_temp_dir(models.temp_root)
+    options = pipeline_options(**options)
+
+    job = _new_job(audio_path, temp_path)
+    try:
+        for _, _, step in _job_steps(
+            models, cache or StageCache(), options, profiler=profiler
+        ):
+            step(job)
+    finally:
+        if os.path.exists(temp_path):
+            cleanup(temp_path)
+    return job["outputs"]
+
+
+def _run_stage(jobs, stage: str, step):
+    """Run `step` on every job that hasn't failed yet, recording new failures."""
+    for job in jobs:
+        if "error" in job:
+            continue
+        try:
+            step(job)
+        except Exception as e:
+            logging.exception(f"{stage} failed for {job['audio']}")
+            with job["lock"]:
+                # keep the first failure when stages run side by side
+                if "error" in job:
+                    continue
+                job["stage"] = stage
+                job["error"] = f"{type(e).__name__}: {e}"
+                job.pop("waveform", None)
+            if os.path.exists(job["temp_path"]):
+                cleanup(job["temp_path"])
+
+
+def process_batch(
+    models: ModelManager,
+    audio_paths,
+    temp_path: str = None,
+    cache: StageCache = None,
+    profiler: StageProfiler = None,
+    group_size: int = 32,
+    on_file_done=None,
+    **options,
+):
+    """
+    Run the whole pipeline on many audio files, one stage at a time.
+
+    Every stage runs over a group of `group_size` files before the next stage
+    starts, so each model is loaded once per group instead of once per file. The
+    transcripts of a file are written as soon as its last stage is done and
+    `on_file_done(audio_path, result)` is called. A file that fails is skipped by
+    the remaining stages without stopping the rest of the batch. Every file gets
+    its own scratch directory under `temp_path`.
+
+    Returns a dict mapping each audio path to its result, either
+    {"status": "ok", "outputs": [...]} or {"status": "error", "stage", "error"}.
+    """
+    if temp_path is None:
+        temp_path = create_temp_dir(models.temp_root)
+    options = pipeline_options(**options)
+    steps = _job_steps(models, cache or StageCache(), options, profiler=profiler)
+
+    def report(job):
+        if "error" in job:
+            results[job["audio"]] = {
+                "status": "error",
+                "stage": job["stage"],
+                "error": job["error"],
+            }
+        else:
+            results[job["audio"]] = {
+                "status": "ok",
+                "outputs": job["outputs"],
+                "alignment": job["alignment_paths"],
+            }
+        if on_file_done is not None:
+            on_file_done(job["audio"], results[job["audio"]])
+
+    results = {}
+    for group_start in range(0, len(audio_paths), group_size):
+        jobs = [
+            _new_job(audio_path, os.path.join(temp_path, str(idx)))
+            for idx, audio_path in enumerate(
+                audio_paths[group_start : group_start + group_size], start=group_start
+            )
+        ]
+        for stage, kinds, step in steps[:-1]:
+            with models.hold(*kinds):
+                _run_stage(jobs, stage, step)
+
+        # report every file as soon as its transcripts are written
+        stage, kinds, step = steps[-1]
+        with models.hold(*kinds):
+            for job in jobs:
+                _run_stage([job], stage, step)
+                report(job)
+
+    if os.path.exists(temp_path):
+        cleanup(temp_path)
+    return results
+
+
+# the stages each stage hands a file on to, post-processing waits for both branches
+PIPELINE_GRAPH = {
+    "separation": ("transcription", "diarization"),
+    "transcription": ("alignment",),
+    "alignment": ("postprocessing",),
+    "diarization": ("postprocessing",),
+    "postprocessing": (),
+}
+
+
+def process_pipelined(
+    models: ModelManager,
+    audio_paths,
+    temp_path: str = None,
+    cache: StageCache = None,
+    profiler: StageProfiler = None,
+    workers: dict = None,
+    queue_size: int = 2,
+    diarize_fn=None,
+    on_file_done=None,
+    **options,
+):
+    """
+    Run the whole pipeline on many audio files with the stages working on different
+    files at the same time.
+
+    Every stage has its own pool of `workers[stage]` threads, one by default, fed by
+    a queue holding at most `queue_size` files, so a slow stage holds back the
+    stages before it instead of piling up decoded audio. Transcription and
+    diarization both start from the separated audio and run side by side,
+    post-processing waits for both. The workers of a stage past the first load
+    their own copy of the stage's model. `diarize_fn` replaces `diarize`, e.g. to
+    run NeMo in another process.
+
+    Returns the same dict as `process_batch`, the result of every file that
+    succeeded also holds its audio duration in seconds.
+    """
+    if temp_path is None:
+        temp_path = create_temp_dir(models.temp_root)
+    options = pipeline_options(**options)
+    cache = cache or StageCache()
+    workers = {stage: max(1, (workers or {}).get(stage, 1)) for stage in PIPELINE_GRAPH}
+
+    # the n-th worker of every stage uses the n-th manager
+    managers = [models] + [
+        ModelManager(models.device, keep=MODEL_KINDS, temp_root=models.temp_root)
+        for _ in range(max(workers.values()) - 1)
+    ]
+    steps = [
+        {
+            stage: step
+            for stage, _, step in _job_steps(
+                manager, cache, options, diarize_fn, profiler
+            )
+        }
+        for manager in managers
+    ]
+    queues = {stage: queue.Queue(queue_size) for stage in PIPELINE_GRAPH}
+    finished = queue.Queue()
+    results = {}
+    results_lock = threading.Lock()
+
+    def report(job):
+        if "error" in job:
+            result = {"status": "error", "stage": job["stage"], "error": job["error"]}
+        else:
+            result = {
+                "status": "ok",
+                "outputs": job["outputs"],
+                "duration": _job_duration(job),
+                "alignment": job["alignment_paths"],
+            }
+        with results_lock:
+            results[job["audio"]] = result
+        if on_file_done is not None:
+            on_file_done(job["audio"], result)
+
+    def forward(job, stage):
+        for next_stage in PIPELINE_GRAPH[stage]:
+            if next_stage == "postprocessing":
+                with job["lock"]:
+                    job["branches"] -= 1
+                    if job["branches"]:
+                        continue
+            queues[next_stage].put(job)
+
+    def work(stage, step):
+        while True:
+            job = queues[stage].get()
+            if job is None:
+                return
+            # failed files still go down the graph so both branches are joined
+            _run_stage([job], stage, step)
+            if stage == "postprocessing":
+                report(job)
+                finished.put(job)
+            else:
+                forward(job, stage)
+
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(stage, steps[idx][stage]),
+            name=f"{stage}-{idx}",
+            daemon=True,
+        )
+        for stage, count in workers.items()
+        for idx in range(count)
+    ]
+    with models.hold(*MODEL_KINDS):
+        for thread in threads:
+            thread.start()
+        for idx, audio_path in enumerate(audio_paths):
+            job = _new_job(audio_path, os.path.join(temp_path, str(idx)))
+            job["branches"] = 2
+            queues["separation"].put(job)
+        for _ in range(len(audio_paths)):
+            finished.get()
+
+        for stage, count in workers.items():
+            for _ in range(count):
+                queues[stage].put(None)
+        for thread in threads:
+            thread.join()
+        for manager in managers[1:]:
+            manager.close()
+
+    if os.path.exists(temp_path):
+        cleanup(temp_path)
+    return results
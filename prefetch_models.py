@@ -0,0 +1,44 @@
+import argparse
+import logging
+import os
+
+from model_store import MODEL_STORE_ENV, prefetch
+
+parser = argparse.ArgumentParser(
+    description="Downloads every model and config the pipeline uses into a model "
+    "store and checks that each loads from it offline"
+)
+parser.add_argument(
+    "--model-store",
+    dest="model_store",
+    default=os.environ.get(MODEL_STORE_ENV),
+    help=f"directory to fill, defaults to ${MODEL_STORE_ENV}",
+)
+parser.add_argument(
+    "--whisper-model",
+    dest="whisper_models",
+    nargs="+",
+    default=["medium.en"],
+    help="names of the Whisper models to store",
+)
+parser.add_argument(
+    "--device",
+    default="cpu",
+    help="device the models are loaded on to verify them",
+)
+args = parser.parse_args()
+if args.model_store is None:
+    parser.error(f"--model-store or ${MODEL_STORE_ENV} is required")
+
+logging.basicConfig(level=logging.INFO)
+
+manifest = prefetch(args.model_store, args.whisper_models, args.device)
+
+saved = 0.0
+for name, artifact in manifest["artifacts"].items():
+    print(
+        f"{name:>24} {artifact['cold_s']:>8.1f}s cold {artifact['warm_s']:>8.1f}s "
+        "from the store"
+    )
+    saved += artifact["saved_s"]
+print(f"The model store {args.model_store} saves about {saved:.1f}s of cold start")
@@ -0,0 +1,183 @@
+import time
+
+import numpy as np
+
+from helpers import torch_threads
+
+PUNCT_MODEL_NAME = "kredor/punctuate-all"
+
+PUNCT_BACKENDS = ("torch", "int8", "onnx")
+
+
+class PunctuationRestorer:
+    """
+    Token classification punctuation model, a batched drop-in for
+    `deepmultilingualpunctuation.PunctuationModel.predict`.
+
+    The words are split into the same overlapping chunks, but `batch_size` chunks
+    go through the model in one forward pass. `backend` is "torch", "int8" for
+    torch with dynamically quantized linear layers, or "onnx" for ONNX Runtime,
+    the last two run on the CPU. `num_threads` sets the intra-op threads of the
+    backend, defaults to the backend's choice.
+    """
+
+    def __init__(
+        self,
+        model_name: str = PUNCT_MODEL_NAME,
+        device: str = "cpu",
+        backend: str = "torch",
+        num_threads: int = None,
+    ):
+        import torch
+        from transformers import AutoModelForTokenClassification, AutoTokenizer
+
+        if backend not in PUNCT_BACKENDS:
+            raise ValueError(
+                f"Unknown punctuation backend {backend}, choose from {', '.join(PUNCT_BACKENDS)}"
+            )
+        self.backend = backend
+        self.num_threads = num_threads
+        self.device = device if backend == "torch" else "cpu"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        if backend == "onnx":
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForTokenClassification
+
+            session_options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                session_options.intra_op_num_threads = num_threads
+            self.model = ORTModelForTokenClassification.from_pretrained(
+                model_name, export=True, session_options=session_options
+            )
+        else:
+            model = AutoModelForTokenClassification.from_pretrained(model_name).eval()
+            if backend == "int8":
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            self.model = model.to(self.device)
+        self.id2label = self.model.config.id2label
+
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def predict(self, words, chunk_size=230, overlap=5, batch_size=8):
+        """Label every word with the punctuation following it, as [word, label, score]."""
+        return self.predict_many([words], chunk_size, overlap, batch_size)[0]
+
+    def predict_many(self, word_lists, chunk_size=230, overlap=5, batch_size=8):
+        """`predict` for several word lists, their chunks are batched together."""
+        # (word list, chunk, number of its words that are used)
+        planned = []
+        for list_idx, words in enumerate(word_lists):
+            list_overlap = overlap if len(words) > chunk_size else 0
+            chunks = [
+                words[i : i + chunk_size]
+                for i in range(0, len(words), chunk_size - list_overlap)
+            ]
+            # a last chunk within the overlap is already covered by the one before it
+            if chunks and len(chunks[-1]) <= list_overlap:
+                chunks.pop()
+            for chunk_idx, chunk in enumerate(chunks):
+                # the last chunk is used completely
+                used = len(chunk) - (list_overlap if chunk_idx < len(chunks) - 1 else 0)
+                planned.append((list_idx, chunk, used))
+
+        tagged_lists = [[] for _ in word_lists]
+        for batch_start in range(0, len(planned), batch_size):
+            batch = planned[batch_start : batch_start + batch_size]
+            results = self._classify([" ".join(chunk) for _, chunk, _ in batch])
+            for (list_idx, chunk, used), result in zip(batch, results):
+                tagged_lists[list_idx].extend(_label_words(chunk[:used], result))
+
+        for words, tagged_words in zip(word_lists, tagged_lists):
+            assert len(tagged_words) == len(words)
+        return tagged_lists
+
+    def _classify(self, texts):
+        """[(end offset, label, score)] of every token of every text."""
+        import torch
+
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            return_offsets_mapping=True,
+            return_special_tokens_mask=True,
+            return_tensors="pt",
+        )
+        offsets = inputs.pop("offset_mapping").numpy()
+        special = inputs.pop("special_tokens_mask").numpy().astype(bool)
+        mask = inputs["attention_mask"].numpy().astype(bool)
+
+        started = time.perf_counter()
+        # ONNX Runtime has its own threads, set by the session options
+        num_threads = self.num_threads if self.backend != "onnx" else None
+        with torch_threads(num_threads), torch.inference_mode():
+            logits = self.model(**inputs.to(self.device)).logits
+        self.seconds += time.perf_counter() - started
+        self.tokens += int(mask.sum())
+
+        logits = logits.float().cpu().numpy()
+        # same scores as the token classification pipeline
+        scores = np.exp(logits - logits.max(-1, keepdims=True))
+        scores /= scores.sum(-1, keepdims=True)
+        labels = scores.argmax(-1)
+
+        results = []
+        for (
+            text,
+            text_offsets,
+            text_special,
+            text_mask,
+            text_labels,
+            text_scores,
+        ) in zip(texts, offsets, special, mask, labels, scores):
+            result = [
+                (int(end), self.id2label[label], float(token_scores[label]))
+                for (_, end), is_special, is_token, label, token_scores in zip(
+                    text_offsets, text_special, text_mask, text_labels, text_scores
+                )
+                # the pipeline drops the tokens labeled "O"
+                if is_token and not is_special and self.id2label[label] != "O"
+            ]
+            assert len(text) == result[-1][0], "chunk size too large, text got clipped"
+            results.append(result)
+        return results
+
+
+def _label_words(words, result):
+    tagged_words = []
+    char_index, result_index = 0, 0
+    label, score = 0, 0.0
+    for word in words:
+        char_index += len(word) + 1
+        # if any subtoken of a word is labeled as sentence end the whole word is
+        label = 0
+        while result_index < len(result) and char_index > result[result_index][0]:
+            _, label, score = result[result_index]
+            result_index += 1
+        tagged_words.append([word, label, score])
+    return tagged_words
+
+
+def speaker_change_spans(speakers, radius: int, context: int):
+    """
+    The spans of words within `radius` words of a speaker change, as (start, end,
+    core start, core end) index ranges. The core is what's within `radius`, the
+    span adds `context` words on each side of it for the model to look at. Cores
+    closer than twice the context are merged.
+    """
+    spans = []
+    for k in range(len(speakers) - 1):
+        if speakers[k] == speakers[k + 1]:
+            continue
+        core_start, core_end = max(0, k - radius), min(len(speakers), k + radius + 1)
+        if spans and core_start - spans[-1][1] <= 2 * context:
+            spans[-1][1] = max(spans[-1][1], core_end)
+        else:
+            spans.append([core_start, core_end])
+    return [
+        (max(0, start - context), min(len(speakers), end + context), start, end)
+        for start, end in spans
+    ]
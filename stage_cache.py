@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+# bump whenever a stage changes what it computes so that stale entries are ignored
+CACHE_VERSION = 2
+
+
+class StageCache:
+    """
+    On-disk cache of the pipeline stage outputs.
+
+    Entries are keyed by the hash of the input audio, the stage name and the
+    parameters the stage output depends on, so a re-run only recomputes the stages
+    whose inputs changed. When the cache grows past `max_size` bytes the least
+    recently used entries are evicted. A cache without a directory is disabled and
+    always recomputes.
+    """
+
+    def __init__(self, cache_dir: str = None, max_size: int = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._hashes = {}
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.cache_dir is not None
+
+    def file_hash(self, path: str):
+        """sha256 of a file's content, memoized while the file is unchanged."""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._hashes:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            self._hashes[memo_key] = digest.hexdigest()
+        return self._hashes[memo_key]
+
+    def key(self, stage: str, audio_hash: str, params: dict):
+        description = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "stage": stage,
+                "audio": audio_hash,
+                "params": params,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached value of `key`, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logging.warning(f"Ignoring unreadable cache entry {path}")
+            return None
+        # refresh the entry's position in the LRU order
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value):
+        if not self.enabled:
+            return
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._evict()
+
+    def cached(self, stage: str, audio_hash: str, params: dict, compute):
+        """Return the cached output of `stage`, running `compute` on a miss."""
+        key = self.key(stage, audio_hash, params)
+        value = self.get(key)
+        if value is not None:
+            logging.info(f"Using cached {stage} output")
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def size(self):
+        return sum(size for _, _, size in self._entries())
+
+    def _entry_path(self, key: str):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def _entries(self):
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,191 @@
+import cProfile
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# the measured steps of the pipeline, in the order they run
+PROFILED_STAGES = (
+    "decode",
+    "separation",
+    "vad",
+    "transcription",
+    "emissions",
+    "forced_alignment",
+    "diarization",
+    "speaker_mapping",
+    "punctuation",
+    "realignment",
+    "sentence_mapping",
+    "writing",
+)
+
+PROFILERS = ("cprofile", "torch")
+
+
+class StageProfiler:
+    """
+    Measures the wall time, CPU time, peak RSS and peak VRAM of every pipeline
+    stage a file goes through, and the real-time factor of each for the file's
+    duration.
+
+    The measurements are kept in the job dict and written as a JSON report next
+    to the transcripts. `profile_stage` additionally records a cProfile or torch
+    profiler trace, chosen by `profiler`, of that stage. The CPU time and peak
+    memory are those of the whole process, when stages run side by side they are
+    an upper bound of each stage's own. A profiler without a report and a profiled
+    stage is disabled and measures nothing.
+    """
+
+    def __init__(
+        self, report: bool = False, profile_stage: str = None, profiler="cprofile"
+    ):
+        if profile_stage is not None and profile_stage not in PROFILED_STAGES:
+            raise ValueError(
+                f"Unknown stage {profile_stage}, choose from {', '.join(PROFILED_STAGES)}"
+            )
+        if profiler not in PROFILERS:
+            raise ValueError(
+                f"Unknown profiler {profiler}, choose from {', '.join(PROFILERS)}"
+            )
+        self.report = report
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self._active = 0
+        self._lock = threading.Lock()
+        # a single stage is traced at a time, python allows one profiler per process
+        self._tracing = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.report or self.profile_stage is not None
+
+    @contextmanager
+    def measure(self, job: dict, stage: str):
+        """Measure the block as `stage` of `job`."""
+        if not self.enabled:
+            yield
+            return
+
+        import torch
+
+        with self._lock:
+            # peaks are only reset when no other stage is being measured
+            if not self._active:
+                _reset_peak_rss()
+                if torch.cuda.is_available():
+                    torch.cuda.reset_peak_memory_stats()
+            self._active += 1
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            with self._trace(job, stage):
+                yield
+        finally:
+            wall, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+            with self._lock:
+                self._active -= 1
+            measurement = {"wall_s": round(wall, 3), "cpu_s": round(cpu, 3)}
+            peak_rss = _peak_rss()
+            if peak_rss is not None:
+                measurement["peak_rss_mb"] = round(peak_rss / 1024**2, 1)
+            if torch.cuda.is_available():
+                measurement["peak_vram_mb"] = round(
+                    torch.cuda.max_memory_allocated() / 1024**2, 1
+                )
+            # not under the job lock, decoding is measured while holding it
+            job.setdefault("stages", {})[stage] = measurement
+
+    @contextmanager
+    def _trace(self, job: dict, stage: str):
+        if stage != self.profile_stage:
+            yield
+            return
+        if not self._tracing.acquire(blocking=False):
+            logging.warning(
+                f"Not profiling {stage} of {job['audio']}, another file is being profiled"
+            )
+            yield
+            return
+
+        trace_base = f"{job['output_base']}.{stage}"
+        try:
+            if self.profiler == "torch":
+                import torch
+                from torch.profiler import ProfilerActivity, profile
+
+                activities = [ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(ProfilerActivity.CUDA)
+                with profile(
+                    activities=activities, record_shapes=True, profile_memory=True
+                ) as trace:
+                    yield
+                path = f"{trace_base}.trace.json"
+                trace.export_chrome_trace(path)
+            else:
+                trace = cProfile.Profile()
+                trace.enable()
+                try:
+                    yield
+                finally:
+                    trace.disable()
+                path = f"{trace_base}.prof"
+                trace.dump_stats(path)
+            logging.info(f"Wrote the {self.profiler} trace of {stage} to {path}")
+        finally:
+            self._tracing.release()
+
+    def write_report(self, job: dict, duration: float, device: str):
+        """Write the measurements of `job` as JSON next to its transcripts."""
+        stages = {}
+        for stage in PROFILED_STAGES:
+            if stage not in job.get("stages", {}):
+                continue
+            stages[stage] = dict(job["stages"][stage])
+            if duration:
+                stages[stage]["rtf"] = round(stages[stage]["wall_s"] / duration, 4)
+        wall = time.perf_counter() - job["created"]
+        report = {
+            "audio": job["audio"],
+            "duration_s": duration,
+            "device": device,
+            "wall_s": round(wall, 3),
+            "rtf": round(wall / duration, 4) if duration else None,
+            "stages": stages,
+        }
+        if "alignment_paths" in job:
+            # how many segments took their word timestamps from Whisper or CTC
+            report["alignment"] = job["alignment_paths"]
+        path = f"{job['output_base']}.stages.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        return path
+
+
+def _reset_peak_rss():
+    # linux resets the peak resident set size when "5" is written to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    """Peak resident set size of the process in bytes, None if unknown."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
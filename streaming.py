@@ -0,0 +1,282 @@
+import struct
+import time
+
+import numpy as np
+
+from pipeline import SAMPLE_RATE, ModelManager, align, transcribe
+
+SPEAKER_MODEL_NAME = "titanet_large"
+
+
+def read_windows(
+    stream,
+    window: float,
+    follow: bool = False,
+    poll_interval: float = 0.2,
+    idle_timeout: float = 10.0,
+):
+    """
+    Read 16kHz mono 16-bit PCM from a binary `stream` in `window` second pieces.
+
+    Yields the samples of every piece as float32 with the time it was complete, the
+    last piece may be shorter. A WAV header at the start of the stream is skipped.
+    With `follow` the stream is a file that is still being written, its end is
+    polled every `poll_interval` seconds until nothing was added for
+    `idle_timeout` seconds.
+    """
+
+    def read(size):
+        data, idle_since = b"", time.monotonic()
+        while len(data) < size:
+            chunk = stream.read(size - len(data))
+            if chunk:
+                data += chunk
+                idle_since = time.monotonic()
+            elif follow and time.monotonic() - idle_since < idle_timeout:
+                time.sleep(poll_interval)
+            else:
+                break
+        return data
+
+    pending = _skip_wav_header(read)
+    window_bytes = int(window * SAMPLE_RATE) * 2
+    while True:
+        data = pending + read(window_bytes - len(pending))
+        pending = b""
+        # an odd trailing byte is half a sample
+        data = data[: len(data) // 2 * 2]
+        if not data:
+            return
+        yield np.frombuffer(data, "<i2").astype(np.float32) / 32768, time.time()
+        if len(data) < window_bytes:
+            return
+
+
+def _skip_wav_header(read):
+    """Consume a WAV header if there is one, returns the bytes read that aren't."""
+    head = read(12)
+    if head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return head
+    while True:
+        chunk_header = read(8)
+        if len(chunk_header) < 8:
+            return b""
+        chunk_id, chunk_size = (
+            chunk_header[:4],
+            struct.unpack("<I", chunk_header[4:])[0],
+        )
+        if chunk_id == b"data":
+            return b""
+        chunk = read(chunk_size + chunk_size % 2)
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate = struct.unpack("<HHI", chunk[:8])
+            bits = struct.unpack("<H", chunk[14:16])[0]
+            if (audio_format, channels, sample_rate, bits) != (1, 1, SAMPLE_RATE, 16):
+                raise ValueError(
+                    f"Streaming needs {SAMPLE_RATE}Hz mono 16-bit PCM, convert it with "
+                    f"ffmpeg -i INPUT -f s16le -ac 1 -ar {SAMPLE_RATE} -"
+                )
+
+
+class SpeakerTracker:
+    """
+    Running speaker centroids that keep the labels consistent across windows.
+
+    An embedding is assigned to the speaker whose centroid is the most similar,
+    or to a new speaker when no centroid's cosine similarity reaches `threshold`
+    and there are fewer than `max_speakers`. The centroid of a speaker is the
+    mean direction of every embedding assigned to it.
+    """
+
+    def __init__(self, threshold: float = 0.6, max_speakers: int = None):
+        self.threshold = threshold
+        self.max_speakers = max_speakers
+        self.sums = []
+
+    def assign(self, embedding):
+        embedding = embedding / (np.linalg.norm(embedding) + 1e-8)
+        if self.sums:
+            sums = np.stack(self.sums)
+            similarities = sums @ embedding / np.linalg.norm(sums, axis=1)
+            best = int(similarities.argmax())
+            if similarities[best] >= self.threshold or (
+                self.max_speakers is not None and len(self.sums) >= self.max_speakers
+            ):
+                self.sums[best] = self.sums[best] + embedding
+                return best
+        self.sums.append(embedding)
+        return len(self.sums) - 1
+
+
+def speech_segments(words, max_length: float = 3.0, max_gap: float = 0.5):
+    """
+    Group consecutive words into segments of at most `max_length` seconds, a pause
+    longer than `max_gap` seconds starts a new one. Returns [start, end, word
+    indices] of every segment.
+    """
+    segments = []
+    for idx, word in enumerate(words):
+        if (
+            segments
+            and word["start"] - segments[-1][1] <= max_gap
+            and word["end"] - segments[-1][0] <= max_length
+        ):
+            segments[-1][1] = word["end"]
+            segments[-1][2].append(idx)
+        else:
+            segments.append([word["start"], word["end"], [idx]])
+    return segments
+
+
+def load_speaker_model(models: ModelManager):
+    from nemo.collections.asr.models import EncDecSpeakerLabelModel
+
+    return models.get(
+        "speaker_embedding",
+        SPEAKER_MODEL_NAME,
+        lambda: EncDecSpeakerLabelModel.from_pretrained(
+            SPEAKER_MODEL_NAME, map_location=models.device
+        ).eval(),
+    )
+
+
+def embed_segments(speaker_model, audio, spans):
+    """TitaNet embeddings of the (start, end) second spans of `audio`, in one batch."""
+    import torch
+
+    clips = [
+        audio[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)] for start, end in spans
+    ]
+    lengths = [len(clip) for clip in clips]
+    signal = np.zeros((len(clips), max(lengths)), dtype=np.float32)
+    for row, clip in zip(signal, clips):
+        row[: len(clip)] = clip
+    device = next(speaker_model.parameters()).device
+    with torch.inference_mode():
+        _, embeddings = speaker_model.forward(
+            input_signal=torch.from_numpy(signal).to(device),
+            input_signal_length=torch.tensor(lengths, device=device),
+        )
+    return embeddings.float().cpu().numpy()
+
+
+class StreamingTranscriber:
+    """
+    Transcribes and labels the speakers of consecutive windows of a live stream.
+
+    Every window is transcribed with Whisper and force aligned, its words are
+    grouped into short speech segments and each segment gets the speaker of its
+    TitaNet embedding from a `SpeakerTracker`. The last word of a window may be
+    cut off, so it is held back and its audio is transcribed again with the next
+    window, at most `max_carry` seconds of audio are carried over. The language
+    detected in the first window with speech is used for the rest of the stream.
+    """
+
+    def __init__(
+        self,
+        models: ModelManager,
+        language: str = None,
+        model_name: str = "medium.en",
+        batch_size: int = 8,
+        suppress_numerals: bool = False,
+        tracker: SpeakerTracker = None,
+        min_segment_length: float = 0.5,
+        max_carry: float = 3.0,
+    ):
+        self.models = models
+        self.language = language
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.suppress_numerals = suppress_numerals
+        self.tracker = tracker or SpeakerTracker()
+        self.min_segment_length = min_segment_length
+        self.max_carry = max_carry
+        # stream time of the first sample of `carry`
+        self.offset = 0.0
+        self.carry = np.zeros(0, dtype=np.float32)
+        self.last_speaker = 0
+
+    def process(self, window, final: bool = False):
+        """
+        Transcribe the next window of the stream, returns its cues as dicts with
+        the speaker, start_time and end_time in ms and the text, like the
+        sentences of `Sentences.to_dicts`.
+        """
+        audio = np.concatenate([self.carry, window])
+        offset = self.offset
+        words = self._words(audio)
+
+        self.offset, self.carry = offset + len(audio) / SAMPLE_RATE, audio[:0]
+        if words and not final:
+            cut = words[-1]["start"]
+            if len(audio) / SAMPLE_RATE - cut <= self.max_carry:
+                words.pop()
+                self.offset = offset + cut
+                self.carry = audio[int(cut * SAMPLE_RATE) :]
+        if not words:
+            return []
+
+        speakers = self._speakers(audio, words)
+        cues = []
+        for word, speaker in zip(words, speakers):
+            start_time = int((offset + word["start"]) * 1000)
+            end_time = int((offset + word["end"]) * 1000)
+            if cues and cues[-1]["speaker"] == f"Speaker {speaker}":
+                cues[-1]["end_time"] = end_time
+                cues[-1]["text"] += " " + word["text"]
+            else:
+                cues.append(
+                    {
+                        "speaker": f"Speaker {speaker}",
+                        "start_time": start_time,
+                        "end_time": end_time,
+                        "text": word["text"],
+                    }
+                )
+        return cues
+
+    def flush(self):
+        """Transcribe the audio held back from the last window, once the stream ended."""
+        return self.process(np.zeros(0, dtype=np.float32), final=True)
+
+    def _words(self, audio):
+        if not len(audio):
+            return []
+        whisper_results, language, _ = transcribe(
+            self.models,
+            audio,
+            self.language,
+            self.batch_size,
+            self.model_name,
+            self.suppress_numerals,
+        )
+        if not "".join(segment["text"] for segment in whisper_results).strip():
+            return []
+        self.language = language
+        return align(self.models, audio, whisper_results, language, self.batch_size)
+
+    def _speakers(self, audio, words):
+        """The speaker of every word, from the embedding of its speech segment."""
+        segments = speech_segments(words)
+        embedded = [
+            segment
+            for segment in segments
+            if segment[1] - segment[0] >= self.min_segment_length
+        ]
+        if embedded:
+            embeddings = embed_segments(
+                load_speaker_model(self.models),
+                audio,
+                [(start, end) for start, end, _ in embedded],
+            )
+            for segment, embedding in zip(embedded, embeddings):
+                segment.append(self.tracker.assign(embedding))
+
+        speakers = [None] * len(words)
+        for segment in segments:
+            if len(segment) == 4:
+                self.last_speaker = segment[3]
+            # segments too short to embed reliably continue the previous speaker
+            for idx in segment[2]:
+                speakers[idx] = self.last_speaker
+        return speakers
@@ -0,0 +1,142 @@
+"""
+Columnar transcripts for the post-processing, from the speaker mapping to the
+writers. The times and speakers are numpy arrays and the words are indices into
+a table of distinct words, instead of a dict per word and per sentence. The
+dicts the writers and callers used before are built by `to_dicts`, only where
+they leave the pipeline.
+"""
+
+import numpy as np
+
+
+class Transcript:
+    """
+    The words of a transcript with their start and end times in ms and their
+    speaker ids.
+
+    Each distinct word is kept once in `vocabulary`, `word_ids` indexes it. A
+    word changed with `set_word` is interned again, the other words sharing its
+    text are left as they are.
+    """
+
+    __slots__ = ("start_time", "end_time", "speaker", "word_ids", "vocabulary", "_ids")
+
+    def __init__(self, words, start_time, end_time, speaker):
+        self.vocabulary, self._ids = [], {}
+        self.word_ids = np.fromiter(
+            (self._intern(word) for word in words), dtype=np.int32, count=len(words)
+        )
+        self.start_time = np.asarray(start_time, dtype=np.int64)
+        self.end_time = np.asarray(end_time, dtype=np.int64)
+        self.speaker = np.asarray(speaker, dtype=np.int64)
+
+    @classmethod
+    def from_dicts(cls, word_speaker_mapping):
+        """From the word, start_time, end_time and speaker dicts."""
+        return cls(
+            [word_dict["word"] for word_dict in word_speaker_mapping],
+            [word_dict["start_time"] for word_dict in word_speaker_mapping],
+            [word_dict["end_time"] for word_dict in word_speaker_mapping],
+            [word_dict["speaker"] for word_dict in word_speaker_mapping],
+        )
+
+    def _intern(self, word: str):
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = self._ids[word] = len(self.vocabulary)
+            self.vocabulary.append(word)
+        return word_id
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def word(self, index: int):
+        return self.vocabulary[self.word_ids[index]]
+
+    def words(self, start: int = 0, end: int = None):
+        """The text of the words from `start` to `end`."""
+        vocabulary = self.vocabulary
+        return [vocabulary[word_id] for word_id in self.word_ids[start:end].tolist()]
+
+    def set_word(self, index: int, word: str):
+        self.word_ids[index] = self._intern(word)
+
+    def vocabulary_mask(self, predicate):
+        """Whether `predicate` holds for each word, evaluated once per distinct word."""
+        mask = np.fromiter(
+            (predicate(word) for word in self.vocabulary),
+            dtype=bool,
+            count=len(self.vocabulary),
+        )
+        return mask[self.word_ids]
+
+    def to_dicts(self):
+        """The words as word, start_time, end_time and speaker dicts."""
+        return [
+            {"word": word, "start_time": s, "end_time": e, "speaker": sp}
+            for word, s, e, sp in zip(
+                self.words(),
+                self.start_time.tolist(),
+                self.end_time.tolist(),
+                self.speaker.tolist(),
+            )
+        ]
+
+
+class Sentences:
+    """
+    The sentences of a `Transcript`, each the words from `word_start` to
+    `word_end` with its start and end times in ms and its speaker id.
+
+    The text of a sentence is joined from its words when asked for, each word
+    followed by a space.
+    """
+
+    __slots__ = (
+        "transcript",
+        "start_time",
+        "end_time",
+        "speaker",
+        "word_start",
+        "word_end",
+    )
+
+    def __init__(
+        self,
+        transcript: Transcript,
+        start_time,
+        end_time,
+        speaker,
+        word_start,
+        word_end,
+    ):
+        self.transcript = transcript
+        self.start_time = np.asarray(start_time, dtype=np.int64)
+        self.end_time = np.asarray(end_time, dtype=np.int64)
+        self.speaker = np.asarray(speaker, dtype=np.int64)
+        self.word_start = np.asarray(word_start, dtype=np.int64)
+        self.word_end = np.asarray(word_end, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.speaker)
+
+    def texts(self):
+        words = self.transcript.words()
+        for start, end in zip(self.word_start.tolist(), self.word_end.tolist()):
+            yield "".join(word + " " for word in words[start:end])
+
+    def rows(self):
+        """(speaker label, start_time, end_time, text) of every sentence."""
+        return zip(
+            (f"Speaker {speaker}" for speaker in self.speaker.tolist()),
+            self.start_time.tolist(),
+            self.end_time.tolist(),
+            self.texts(),
+        )
+
+    def to_dicts(self):
+        """The sentences as speaker, start_time, end_time and text dicts."""
+        return [
+            {"speaker": speaker, "start_time": s, "end_time": e, "text": text}
+            for speaker, s, e, text in self.rows()
+        ]
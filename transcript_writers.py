@@ -0,0 +1,161 @@
+import argparse
+import gzip
+import html
+import json
+import os
+from contextlib import ExitStack
+
+from helpers import format_timestamp
+from transcript import Sentences, Transcript
+
+OUTPUT_FORMATS = ("txt", "srt", "vtt", "json", "jsonl", "rttm")
+
+# the formats written when none are selected
+DEFAULT_OUTPUT_FORMATS = ("txt", "srt")
+
+# txt and srt keep the BOM they always had, some subtitle players rely on it
+ENCODINGS = {"txt": "utf-8-sig", "srt": "utf-8-sig"}
+
+BUFFER_SIZE = 1 << 20
+
+
+def parse_output_formats(value: str):
+    formats = [fmt.strip().lower() for fmt in value.split(",") if fmt.strip()]
+    if formats == ["all"]:
+        return list(OUTPUT_FORMATS)
+    for fmt in formats:
+        if fmt not in OUTPUT_FORMATS:
+            raise argparse.ArgumentTypeError(
+                f"unknown output format '{fmt}', choose from {', '.join(OUTPUT_FORMATS)}"
+            )
+    if not formats:
+        raise argparse.ArgumentTypeError("at least one output format is required")
+    return formats
+
+
+def open_output(path: str, fmt: str, compress: bool = False):
+    encoding = ENCODINGS.get(fmt, "utf-8")
+    if compress:
+        return gzip.open(path, "wt", encoding=encoding)
+    return open(path, "w", encoding=encoding, buffering=BUFFER_SIZE)
+
+
+def output_paths(output_base: str, formats=DEFAULT_OUTPUT_FORMATS, compress=False):
+    suffix = ".gz" if compress else ""
+    return {fmt: f"{output_base}.{fmt}{suffix}" for fmt in formats}
+
+
+def srt_cue(index: int, speaker: str, start_time: int, end_time: int, text: str):
+    start = format_timestamp(start_time, always_include_hours=True, decimal_marker=",")
+    end = format_timestamp(end_time, always_include_hours=True, decimal_marker=",")
+    text = text.strip().replace("-->", "->")
+    return f"{index}\n{start} --> {end}\n{speaker}: {text}\n\n"
+
+
+def vtt_cue(speaker: str, start_time: int, end_time: int, text: str):
+    start = format_timestamp(start_time, always_include_hours=True)
+    end = format_timestamp(end_time, always_include_hours=True)
+    # &, < and > start escapes and tags in a cue, escaping them breaks up "-->" too
+    text = html.escape(text.strip(), quote=False)
+    return f"{start} --> {end}\n<v {html.escape(speaker, quote=False)}>{text}\n\n"
+
+
+def rttm_line(file_id: str, speaker: str, start_time: int, end_time: int):
+    # spaces separate the RTTM fields
+    label = speaker.replace(" ", "_")
+    return (
+        f"SPEAKER {file_id} 1 {start_time / 1000:.3f} "
+        f"{(end_time - start_time) / 1000:.3f} <NA> <NA> {label} <NA> <NA>\n"
+    )
+
+
+def word_record(word: str, start_time: int, end_time: int, speaker: int):
+    return {
+        "word": word,
+        "start": start_time / 1000,
+        "end": end_time / 1000,
+        "speaker": f"Speaker {speaker}",
+    }
+
+
+def write_transcripts(
+    sentences: Sentences,
+    transcript: Transcript,
+    output_base: str,
+    formats=DEFAULT_OUTPUT_FORMATS,
+    compress: bool = False,
+):
+    """
+    Write the transcript in every format of `formats` in a single pass.
+
+    The sentence formats (txt, srt, vtt and rttm) are written while walking the
+    `sentences` once and the word formats (json and jsonl) while walking the
+    words of `transcript` once. Every file is buffered and gzip compressed if
+    `compress` is set. The files are named `output_base` plus the format's
+    extension, their paths are returned in the order of `formats`.
+    """
+    if formats == ["all"]:
+        formats = OUTPUT_FORMATS
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown output formats: {', '.join(unknown)}")
+    paths = output_paths(output_base, formats, compress)
+    file_id = os.path.basename(output_base).replace(" ", "_")
+
+    with ExitStack() as stack:
+        files = {
+            fmt: stack.enter_context(open_output(path, fmt, compress))
+            for fmt, path in paths.items()
+        }
+        txt, srt, vtt, rttm = (files.get(fmt) for fmt in ("txt", "srt", "vtt", "rttm"))
+
+        if vtt is not None:
+            vtt.write("WEBVTT\n\n")
+        previous_speaker, turn = None, None
+        for index, (speaker, start_time, end_time, text) in enumerate(
+            sentences.rows(), start=1
+        ):
+            if txt is not None:
+                # a new paragraph whenever the speaker changes
+                if previous_speaker is None:
+                    txt.write(f"{speaker}: ")
+                elif speaker != previous_speaker:
+                    txt.write(f"\n\n{speaker}: ")
+                txt.write(text + " ")
+            if srt is not None:
+                srt.write(srt_cue(index, speaker, start_time, end_time, text))
+            if vtt is not None:
+                vtt.write(vtt_cue(speaker, start_time, end_time, text))
+            if rttm is not None:
+                # consecutive sentences of a speaker make up one turn
+                if turn is not None and turn[0] == speaker:
+                    turn[2] = end_time
+                else:
+                    if turn is not None:
+                        rttm.write(rttm_line(file_id, *turn))
+                    turn = [speaker, start_time, end_time]
+            previous_speaker = speaker
+        if turn is not None:
+            rttm.write(rttm_line(file_id, *turn))
+
+        json_file, jsonl = files.get("json"), files.get("jsonl")
+        if json_file is not None or jsonl is not None:
+            if json_file is not None:
+                json_file.write("[")
+            for idx, columns in enumerate(
+                zip(
+                    transcript.words(),
+                    transcript.start_time.tolist(),
+                    transcript.end_time.tolist(),
+                    transcript.speaker.tolist(),
+                )
+            ):
+                record = json.dumps(word_record(*columns), ensure_ascii=False)
+                if json_file is not None:
+                    json_file.write(("," if idx else "") + "\n  " + record)
+                if jsonl is not None:
+                    jsonl.write(record + "\n")
+            if json_file is not None:
+                json_file.write("\n]\n")
+
+    return list(paths.values())
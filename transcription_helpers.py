@@ -1,6 +1,3 @@
-import torch
-
-
 def transcribe(
     audio_file: str,
     language: str,
@@ -9,6 +6,7 @@ def transcribe(
     suppress_numerals: bool,
     device: str,
 ):
+    import torch
     from faster_whisper import WhisperModel
 
     from helpers import find_numeral_symbol_tokens, wav2vec2_langs
@@ -49,26 +47,133 @@ def transcribe(
     return whisper_results, info.language
 
 
-def transcribe_batched(
-    audio_file: str,
-    language: str,
-    batch_size: int,
+def load_whisper_model(
     model_name: str,
+    device: str,
     compute_dtype: str,
     suppress_numerals: bool,
-    device: str,
 ):
     import whisperx
 
     # Faster Whisper batched
-    whisper_model = whisperx.load_model(
+    return whisperx.load_model(
         model_name,
         device,
         compute_type=compute_dtype,
         asr_options={"suppress_numerals": suppress_numerals},
     )
-    audio = whisperx.load_audio(audio_file)
-    result = whisper_model.transcribe(audio, language=language, batch_size=batch_size)
-    del whisper_model
-    torch.cuda.empty_cache()
+
+
+def transcribe_batched(
+    audio_file,
+    language: str,
+    batch_size: int,
+    model_name: str,
+    compute_dtype: str,
+    suppress_numerals: bool,
+    device: str,
+    whisper_model=None,
+    speech_scores=None,
+):
+    """
+    Transcribe with batched whisperx inference.
+
+    `audio_file` is either a path or 16kHz mono float32 samples. If `whisper_model`
+    is given it is used as is and left loaded for the caller, otherwise a model is
+    loaded for this call only. `speech_scores` are the output of whisperx's VAD
+    model on the audio, computed beforehand, which then isn't run again.
+    """
+    import whisperx
+
+    owns_model = whisper_model is None
+    if owns_model:
+        whisper_model = load_whisper_model(
+            model_name, device, compute_dtype, suppress_numerals
+        )
+    if isinstance(audio_file, str):
+        audio = whisperx.load_audio(audio_file)
+    else:
+        audio = audio_file
+    own_vad_model = whisper_model.vad_model
+    if speech_scores is not None:
+        whisper_model.vad_model = lambda inputs: speech_scores
+    try:
+        result = whisper_model.transcribe(
+            audio, language=language, batch_size=batch_size
+        )
+    finally:
+        whisper_model.vad_model = own_vad_model
+    if owns_model:
+        import torch
+
+        del whisper_model
+        torch.cuda.empty_cache()
     return result["segments"], result["language"], audio
+
+
+def load_faster_whisper_model(model_name: str, device: str, compute_dtype: str):
+    from faster_whisper import WhisperModel
+
+    # Faster Whisper non-batched
+    return WhisperModel(model_name, device=device, compute_type=compute_dtype)
+
+
+def transcribe_with_word_timestamps(
+    audio,
+    language: str,
+    suppress_numerals: bool,
+    whisper_model,
+    speech_regions=None,
+):
+    """
+    Transcribe with non-batched faster-whisper, predicting the start, end and
+    probability of every word along with the text.
+
+    `audio` is 16kHz mono float32 samples. Returns the segments with their
+    "words", the language and the audio, like `transcribe_batched`. Only the
+    (start, end) second `speech_regions` are transcribed when given, instead of
+    what faster-whisper's own VAD finds.
+    """
+    from helpers import find_numeral_symbol_tokens
+
+    if suppress_numerals:
+        suppress_tokens = find_numeral_symbol_tokens(whisper_model.hf_tokenizer)
+    else:
+        suppress_tokens = [-1]
+
+    if speech_regions is not None:
+        # an empty clip when there is no speech, the language is still detected
+        clip_timestamps = [time for region in speech_regions for time in region]
+        vad_options = {
+            "vad_filter": False,
+            "clip_timestamps": clip_timestamps or [0, 0],
+        }
+    else:
+        vad_options = {"vad_filter": True}
+
+    segments, info = whisper_model.transcribe(
+        audio,
+        language=language,
+        beam_size=5,
+        word_timestamps=True,
+        suppress_tokens=suppress_tokens,
+        **vad_options,
+    )
+    whisper_results = [
+        {
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text,
+            "words": [
+                {
+                    "word": word.word,
+                    "start": word.start,
+                    "end": word.end,
+                    "probability": word.probability,
+                }
+                for word in segment.words or []
+            ],
+        }
+        for segment in segments
+    ]
+    return whisper_results, info.language, audio